@@ -18,8 +18,7 @@ import os
 import sys
 import signal
 import time
-import socket
-import datetime
+import select
 import fcntl
 
 if sys.version[0] == '2':
@@ -33,6 +32,11 @@ COVERAGE = os.environ.get("SYSTEMCTL_COVERAGE", "")
 DEBUG_AFTER = os.environ.get("SYSTEMCTL_DEBUG_AFTER", "") or False
 EXIT_WHEN_NO_MORE_PROCS = os.environ.get("SYSTEMCTL_EXIT_WHEN_NO_MORE_PROCS", "") or False
 EXIT_WHEN_NO_MORE_SERVICES = os.environ.get("SYSTEMCTL_EXIT_WHEN_NO_MORE_SERVICES", "") or False
+USE_STATE_FILE = os.environ.get("SYSTEMCTL_STATE_FILE", "") or False
+SYNC_STATUS_FILES = os.environ.get("SYSTEMCTL_SYNC_STATUS", "") or False
+BOOT_TIME = os.environ.get("SYSTEMCTL_BOOT_TIME", "") # for testing
+LOG_PIPE = os.environ.get("SYSTEMCTL_LOG_PIPE", "") # "stdout" = not into the journal log
+USE_POSIX_SPAWN = os.environ.get("SYSTEMCTL_POSIX_SPAWN", "yes") not in [ "no", "0" ]
 
 FOUND_OK = 0
 FOUND_INACTIVE = 2
@@ -53,6 +57,13 @@ _unit_state = None
 _unit_property = None
 _show_all = False
 _user_mode = False
+_jobs = 1
+_log_lines = None
+_log_since = None
+_boottime = None # resolved once per process
+_credentials = {} # (user, group, xgroups) => resolved while the user database is unchanged
+_credentials_stamp = None # the mtimes of the _credentials_files when it was resolved
+_credentials_files = [ "/etc/passwd", "/etc/group" ]
 
 # common default paths
 _default_target = "multi-user.target"
@@ -86,8 +97,20 @@ DefaultTimeoutStartSec = int(os.environ.get("SYSTEMCTL_TIMEOUT_START_SEC", 90))
 DefaultTimeoutStopSec = int(os.environ.get("SYSTEMCTL_TIMEOUT_STOP_SEC", 90))   # official value
 DefaultMaximumTimeout = int(os.environ.get("SYSTEMCTL_MAXIMUM_TIMEOUT", 200))   # overrides all other
 InitLoopSleep = int(os.environ.get("SYSTEMCTL_INITLOOP", 5))
+ShutdownTimeout = int(os.environ.get("SYSTEMCTL_SHUTDOWN_TIMEOUT", 8)) # init-loop stop, below the 10s of 'docker stop', 0 = DefaultMaximumTimeout
+ControlTimeout = 3 # reading a request from the control socket
+ControlOptions = [ "_extra_vars", "_force", "_full", "_no_ask_password", "_no_legend", "_preset_mode", "_quiet",
+                   "_show_all", "_unit_property", "_unit_state", "_unit_type", "_log_lines", "_log_since" ]
+ReadOnlyCommands = [ "is-active", "is-failed", "is-enabled", "show" ] # no wait_boot
+ControlCommands = [ "start", "stop", "restart", "status", "show", "is-active", "is-failed", "daemon-reload" ]
 ProcMaxDepth = 100
+JournalMaxFileSize = int(os.environ.get("SYSTEMCTL_JOURNAL_MAXFILESIZE", 10*1024*1024)) # 0 = no rotation by size
+JournalMaxFileSec = int(os.environ.get("SYSTEMCTL_JOURNAL_MAXFILESEC", 0)) # 0 = no rotation by age
+JournalMaxFiles = int(os.environ.get("SYSTEMCTL_JOURNAL_MAXFILES", 5)) # rotated segments to keep
+JournalCompress = os.environ.get("SYSTEMCTL_JOURNAL_COMPRESS", "yes") not in [ "", "0", "no" ]
+JournalIndexSec = 1 # time between the marks in the .idx of a log
 MaxLockWait = None # equals DefaultMaximumTimeout
+QueryLockWait = float(os.environ.get("SYSTEMCTL_QUERY_LOCKWAIT", 0.2)) # for a start/stop to be done
 DefaultPath = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
 ResetLocale = ["LANG", "LANGUAGE", "LC_CTYPE", "LC_NUMERIC", "LC_TIME", "LC_COLLATE", "LC_MONETARY",
                "LC_MESSAGES", "LC_PAPER", "LC_NAME", "LC_ADDRESS", "LC_TELEPHONE", "LC_MEASUREMENT",
@@ -96,9 +119,20 @@ LocaleConf="/etc/locale.conf"
 
 # The systemd default is NOTIFY_SOCKET="/var/run/systemd/notify"
 _notify_socket_folder = "/var/run/systemd" # alias /run/systemd
+_unit_index_name = "systemctl.units.index" # in _notify_socket_folder
+_conf_cache_folder = "/var/run/systemd/systemctl.cache"
+_control_socket_name = "private" # in _notify_socket_folder
 _pid_file_folder = "/var/run"
+_state_file_name = "systemctl.state" # in _pid_file_folder, see USE_STATE_FILE
 _journal_log_folder = "/var/log/journal"
 
+_special_var = re.compile(r"[%](.)") # expand_special
+_env_var = re.compile(r"[$](?:(\w+)|[{](\w+)[}])") # expand_env
+_env_word_var = re.compile(r"[$](\w+)") # exec_cmd before shlex
+_env_brace_var = re.compile(r"[$][{](\w+)[}]") # exec_cmd after shlex
+_env_maxdepth = 20
+_env_file_line = re.compile(r"""(?:export +)?([\w_]+)[=](?:'([^']*)'|"([^"]*)"|(.*))""") # read_env_file
+
 _systemctl_debug_log = "/var/log/systemctl.debug.log"
 _systemctl_extra_log = "/var/log/systemctl.log"
 
@@ -136,6 +170,12 @@ def to_list(value):
     if isinstance(value, string_types):
          return [ value ]
     return value
+def to_str(value):
+    if value is None:
+        return ""
+    if not isinstance(value, str): # unicode from json on python2
+        return value.encode("utf-8")
+    return value
 def unit_of(module):
     if "." not in module:
         return module + ".service"
@@ -180,35 +220,51 @@ def _var_path(path):
     return path
 
 
-def shutil_setuid(user = None, group = None, xgroups = None):
-    """ set fork-child uid/gid (returns pw-info env-settings)"""
+def shutil_credentials(user = None, group = None, xgroups = None): # -> (gid, groups, uid, env)
+    """ resolve the uid/gid settings (cached in the process, so that the
+        fork-child does not need to scan the group database again). The
+        cache is dropped when /etc/passwd or /etc/group have changed. Note
+        that the init-loop does not see what its control workers resolve."""
+    global _credentials_stamp
+    stamp = [ os.path.exists(filename) and os.path.getmtime(filename) for filename in _credentials_files ]
+    if stamp != _credentials_stamp:
+        _credentials.clear()
+        _credentials_stamp = stamp
+    key = (user, group, tuple(xgroups or []))
+    if key in _credentials:
+        return _credentials[key]
+    gid, groups, uid, env = None, [], None, {}
     if group:
         import grp
         gid = grp.getgrnam(group).gr_gid
-        os.setgid(gid)
-        logg.debug("setgid %s '%s'", gid, group)
     if user:
         import pwd
         import grp
         pw = pwd.getpwnam(user)
-        gid = pw.pw_gid
-        gname = grp.getgrgid(gid).gr_name
         if not group:
-            os.setgid(gid)
-            logg.debug("setgid %s", gid)
-        groups = [g.gr_gid for g in grp.getgrall() if user in g.gr_mem]
+            gid = pw.pw_gid
+        allgroups = grp.getgrall()
+        groups = [g.gr_gid for g in allgroups if user in g.gr_mem]
         if xgroups:
-            groups += [g.gr_gid for g in grp.getgrall() if g.gr_name in xgroups and g.gr_gid not in groups]
-        if groups:
-            os.setgroups(groups)
+            groups += [g.gr_gid for g in allgroups if g.gr_name in xgroups and g.gr_gid not in groups]
         uid = pw.pw_uid
+        env = { "USER": user, "LOGNAME": pw.pw_name, "HOME": pw.pw_dir, "SHELL": pw.pw_shell }
+    logg.debug("resolved credentials %s:%s => %s:%s %s", user, group, uid, gid, groups)
+    _credentials[key] = (gid, groups, uid, env)
+    return _credentials[key]
+
+def shutil_setuid(user = None, group = None, xgroups = None):
+    """ set fork-child uid/gid (returns pw-info env-settings)"""
+    gid, groups, uid, env = shutil_credentials(user, group, xgroups)
+    if gid is not None:
+        os.setgid(gid)
+        logg.debug("setgid %s '%s'", gid, group or user)
+    if groups:
+        os.setgroups(groups)
+    if uid is not None:
         os.setuid(uid)
         logg.debug("setuid %s '%s'", uid, user)
-        home = pw.pw_dir
-        shell = pw.pw_shell
-        logname = pw.pw_name
-        return { "USER": user, "LOGNAME": logname, "HOME": home, "SHELL": shell }
-    return {}
+    return dict(env)
 
 def shutil_truncate(filename):
     """ truncates the file (or creates a new empty file)"""
@@ -219,6 +275,46 @@ def shutil_truncate(filename):
     f.write("")
     f.close()
 
+def shutil_atomic_write(filename, text, sync = False):
+    """ writes the text to a temporary file that is renamed over the old
+        file - so a reader sees either the old or the new content but never
+        a partial file. With sync the data is on disk before the rename."""
+    tmpfile = "%s.%s.tmp" % (filename, os.getpid())
+    try:
+        with open(tmpfile, "w") as f:
+            f.write(text)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmpfile, filename)
+    except:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+def shutil_fsync_dir(dirpath):
+    """ makes the renames in the directory durable """
+    fd = os.open(dirpath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def proc_starttime(pid = 1):
+    """ the start of the process from its jiffies after the system boot
+        as given in /proc/stat btime (or None if unknown) """
+    try:
+        with open("/proc/%s/stat" % pid) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        starttime = int(fields[19]) # field 22 of proc(5)
+        with open("/proc/stat") as f:
+            for line in f:
+                if line.startswith("btime "):
+                    return int(line.split()[1]) + float(starttime) / os.sysconf("SC_CLK_TCK")
+    except Exception as e:
+        logg.debug("no start time of PID %s: %s", pid, e)
+    return None
+
 # http://stackoverflow.com/questions/568271/how-to-check-if-there-exists-a-process-with-a-given-pid
 def pid_exists(pid):
     """Check whether pid exists in the current process table."""
@@ -252,6 +348,25 @@ def _pid_exists(pid):
             raise
     else:
         return True
+def write_iov(fd, iov):
+    """ write all the parts - with writev in batches of IOV_MAX if possible """
+    IOV_MAX = 1024
+    if not hasattr(os, "writev"): # python2
+        data = bytearray().join(iov)
+        while data:
+            written = os.write(fd, data)
+            del data[:written]
+        return
+    for start in xrange(0, len(iov), IOV_MAX):
+        parts = iov[start:start+IOV_MAX]
+        written = os.writev(fd, parts)
+        size = sum([ len(part) for part in parts ])
+        if written < size:
+            rest = bytearray().join(parts)[written:]
+            while rest:
+                written = os.write(fd, rest)
+                del rest[:written]
+
 def pid_zombie(pid):
     """ may be a pid exists but it is only a zombie """
     if pid is None:
@@ -278,6 +393,560 @@ def _pid_zombie(pid):
         return False
     return False
 
+_pidfd_open_syscalls = [ # for python2 where os.pidfd_open is missing
+    (r"x86_64|i[3-6]86|aarch64|arm|ppc|s390|riscv|sparc|loongarch", 434), # the unified syscall table
+    (r"alpha", 544) ] # the others (like mips with its ABI offsets) are not known here
+
+def pidfd_open_syscall(machine = None):
+    """ the syscall number of pidfd_open for this machine - or None """
+    machine = machine or os.uname()[4]
+    for pattern, number in _pidfd_open_syscalls:
+        if re.match(pattern, machine):
+            return number
+    return None
+
+def pidfd_open(pid):
+    """ a file descriptor that gets readable when the process has exited
+        (Linux 5.3) - or None when it is not available. """
+    try:
+        if hasattr(os, "pidfd_open"):
+            return os.pidfd_open(int(pid))
+        syscall = pidfd_open_syscall()
+        if syscall is None:
+            return None
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno = True)
+        fd = libc.syscall(syscall, int(pid), 0)
+        if fd >= 0:
+            return fd
+    except Exception as e:
+        logg.debug("no pidfd for PID %s: %s", pid, e)
+    return None
+
+_falloc_fl_collapse_range = 0x08 # fallocate mode (Linux 3.15 for ext4 and xfs)
+
+def collapse_range(fd, size):
+    """ remove the first size bytes of a file in one step, a multiple of the
+        block size - False when the file system can not do that. """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno = True)
+        fallocate = getattr(libc, "fallocate64", None) or libc.fallocate
+        if fallocate(fd, _falloc_fl_collapse_range, ctypes.c_longlong(0), ctypes.c_longlong(size)) == 0:
+            return True
+        logg.debug("no collapse range: %s", os.strerror(ctypes.get_errno()))
+    except Exception as e:
+        logg.debug("no collapse range: %s", e)
+    return False
+
+_pr_set_child_subreaper = 36 # prctl option (Linux 3.4)
+
+def set_child_subreaper():
+    """ the orphans of our children are reparented to us (and not to PID 1) """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno = True)
+        if libc.prctl(_pr_set_child_subreaper, 1, 0, 0, 0) == 0:
+            return True
+    except Exception as e:
+        logg.debug("no child subreaper: %s", e)
+    return False
+
+def pidfd_wait(pids, timeout):
+    """ wait for the processes to exit by polling on their pidfds - returns
+        the pids still running after the timeout, or None when there is no
+        pidfd support so that the caller needs to check the pids itself. """
+    pidfds = {}
+    try:
+        for pid in pids:
+            fd = pidfd_open(pid)
+            if fd is None:
+                if pid_exists(pid) and not pid_zombie(pid):
+                    return None
+                continue # has exited already
+            pidfds[fd] = pid
+        deadline = time.time() + timeout
+        while pidfds:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                ready, _, _ = select.select(list(pidfds), [], [], remaining)
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            for fd in ready:
+                os.close(fd)
+                del pidfds[fd]
+        return sorted(pidfds.values())
+    finally:
+        for fd in pidfds:
+            os.close(fd)
+
+class ProcTable:
+    """ a snapshot of the process table - each /proc/<pid>/stat is read
+        only once to know the parent, the state and the entry time. """
+    def __init__(self, pids = None):
+        self.ppid = {} # pid => ppid
+        self.state = {} # pid => "R", "S", "Z", ...
+        self.mtime = {} # pid => mtime of the /proc entry
+        self.children = {} # ppid => [ pid ]
+        if pids is None:
+            pids = [ name for name in os.listdir("/proc") if name.isdigit() ]
+        for pid in pids:
+            self.read(int(pid))
+    def read(self, pid):
+        proc_stat = "/proc/%s/stat" % pid
+        try:
+            with open(proc_stat) as f:
+                mtime = os.fstat(f.fileno()).st_mtime
+                text = f.read()
+        except (IOError, OSError) as e:
+            if e.errno not in [ errno.ENOENT, errno.ESRCH ]:
+                logg.warning("%s : %s", proc_stat, e)
+            return False
+        # "pid (comm) state ppid ..." where the comm may have spaces and parens
+        fields = text[text.rfind(")")+2:].split()
+        try:
+            state, ppid = fields[0], int(fields[1])
+        except (IndexError, ValueError):
+            logg.warning("%s : can not parse '%s'", proc_stat, text)
+            return False
+        self.ppid[pid] = ppid
+        self.state[pid] = state
+        self.mtime[pid] = mtime
+        self.children.setdefault(ppid, []).append(pid)
+        return True
+    def pids(self):
+        return sorted(self.ppid)
+    def exists(self, pid):
+        return pid in self.ppid
+    def zombie(self, pid):
+        return self.state.get(pid) == "Z"
+    def alive(self, pid):
+        return pid in self.state and self.state[pid] not in [ "Z", "X" ]
+    def descendants(self, pid):
+        """ the pid and all its children, their children and so on """
+        pidlist = [ pid ]
+        known = set(pidlist)
+        level = pidlist
+        for depth in xrange(ProcMaxDepth):
+            found = []
+            for parent in level:
+                for child in self.children.get(parent, []):
+                    if child not in known:
+                        known.add(child)
+                        found.append(child)
+            if not found:
+                break
+            pidlist += found
+            level = found
+        return pidlist
+
+class Inotify:
+    """ watching a directory with the Linux inotify API (through ctypes).
+        When it is not available then 'fd' is None and wait() will just
+        sleep the timeout - the callers have to poll anyway. """
+    IN_MODIFY = 0x0002
+    IN_CLOSE_WRITE = 0x0008
+    IN_MOVED_TO = 0x0080
+    IN_CREATE = 0x0100
+    IN_NONBLOCK = 0x0800
+    IN_CLOEXEC = 0x80000
+    _libc = None
+    def __init__(self):
+        self.fd = None
+        try:
+            if Inotify._libc is None:
+                import ctypes
+                Inotify._libc = ctypes.CDLL(None, use_errno = True)
+            fd = Inotify._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+        except Exception as e: # pragma: nocover
+            logg.debug("no inotify: %s", e)
+    def add_watch(self, path, mask):
+        if self.fd is None:
+            return False
+        if not isinstance(path, bytes):
+            path = path.encode("utf-8")
+        wd = Inotify._libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            logg.debug("inotify can not watch %s", path)
+            self.close()
+            return False
+        return True
+    def read_names(self):
+        """ the names from the pending events (a name is empty for the watched folder itself) """
+        import struct
+        names = []
+        try:
+            buf = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno in [ errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ]:
+                return names
+            raise
+        offset = 0
+        while offset + 16 <= len(buf):
+            wd, mask, cookie, size = struct.unpack_from("iIII", buf, offset)
+            name = buf[offset+16:offset+16+size].rstrip(b"\0")
+            names.append(name.decode("utf-8", "replace"))
+            offset += 16 + size
+        return names
+    def wait(self, name, timeout):
+        """ wait for an event on the name - or just sleep the timeout """
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                ready, _, _ = select.select([ self.fd ], [], [], remaining)
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            if ready and name in self.read_names():
+                return True
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class StateFile:
+    """ the status of all units in one file - one line per unit with the
+        name and the tab-separated key=value items. A reader has one read()
+        for all units while an update of a unit is done under an flock
+        by renaming a new file over the old one. The status from before
+        the boottime is ignored (like the truncate_old status files). """
+    def __init__(self, filename, boottime = 0):
+        self.filename = filename
+        self.boottime = boottime
+        self._stamp = None # (ino, mtime, size) of the parsed file
+        self._units = {}
+    def read(self): # -> { unit: { key: value } }
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            self._stamp = None
+            self._units = {}
+            return self._units
+        stamp = (st.st_ino, st.st_mtime, st.st_size)
+        if stamp == self._stamp:
+            return self._units
+        units = {}
+        if st.st_mtime - EpsilonTime >= self.boottime:
+            with open(self.filename) as f:
+                text = f.read()
+            for line in text.splitlines():
+                items = line.split("\t")
+                status = {}
+                for item in items[1:]:
+                    key, eq, value = item.partition("=")
+                    if eq:
+                        status[key] = value
+                if items[0]:
+                    units[items[0]] = status
+        self._stamp = stamp
+        self._units = units
+        return units
+    def update(self, unit, status): # status None => remove
+        dirpath = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        lock = os.open(self.filename + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            units = dict(self.read())
+            if status is not None:
+                units[unit] = status
+            else:
+                units.pop(unit, None)
+            lines = []
+            for name in sorted(units):
+                items = [ name ]
+                for key in sorted(units[name]):
+                    value = " ".join(str(units[name][key]).split())
+                    items.append("%s=%s" % (key, value))
+                lines.append("\t".join(items) + "\n")
+            shutil_atomic_write(self.filename, "".join(lines), SYNC_STATUS_FILES)
+            self._stamp = None
+        finally:
+            os.close(lock) # and unlock
+
+class JournalLog:
+    """ the log of a service - the live 'name.log' that the service writes
+        to and the rotated segments 'name.log.1' to 'name.log.N' (or with
+        '.gz' when compressed) where 'name.log.N' is the oldest. Each of
+        them has a sidecar 'idx' with lines of 'time offset' telling the
+        size of the log at that time, so that a --since can seek to the
+        offset instead of scanning. The rotation copies the live log to a
+        segment and cuts that part off - the service keeps its O_APPEND fd.
+        Only the writers check the log, one at a time by an flock on it. """
+    def __init__(self, filename):
+        self.filename = filename
+        self._index = None # [ (time, offset) ] of the live log
+        self._index_key = None # (ino, size) of its idx file when read
+    def segment(self, num):
+        return "%s.%s" % (self.filename, num)
+    def index_file(self, filename):
+        if filename.endswith(".gz"):
+            filename = filename[:-len(".gz")]
+        return filename + ".idx"
+    def segments(self): # -> [ filename ] the oldest first, the live log last
+        found = []
+        for num in xrange(JournalMaxFiles, 0, -1):
+            for filename in [ self.segment(num), self.segment(num) + ".gz" ]:
+                if os.path.isfile(filename):
+                    found.append(filename)
+        if os.path.isfile(self.filename):
+            found.append(self.filename)
+        return found
+    def read_index(self, filename): # -> [ (time, offset) ]
+        index = []
+        try:
+            with open(self.index_file(filename)) as f:
+                for line in f:
+                    mark = line.split()
+                    if len(mark) == 2:
+                        index.append((float(mark[0]), int(mark[1])))
+        except (IOError, OSError, ValueError) as e:
+            logg.debug("no index for %s: %s", filename, e)
+        return index
+    def index_key(self):
+        try:
+            st = os.stat(self.index_file(self.filename))
+            return (st.st_ino, st.st_size)
+        except OSError:
+            return None
+    def load_index(self): # -> [ (time, offset) ]
+        """ the index of the live log - again when another process changed it """
+        key = self.index_key()
+        if self._index is None or key != self._index_key:
+            self._index = self.read_index(self.filename)
+            self._index_key = key
+        return self._index
+    def mark(self, size, now = None):
+        """ append the current size to the index of the live log """
+        now = now or time.time()
+        self.load_index()
+        if self._index and self._index[-1][1] > size:
+            self._index = [] # truncated by someone else
+            shutil_truncate(self.index_file(self.filename))
+        if self._index:
+            last_time, last_size = self._index[-1]
+            if last_size == size or now - last_time < JournalIndexSec:
+                return
+        with open(self.index_file(self.filename), "a") as f:
+            f.write("%.3f %s\n" % (now, size))
+        self._index.append((now, size))
+        self._index_key = self.index_key()
+    def check(self, offset = None): # -> size cut off from the start
+        """ mark the index and rotate the live log when it is too big or too old
+            (a reader at the offset finds the rest at the offset minus the cut).
+            When another process is checking the log right now then it is skipped. """
+        try:
+            fd = os.open(self.filename, os.O_RDONLY)
+        except OSError:
+            return 0
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as e:
+                logg.debug("%s is checked by another process: %s", self.filename, e)
+                return 0
+            size = os.fstat(fd).st_size
+            now = time.time()
+            if size:
+                self.load_index()
+                started = self._index and self._index[0][0] or now
+                upto = size
+                if offset is not None:
+                    upto = min(size, offset)
+                blocks = upto - upto % os.fstatvfs(fd).f_bsize
+                upto = blocks or upto # whole blocks can be collapsed, a smaller log is cut
+                if upto and JournalMaxFileSize and size >= JournalMaxFileSize:
+                    logg.debug("rotate %s (size %s)", self.filename, size)
+                    return self.rotate(upto)
+                if upto and JournalMaxFileSec and now - started >= JournalMaxFileSec:
+                    logg.debug("rotate %s (since %s)", self.filename, LogTime(started))
+                    return self.rotate(upto)
+            self.mark(size, now)
+            return 0
+        finally:
+            os.close(fd) # and the flock
+    def rotate(self, size): # -> size
+        for filename in [ self.segment(JournalMaxFiles), self.segment(JournalMaxFiles) + ".gz" ]:
+            for oldfile in [ filename, self.index_file(filename) ]:
+                if os.path.exists(oldfile):
+                    os.remove(oldfile)
+        for num in xrange(JournalMaxFiles - 1, 0, -1):
+            for suffix in [ "", ".gz" ]:
+                filename = self.segment(num) + suffix
+                if os.path.exists(filename):
+                    os.rename(filename, self.segment(num + 1) + suffix)
+                    if os.path.exists(self.index_file(filename)):
+                        os.rename(self.index_file(filename), self.index_file(self.segment(num + 1)))
+        if JournalMaxFiles > 0:
+            import shutil
+            if JournalCompress:
+                import gzip
+                target = self.segment(1) + ".gz"
+                out = gzip.open(target, "wb")
+            else:
+                target = self.segment(1)
+                out = open(target, "wb")
+            with open(self.filename, "rb") as f:
+                with out:
+                    remaining = size
+                    while remaining > 0:
+                        buf = f.read(min(65536, remaining))
+                        if not buf: break
+                        out.write(buf)
+                        remaining -= len(buf)
+            with open(self.index_file(self.filename), "a") as f:
+                f.write("%.3f %s\n" % (time.time(), size))
+            os.rename(self.index_file(self.filename), self.index_file(target))
+        self.cut(size)
+        shutil_truncate(self.index_file(self.filename))
+        self._index = None
+        return size
+    def cut(self, size):
+        """ remove the first size bytes of the live log. That is atomic when
+            the file system can collapse the range (ext4, xfs) - otherwise
+            what the service has written meanwhile is moved to the front, it
+            is read up to the current end of the file right before the
+            truncate (and a line written right at that moment gets lost). """
+        BUFSIZE = 65536
+        fd = os.open(self.filename, os.O_RDWR)
+        try:
+            if collapse_range(fd, size):
+                return
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_APPEND)
+            tail = []
+            offset = size
+            while True:
+                os.lseek(fd, offset, os.SEEK_SET)
+                buf = os.read(fd, BUFSIZE)
+                if buf:
+                    tail.append(buf)
+                    offset += len(buf)
+                    continue
+                if os.fstat(fd).st_size <= offset:
+                    break
+            os.ftruncate(fd, 0)
+            if tail:
+                write_iov(fd, tail)
+        finally:
+            os.close(fd)
+    def lines(self, count = None, since = None): # -> [ bytes ]
+        """ the last count lines, or the lines written after since. The
+            rotation may have cut a line at a block boundary - then the end
+            of a segment is joined with the start of the next file. """
+        segments = self.segments()
+        if since is not None:
+            result = collections.deque(maxlen = count)
+            started = False
+            partial = b""
+            for filename in segments:
+                offset = 0
+                if not started:
+                    index = self.read_index(filename)
+                    if filename != self.filename and index and index[-1][0] < since:
+                        continue # the segment was rotated before
+                    for mark_time, mark_size in index:
+                        if mark_time <= since:
+                            offset = mark_size
+                    started = True
+                text = partial + self.read_text(filename, offset)
+                partial = b""
+                if not text.endswith(b"\n"):
+                    head, newline, partial = text.rpartition(b"\n")
+                    text = head + newline
+                result.extend(text.splitlines())
+            if partial:
+                result.append(partial)
+            return list(result)
+        result = []
+        for filename in reversed(segments):
+            if count is not None and len(result) >= count:
+                break
+            if count is None:
+                found = self.read_from(filename, 0)
+            else:
+                found = self.read_tail(filename, count - len(result) + 1)
+            if result and found and not self.ends_with_newline(filename):
+                result[0] = found.pop() + result[0]
+            result = found + result
+        if count is not None:
+            return result[max(0, len(result) - count):]
+        return result
+    def open_segment(self, filename):
+        if filename.endswith(".gz"):
+            import gzip
+            return gzip.open(filename, "rb")
+        return open(filename, "rb")
+    def read_text(self, filename, offset): # -> bytes
+        with self.open_segment(filename) as f:
+            if offset:
+                f.seek(offset)
+            return f.read()
+    def read_from(self, filename, offset): # -> [ bytes ]
+        return self.read_text(filename, offset).splitlines()
+    def ends_with_newline(self, filename):
+        if filename.endswith(".gz"):
+            text = self.read_text(filename, 0)
+            return not text or text.endswith(b"\n")
+        with open(filename, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if not f.tell():
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    def read_tail(self, filename, count): # -> [ bytes ]
+        if filename.endswith(".gz"):
+            return self.read_from(filename, 0)[-count:]
+        BUFSIZE = 8192
+        with open(filename, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            text = b""
+            while offset > 0 and text.count(b"\n") <= count:
+                step = min(BUFSIZE, offset)
+                offset -= step
+                f.seek(offset)
+                text = f.read(step) + text
+        lines = text.splitlines()
+        return lines[-count:]
+
+class LogTime:
+    """ a timestamp for the logs - formatted (and the datetime module
+        imported) only when the log message is actually shown """
+    def __init__(self, seconds):
+        self.seconds = seconds
+    def __str__(self):
+        import datetime
+        return str(datetime.datetime.fromtimestamp(self.seconds))
+
+class CaptureOutput:
+    """ the output of a control request - the fileno() is the one of the
+        init-loop so that a forked child can still dup2 its journal log """
+    def __init__(self, fileno):
+        self._fileno = fileno
+        self._text = []
+    def write(self, text):
+        self._text.append(text)
+    def flush(self):
+        pass
+    def fileno(self):
+        return self._fileno
+    def getvalue(self):
+        return "".join(self._text)
+
 def checkstatus(cmd):
     if cmd.startswith("-"):
         return False, cmd[1:]
@@ -457,6 +1126,25 @@ class SystemctlConfigParser:
         self.set("Service", "Type", "sysv")
     def filenames(self):
         return self._files
+    def dumps(self):
+        """ the parsed data as plain tuples (see loads) """
+        sections = []
+        for section in self._conf:
+            options = []
+            for option in self._conf[section]:
+                options.append((option, list(self._conf[section][option])))
+            sections.append((section, options))
+        return (list(self._files), sections)
+    def loads(self, data):
+        """ restore the parsed data from plain tuples (see dumps) """
+        files, sections = data
+        self._files = list(files)
+        self._conf = self._dict_type()
+        for section, options in sections:
+            self._conf[section] = self._dict_type()
+            for option, values in options:
+                self._conf[section][option] = list(values)
+        return self
 
 # UnitConfParser = ConfigParser.RawConfigParser
 UnitConfParser = SystemctlConfigParser
@@ -469,6 +1157,8 @@ class SystemctlConf:
         self.masked = None
         self.module = module
         self.drop_in_files = {}
+        self.specials = None # expand_special
+        self.env_cache = None # get_env: (env files key, env)
         self._root = _root
         self._user_mode = _user_mode
     def os_path(self, path):
@@ -538,11 +1228,25 @@ class PresetFile:
         return None
 
 ## with waitlock(conf): self.start()
+class LockTimeout(Exception):
+    pass
+
 class waitlock:
-    def __init__(self, conf):
+    """ the unit lock is exclusive for start/stop/reload. The queries take
+        it shared, so they do not see a unit in the middle of a transition
+        while they do not need to wait for each other. A unit lock that is
+        already held by this process is not taken again, and a query from
+        within a start/stop does not wait for the lock of another unit. """
+    holding = {} # lockfile => count
+    transitions = set() # lockfile of a query that did not wait long enough (in this command)
+    def __init__(self, conf, shared = False):
         self.conf = conf # currently unused
+        self.shared = shared
         self.opened = None
+        self.nested = False
         self.lockfolder = conf.os_path_var(_notify_socket_folder)
+        if shared:
+            return # no need to create the folder
         try:
             folder = self.lockfolder
             if not os.path.isdir(folder):
@@ -555,14 +1259,23 @@ class waitlock:
             unit = self.conf.name()
         return os.path.join(self.lockfolder, str(unit or "global") + ".lock")
     def __enter__(self):
+        lockfile = self.lockfile()
+        if lockfile in waitlock.holding:
+            waitlock.holding[lockfile] += 1
+            self.nested = True
+            return True
+        if self.shared:
+            return self.enter_shared(lockfile)
         try:
-            lockfile = self.lockfile()
             lockname = os.path.basename(lockfile)
             self.opened = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o600)
+            locked = False
             for attempt in xrange(int(MaxLockWait or DefaultMaximumTimeout)):
                 try:
                     logg.debug("[%s] %s. trying %s _______ ", os.getpid(), attempt, lockname)
-                    fcntl.flock(self.opened, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if not locked:
+                        fcntl.flock(self.opened, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = False
                     st = os.fstat(self.opened)
                     if not st.st_nlink:
                         logg.debug("[%s] %s. %s got deleted, trying again", os.getpid(), attempt, lockname)
@@ -572,24 +1285,102 @@ class waitlock:
                     content = "{ 'systemctl': %s, 'lock': '%s' }\n" % (os.getpid(), lockname)
                     os.write(self.opened, content.encode("utf-8"))
                     logg.debug("[%s] %s. holding lock on %s", os.getpid(), attempt, lockname)
+                    waitlock.holding[lockfile] = 1
                     return True
                 except BlockingIOError as e:
                     whom = os.read(self.opened, 4096)
                     os.lseek(self.opened, 0, os.SEEK_SET)
                     logg.info("[%s] %s. systemctl locked by %s", os.getpid(), attempt, whom.rstrip())
-                    time.sleep(1) # until MaxLockWait
+                    locked = self.waitflock(1) # until MaxLockWait
                     continue
             logg.error("[%s] not able to get the lock to %s", os.getpid(), lockname)
         except Exception as e:
             logg.warning("[%s] oops %s, %s", os.getpid(), str(type(e)), e)
         #TODO# raise Exception("no lock for %s", self.unit or "global")
         return False
+    def enter_shared(self, lockfile):
+        """ a query does not write its pid to the lockfile, and it goes on
+            without a lock if there is no lockfile (the unit was never locked).
+            A query waits only QueryLockWait for a start/stop to be done, so
+            a longer one is shown in its current state (as systemd does). """
+        lockname = os.path.basename(lockfile)
+        if waitlock.holding:
+            return False # no lock order problems
+        if lockfile in waitlock.transitions:
+            return False # do not wait again
+        try:
+            self.opened = os.open(lockfile, os.O_RDONLY)
+            locked = False
+            for attempt in xrange(3):
+                try:
+                    if not locked:
+                        fcntl.flock(self.opened, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    locked = False
+                    st = os.fstat(self.opened)
+                    if not st.st_nlink:
+                        os.close(self.opened)
+                        self.opened = None
+                        self.opened = os.open(lockfile, os.O_RDONLY)
+                        continue
+                    waitlock.holding[lockfile] = 1
+                    return True
+                except BlockingIOError as e:
+                    whom = os.read(self.opened, 4096)
+                    os.lseek(self.opened, 0, os.SEEK_SET)
+                    logg.debug("[%s] %s. systemctl locked by %s (shared)", os.getpid(), attempt, whom.rstrip())
+                    locked = self.waitflock(QueryLockWait)
+                    if not locked:
+                        waitlock.transitions.add(lockfile)
+                        break
+            logg.debug("[%s] no shared lock on %s - reading a transition", os.getpid(), lockname)
+        except Exception as e:
+            logg.debug("[%s] no shared lock %s: %s", os.getpid(), lockname, e)
+        if self.opened is not None:
+            os.close(self.opened)
+            self.opened = None
+        return False
+    def waitflock(self, timeout): # -> locked
+        """ block in flock() until the lock is released but not longer than
+            the timeout (by a SIGALRM) - so a waiter gets the lock right away
+            and not only in the next round. Without a SIGALRM it will sleep."""
+        if not hasattr(signal, "setitimer"):
+            time.sleep(timeout)
+            return False
+        def interrupt(signum, frame):
+            raise LockTimeout()
+        try:
+            oldhandler = signal.signal(signal.SIGALRM, interrupt)
+        except ValueError: # not the main thread
+            time.sleep(timeout)
+            return False
+        try:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            fcntl.flock(self.opened, self.shared and fcntl.LOCK_SH or fcntl.LOCK_EX)
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            return True
+        except LockTimeout:
+            return False
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, oldhandler)
     def __exit__(self, type, value, traceback):
+        lockfile = self.lockfile()
+        if self.nested:
+            waitlock.holding[lockfile] -= 1
+            return
+        if self.opened is None:
+            return
+        waitlock.holding.pop(lockfile, None)
+        if self.shared:
+            fcntl.flock(self.opened, fcntl.LOCK_UN)
+            os.close(self.opened)
+            self.opened = None
+            return
+        waitlock.transitions.discard(lockfile) # the transition is done
         try:
             os.lseek(self.opened, 0, os.SEEK_SET)
             os.ftruncate(self.opened, 0)
             if "removelockfile" in COVERAGE: # actually an optional implementation
-                lockfile = self.lockfile()
                 lockname = os.path.basename(lockfile)
                 os.unlink(lockfile) # ino is kept allocated because opened by this process
                 logg.debug("[%s] lockfile removed for %s", os.getpid(), lockname)
@@ -675,6 +1466,34 @@ def time_to_seconds(text, maximum = None):
     if not value:
         return 1
     return value
+def since_to_time(text, now = None): # -> seconds since the epoch | None
+    """ the --since of journalctl - 'YYYY-MM-DD [HH:MM[:SS]]', 'HH:MM[:SS]'
+        of today, 'today', 'yesterday', 'now', '@EPOCH', or some time ago
+        like '-5min' or '2 hours ago' """
+    now = now or time.time()
+    text = text.strip()
+    midnight = time.mktime(time.localtime(now)[:3] + (0, 0, 0, 0, 0, -1))
+    if text == "now":
+        return now
+    if text == "today":
+        return midnight
+    if text == "yesterday":
+        return midnight - 24 * 60 * 60
+    if text.startswith("@"):
+        try: return float(text[1:])
+        except ValueError: return None
+    m = re.match(r"^-?\s*(\d+)\s*(s|sec|m|min|h|hour|d|day)s?(\s+ago)?$", text)
+    if m and (text.startswith("-") or m.group(3)):
+        unit = { "s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400 }
+        return now - int(m.group(1)) * unit[m.group(2)]
+    for style in [ "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d" ]:
+        try: return time.mktime(time.strptime(text, style))
+        except ValueError: pass
+    for style in [ "%H:%M:%S", "%H:%M" ]:
+        try: clock = time.strptime(text, style)
+        except ValueError: continue
+        return midnight + clock.tm_hour * 3600 + clock.tm_min * 60 + clock.tm_sec
+    return None
 def seconds_to_time(seconds):
     seconds = float(seconds)
     mins = int(int(seconds) / 60)
@@ -734,57 +1553,83 @@ def compareAfter(confA, confB):
             return -1
     return 0
 
+def orderingGraph(conflist):
+    """ returns for each conf in the list the indices of the other
+        confs that it must be started before - a conf 'B' is started
+        after 'A' when B has "After=A" or when A has "Before=B". The
+        After/Before lists are parsed only once for each conf. """
+    indices = {}
+    for index, conf in enumerate(conflist):
+        indices.setdefault(conf.name(), []).append(index)
+    before = [ [] for conf in conflist ]
+    for index, conf in enumerate(conflist):
+        for name in getAfter(conf):
+            for other in indices.get(name, []):
+                if other != index and index not in before[other]:
+                    before[other].append(index)
+        for name in getBefore(conf):
+            for other in indices.get(name, []):
+                if other != index and other not in before[index]:
+                    before[index].append(other)
+    return before
+
 def sortedAfter(conflist, cmp = compareAfter):
-    # the normal sorted() does only look at two items
-    # so if "A after C" and a list [A, B, C] then
-    # it will see "A = B" and "B = C" assuming that
-    # "A = C" and the list is already sorted.
+    # Each conf gets a rank that is higher than the rank of all the
+    # confs that it must be started before (the longest path to a
+    # conf that has no followers). The ranks are computed in a
+    # topological order (Kahn's algorithm) walking backwards from
+    # the confs that have no followers. A stable sort on the ranks
+    # will then keep the original order for unrelated confs.
     #
-    # To make a totalsorted we have to create a marker
-    # that informs sorted() that also B has a relation.
-    # It only works when 'after' has a direction, so
-    # anything without 'before' is a 'after'. In that
-    # case we find that "B after C".
-    class SortTuple:
-        def __init__(self, rank, conf):
-            self.rank = rank
-            self.conf = conf
-    sortlist = [ SortTuple(0, conf) for conf in conflist]
-    for check in xrange(len(sortlist)): # maxrank = len(sortlist)
-        changed = 0
-        for A in xrange(len(sortlist)):
-            for B in xrange(len(sortlist)):
-                if A != B:
-                    itemA = sortlist[A]
-                    itemB = sortlist[B]
-                    before = compareAfter(itemA.conf, itemB.conf)
-                    if before > 0 and itemA.rank <= itemB.rank:
-                        if DEBUG_AFTER: # pragma: no cover
-                            logg.info("  %-30s before %s", itemA.conf.name(), itemB.conf.name())
-                        itemA.rank = itemB.rank + 1
-                        changed += 1
-                    if before < 0 and itemB.rank <= itemA.rank:
-                        if DEBUG_AFTER: # pragma: no cover
-                            logg.info("  %-30s before %s", itemB.conf.name(), itemA.conf.name())
-                        itemB.rank = itemA.rank + 1
-                        changed += 1
-        if not changed:
-            if DEBUG_AFTER: # pragma: no cover
-                logg.info("done in check %s of %s", check, len(sortlist))
+    # An ordering cycle leaves some confs unranked. It is reported,
+    # and it is broken at the first of those confs in list order.
+    conflist = list(conflist)
+    before = orderingGraph(conflist)
+    after = [ [] for conf in conflist ]
+    for index, others in enumerate(before):
+        for other in others:
+            after[other].append(index)
+    waiting = [ len(others) for others in before ]
+    rank = [ 0 for conf in conflist ]
+    done = [ False for conf in conflist ]
+    queue = collections.deque([ index for index in xrange(len(conflist)) if not waiting[index] ])
+    while True:
+        while queue:
+            index = queue.popleft()
+            done[index] = True
+            for other in after[index]:
+                if rank[other] <= rank[index]:
+                    if DEBUG_AFTER: # pragma: no cover
+                        logg.info("  %-30s before %s", conflist[other].name(), conflist[index].name())
+                    rank[other] = rank[index] + 1
+                waiting[other] -= 1
+                if not waiting[other]:
+                    queue.append(other)
+        unranked = [ index for index in xrange(len(conflist)) if not done[index] ]
+        if not unranked:
             break
-            # because Requires is almost always the same as the After clauses
-            # we are mostly done in round 1 as the list is in required order
-    for conf in conflist:
-        if DEBUG_AFTER: # pragma: no cover
-            logg.debug(".. %s", conf.name())
-    for item in sortlist:
+        # each unranked conf has an unranked follower - walk along to find the loop
+        path = [ unranked[0] ]
+        while True:
+            follower = [ other for other in before[path[-1]] if not done[other] ][0]
+            if follower in path:
+                cycle = path[path.index(follower):]
+                break
+            path.append(follower)
+        names = [ conflist[index].name() for index in cycle ]
+        logg.error("ordering cycle between units: %s", " ".join(names))
+        index = min(cycle)
+        logg.error("breaking the ordering cycle at %s", conflist[index].name())
+        waiting[index] = 0
+        queue.append(index)
+    for index, conf in enumerate(conflist):
         if DEBUG_AFTER: # pragma: no cover
-            logg.info("(%s) %s", item.rank, item.conf.name())
-    sortedlist = sorted(sortlist, key = lambda item: -item.rank)
-    for item in sortedlist:
+            logg.info("(%s) %s", rank[index], conf.name())
+    sortedlist = sorted(xrange(len(conflist)), key = lambda index: -rank[index])
+    for index in sortedlist:
         if DEBUG_AFTER: # pragma: no cover
-            logg.info("[%s] %s", item.rank, item.conf.name())
-    return [ item.conf for item in sortedlist ]
+            logg.info("[%s] %s", rank[index], conflist[index].name())
+    return [ conflist[index] for index in sortedlist ]
 
 class Systemctl:
     def __init__(self):
@@ -796,6 +1641,9 @@ class Systemctl:
         self._no_ask_password = _no_ask_password
         self._no_legend = _no_legend
         self._now = _now
+        self._jobs = _jobs
+        self._log_lines = _log_lines
+        self._log_since = _log_since
         self._preset_mode = _preset_mode
         self._quiet = _quiet
         self._root = _root
@@ -812,6 +1660,11 @@ class Systemctl:
         self._loaded_file_sysd = {} # /etc/systemd/system/name.service => config data
         self._file_for_unit_sysv = None # name.service => /etc/init.d/name
         self._file_for_unit_sysd = None # name.service => /etc/systemd/system/name.service
+        self._unit_index = None # /etc/systemd/system => (mtime, ino, [ name.service,... ])
+        self._unit_index_changed = False
+        self._conf_cache_reload = False # ignore the compiled unit configs
+        self._state_file = None # StateFile (if USE_STATE_FILE)
+        self._sync_folders = None # set() while a group of units changes
         self._preset_file_list = None # /etc/systemd/system-preset/* => file content
         self._default_target = _default_target
         self._sysinit_target = None
@@ -820,7 +1673,17 @@ class Systemctl:
         self._user_mode = _user_mode
         self._user_getlogin = os_getlogin()
         self._log_file = {} # init-loop
+        self._log_journal = {} # init-loop
+        self._log_inotify = None # init-loop
+        self._log_pipe = {} # init-loop: unit => (read fd, write fd)
+        self._log_tee = {} # init-loop: unit => journal log fd
+        self._sigchld = False # init-loop
+        self._notify_sockets = {} # init-loop
+        self._control_socket = None # init-loop
+        self._control_workers = {} # init-loop: pid => start time of a control request
         self._log_hold = {} # init-loop
+        self._log_drain = {} # start/stop of the init-loop: read fd => unit
+        self._stop_deadline = None # shutdown of the init-loop: no stop waits longer
     def user(self):
         return self._user_getlogin
     def user_mode(self):
@@ -863,6 +1726,87 @@ class Systemctl:
         if True:
             for folder in self.system_folders():
                 yield folder
+    def os_path_var(self, path):
+        if self._user_mode:
+            return os_path(self._root, _var_path(path))
+        return os_path(self._root, path)
+    def unit_index_file(self):
+        """ the persistent index of the unit folders (see scan_unit_folder) """
+        return self.os_path_var(os.path.join(_notify_socket_folder, _unit_index_name))
+    def load_unit_index(self): # -> { folder: (mtime, ino, [names]) }
+        """ read the persistent unit index once per process """
+        if self._unit_index is None:
+            self._unit_index = {}
+            self._unit_index_changed = False
+            index_file = self.unit_index_file()
+            try:
+                if os.path.isfile(index_file):
+                    names = None
+                    for line in open(index_file):
+                        line = line.rstrip("\n")
+                        if line.startswith("@ "):
+                            _, mtime, ino, folder = line.split(" ", 3)
+                            names = []
+                            self._unit_index[folder] = (float(mtime), int(ino), names)
+                        elif names is not None and line:
+                            names.append(line)
+                logg.debug("unit index has %s folders", len(self._unit_index))
+            except Exception as e:
+                logg.debug("bad unit index %s: %s", index_file, e)
+                self._unit_index = {}
+        return self._unit_index
+    def save_unit_index(self):
+        """ write the unit index back if any folder was (re)scanned """
+        if not self._unit_index_changed:
+            return False
+        index_file = self.unit_index_file()
+        try:
+            index_dir = os.path.dirname(index_file)
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            index_tmp = "%s.%s" % (index_file, os.getpid())
+            with open(index_tmp, "w") as f:
+                for folder in sorted(self._unit_index):
+                    mtime, ino, names = self._unit_index[folder]
+                    f.write("@ %r %s %s\n" % (mtime, ino, folder))
+                    for name in names:
+                        f.write(name + "\n")
+            os.rename(index_tmp, index_file)
+        except Exception as e:
+            logg.debug("can not write unit index %s: %s", index_file, e)
+            return False
+        self._unit_index_changed = False
+        return True
+    def scan_unit_folder(self, folder): # -> [ file-names,... ]
+        """ lists the non-directory entries of a unit folder. The result is
+            taken from the persistent unit index as long as the mtime and the
+            inode of the folder did not change. A folder that was modified
+            in the last second is not trusted to be complete when listed. """
+        index = self.load_unit_index()
+        try:
+            st = os.stat(folder)
+        except OSError:
+            if folder in index:
+                del index[folder]
+                self._unit_index_changed = True
+            return []
+        if folder in index:
+            mtime, ino, names = index[folder]
+            if mtime == st.st_mtime and ino == st.st_ino:
+                return names
+        names = []
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if os.path.isdir(path):
+                continue
+            names.append(name)
+        mtime = st.st_mtime
+        if mtime + 1 >= time.time():
+            mtime = -1.0 # racy, check again next time
+        index[folder] = (mtime, st.st_ino, names)
+        self._unit_index_changed = True
+        logg.debug("rescanned unit folder %s", folder)
+        return names
     def scan_unit_sysd_files(self, module = None): # -> [ unit-names,... ]
         """ reads all unit files, returns the first filename for the unit given """
         if self._file_for_unit_sysd is None:
@@ -871,15 +1815,12 @@ class Systemctl:
                 if not folder: 
                     continue
                 folder = os_path(self._root, folder)
-                if not os.path.isdir(folder):
-                    continue
-                for name in os.listdir(folder):
+                for name in self.scan_unit_folder(folder):
                     path = os.path.join(folder, name)
-                    if os.path.isdir(path):
-                        continue
                     service_name = name
                     if service_name not in self._file_for_unit_sysd:
                         self._file_for_unit_sysd[service_name] = path
+            self.save_unit_index()
             logg.debug("found %s sysd files", len(self._file_for_unit_sysd))
         return list(self._file_for_unit_sysd.keys())
     def scan_unit_sysv_files(self, module = None): # -> [ unit-names,... ]
@@ -890,17 +1831,20 @@ class Systemctl:
                 if not folder: 
                     continue
                 folder = os_path(self._root, folder)
-                if not os.path.isdir(folder):
-                    continue
-                for name in os.listdir(folder):
+                for name in self.scan_unit_folder(folder):
                     path = os.path.join(folder, name)
-                    if os.path.isdir(path):
-                        continue
                     service_name = name + ".service" # simulate systemd
                     if service_name not in self._file_for_unit_sysv:
                         self._file_for_unit_sysv[service_name] = path
+            self.save_unit_index()
             logg.debug("found %s sysv files", len(self._file_for_unit_sysv))
         return list(self._file_for_unit_sysv.keys())
+    def reset_unit_index(self):
+        """ forget the unit folder index and the scanned unit files """
+        self._unit_index = {}
+        self._unit_index_changed = True
+        self._file_for_unit_sysv = None
+        self._file_for_unit_sysd = None
     def unit_sysd_file(self, module = None): # -> filename?
         """ file path for the given module (systemd) """
         self.scan_unit_sysd_files()
@@ -981,6 +1925,67 @@ class Systemctl:
             service = "%s@.service" % unit.prefix
             return self.load_sysd_unit_conf(service)
         return None
+    def conf_cache_file(self, path):
+        """ the compiled unit config is stored per unit file path """
+        name = re.sub(r"[^\w.@-]", "_", path.strip(os.path.sep))
+        version = "py%s%s" % sys.version_info[:2]
+        folder = self.os_path_var(_conf_cache_folder)
+        return os.path.join(folder, "%s.%s" % (name, version))
+    def conf_cache_stats(self, filenames): # -> [ (filename, mtime, size, ino) ]
+        stats = []
+        for filename in filenames:
+            st = os.stat(filename)
+            stats.append((filename, st.st_mtime, st.st_size, st.st_ino))
+        return stats
+    def load_conf_cache(self, path, drop_in_files): # -> UnitConfParser?
+        """ returns the compiled unit config when it is known to be
+            up to date with the unit file, all its drop-in files and
+            all its .include files - otherwise None. """
+        if self._conf_cache_reload:
+            return None
+        cache_file = self.conf_cache_file(path)
+        try:
+            import marshal
+            if not os.path.isfile(cache_file):
+                return None
+            with open(cache_file, "rb") as f:
+                cache_path, drop_ins, stats, data = marshal.load(f)
+            if cache_path != path:
+                return None
+            if list(drop_ins) != [ drop_in_files[name] for name in sorted(drop_in_files) ]:
+                return None
+            filenames = [ item[0] for item in stats ]
+            if self.conf_cache_stats(filenames) != [ tuple(item) for item in stats ]:
+                return None
+            logg.debug("using compiled config for %s", path)
+            return UnitConfParser().loads(data)
+        except Exception as e:
+            logg.debug("bad compiled config %s: %s", cache_file, e)
+        return None
+    def save_conf_cache(self, path, drop_in_files, data):
+        """ store the compiled unit config, unless some file was changed
+            in the last second (the mtime may not show another change) """
+        cache_file = self.conf_cache_file(path)
+        try:
+            import marshal
+            stats = self.conf_cache_stats(data.filenames())
+            for filename, mtime, size, ino in stats:
+                if mtime + 1 >= time.time():
+                    logg.debug("not compiling config for recent %s", filename)
+                    return False
+            drop_ins = [ drop_in_files[name] for name in sorted(drop_in_files) ]
+            cache_dir = os.path.dirname(cache_file)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            cache_tmp = "%s.%s" % (cache_file, os.getpid())
+            with open(cache_tmp, "wb") as f:
+                marshal.dump((path, drop_ins, stats, data.dumps()), f)
+            os.rename(cache_tmp, cache_file)
+            logg.debug("compiled config for %s", path)
+        except Exception as e:
+            logg.debug("can not compile config %s: %s", cache_file, e)
+            return False
+        return True
     def load_sysd_unit_conf(self, module): # -> conf?
         """ read the unit file with a UnitConfParser (systemd) """
         path = self.unit_sysd_file(module)
@@ -993,12 +1998,16 @@ class Systemctl:
         drop_in_files = {}
         data = UnitConfParser()
         if not masked:
-            data.read_sysd(path)
             drop_in_files = self.find_drop_in_files(os.path.basename(path))
-            # load in alphabetic order, irrespective of location
-            for name in sorted(drop_in_files):
-                path = drop_in_files[name]
+            cached = self.load_conf_cache(path, drop_in_files)
+            if cached is not None:
+                data = cached
+            else:
                 data.read_sysd(path)
+                # load in alphabetic order, irrespective of location
+                for name in sorted(drop_in_files):
+                    data.read_sysd(drop_in_files[name])
+                self.save_conf_cache(path, drop_in_files, data)
         conf = SystemctlConf(data, module)
         conf.masked = masked
         conf.drop_in_files = drop_in_files
@@ -1250,19 +2259,32 @@ class Systemctl:
         timeout = int(timeout or (DefaultTimeoutStartSec/2))
         timeout = max(timeout, (MinimumTimeoutStartSec))
         dirpath = os.path.dirname(os.path.abspath(pid_file))
-        for x in xrange(timeout):
-            if not os.path.isdir(dirpath):
-                time.sleep(1) # until TimeoutStartSec/2
-                continue
-            pid = self.read_pid_file(pid_file)
-            if not pid:
-                time.sleep(1) # until TimeoutStartSec/2
-                continue
-            if not pid_exists(pid):
-                time.sleep(1) # until TimeoutStartSec/2
-                continue
-            return pid
-        return None
+        filename = os.path.basename(pid_file)
+        deadline = time.time() + timeout
+        watcher = None
+        try:
+            while True:
+                if os.path.isdir(dirpath):
+                    if watcher is None: # before reading the file, so no event is lost
+                        watcher = Inotify()
+                        watcher.add_watch(dirpath, Inotify.IN_CREATE | Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO)
+                    pid = self.read_pid_file(pid_file)
+                    if pid and pid_exists(pid):
+                        return pid
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                if self._log_drain:
+                    fds = watcher is not None and watcher.fd is not None and [ watcher.fd ] or []
+                    if self.wait_log_pipes(min(remaining, 1), fds = fds):
+                        watcher.read_names() # check the pid file again
+                elif watcher is None:
+                    time.sleep(min(remaining, 1)) # until TimeoutStartSec/2
+                else:
+                    watcher.wait(filename, min(remaining, 1)) # or 1 second polling
+        finally:
+            if watcher is not None:
+                watcher.close()
     def test_pid_file(self, unit): # -> text
         """ support for the testsuite.py """
         conf = self.get_unit_conf(unit)
@@ -1302,21 +2324,49 @@ class Systemctl:
         folder = conf.os_path_var(self._pid_file_folder)
         name = "%s.status" % conf.name()
         return os.path.join(folder, name)
+    def use_state_file(self, conf):
+        """ with USE_STATE_FILE the status is not in a file per unit, unless
+            the unit has its own StatusFile """
+        if not USE_STATE_FILE or conf is None:
+            return False
+        return not conf.get("Service", "StatusFile", "")
+    def state_file(self): # -> StateFile
+        if self._state_file is None:
+            filename = self.os_path_var(os.path.join(self._pid_file_folder, _state_file_name))
+            self._state_file = StateFile(filename, self.get_boottime())
+        return self._state_file
+    def has_status_from(self, conf): # -> bool
+        """ there is some status that has been written for this unit """
+        if self.use_state_file(conf):
+            return bool(self.state_file().read().get(conf.name()))
+        return bool(self.getsize(self.status_file_from(conf)))
+    def exists_status_from(self, conf): # -> bool
+        """ there is a status for this unit (even when it is empty) """
+        if self.use_state_file(conf):
+            return conf.name() in self.state_file().read()
+        return os.path.isfile(self.status_file_from(conf))
     def clean_status_from(self, conf):
+        if self.use_state_file(conf):
+            self.state_file().update(conf.name(), None)
+            conf.status = {}
+            return
         status_file = self.status_file_from(conf)
         if os.path.exists(status_file):
             os.remove(status_file)
+            self.sync_status_folder(os.path.dirname(os.path.abspath(status_file)))
         conf.status = {}
     def write_status_from(self, conf, **status): # -> bool(written)
         """ if a status_file is known then path is created and the
             give status is written as the only content. """
+        use_state_file = self.use_state_file(conf)
         status_file = self.status_file_from(conf)
-        if not status_file: 
+        if not status_file and not use_state_file:
             logg.debug("status %s but no status_file", conf.name())
             return False
-        dirpath = os.path.dirname(os.path.abspath(status_file))
-        if not os.path.isdir(dirpath):
-            os.makedirs(dirpath)
+        if not use_state_file:
+            dirpath = os.path.dirname(os.path.abspath(status_file))
+            if not os.path.isdir(dirpath):
+                os.makedirs(dirpath)
         if conf.status is None:
             conf.status = self.read_status_from(conf)
         if True:
@@ -1329,19 +2379,63 @@ class Systemctl:
                     except KeyError: pass
                 else:
                     conf.status[key] = value
+        if use_state_file:
+            items = {}
+            for key, value in conf.status.items():
+                if key == "MainPID" and str(value) == "0":
+                    logg.warning("ignore writing MainPID=0")
+                    continue
+                items[key] = value
+            try:
+                self.state_file().update(conf.name(), items)
+                self.sync_status_folder(os.path.dirname(os.path.abspath(self.state_file().filename)))
+            except (IOError, OSError) as e:
+                logg.error("writing STATUS %s: %s\n\t to state file %s", status, e, self.state_file().filename)
+            return True
+        lines = []
+        for key in sorted(conf.status):
+            value = conf.status[key]
+            if key == "MainPID" and str(value) == "0":
+                logg.warning("ignore writing MainPID=0")
+                continue
+            lines.append("{}={}\n".format(key, str(value)))
+        logg.debug("writing to %s\n\t%s", status_file, "\t".join(lines).strip())
         try:
-            with open(status_file, "w") as f:
-                for key in sorted(conf.status):
-                    value = conf.status[key]
-                    if key == "MainPID" and str(value) == "0":
-                        logg.warning("ignore writing MainPID=0")
-                        continue
-                    content = "{}={}\n".format(key, str(value))
-                    logg.debug("writing to %s\n\t%s", status_file, content.strip())
-                    f.write(content)
-        except IOError as e:
+            shutil_atomic_write(status_file, "".join(lines), SYNC_STATUS_FILES)
+            self.sync_status_folder(dirpath)
+        except (IOError, OSError) as e:
             logg.error("writing STATUS %s: %s\n\t to status file %s", status, e, status_file)
         return True
+    def sync_status_folder(self, folder):
+        """ with SYNC_STATUS_FILES the renamed status files are made durable
+            by an fsync of their folder - which is done only once per folder
+            when a group of units is started or stopped together. """
+        if not SYNC_STATUS_FILES or not folder:
+            return
+        if self._sync_folders is not None:
+            self._sync_folders.add(folder)
+            return
+        try:
+            shutil_fsync_dir(folder)
+            logg.debug("synced status folder %s", folder)
+        except OSError as e:
+            logg.debug("can not sync %s: %s", folder, e)
+    def sync_status_begin(self): # -> bool(grouped here)
+        if self._sync_folders is not None:
+            return False
+        self._sync_folders = set()
+        return True
+    def sync_status_end(self, grouped = True):
+        if not grouped or self._sync_folders is None:
+            return
+        folders, self._sync_folders = self._sync_folders, None
+        for folder in sorted(folders):
+            self.sync_status_folder(folder)
+    def status_folder_from(self, conf): # -> path
+        if self.use_state_file(conf):
+            return os.path.dirname(os.path.abspath(self.state_file().filename))
+        status_file = self.status_file_from(conf)
+        return status_file and os.path.dirname(os.path.abspath(status_file))
     def read_status_from(self, conf, defaults = None):
         status_file = self.status_file_from(conf)
         status = {}
@@ -1350,6 +2444,12 @@ class Systemctl:
                status[key] = defaults[key]
         elif isinstance(defaults, string_types):
            status["ActiveState"] = defaults
+        if self.use_state_file(conf):
+            try:
+                status.update(self.state_file().read().get(conf.name(), {}))
+            except (IOError, OSError) as e:
+                logg.warning("bad read of state file '%s': %s", self.state_file().filename, e)
+            return status
         if not status_file:
             logg.debug("no status file. returning %s", status)
             return status
@@ -1397,6 +2497,15 @@ class Systemctl:
             time.sleep(EpsilonTime)
             logg.info(" %s ................. boot sleep %ss", hint or "", EpsilonTime)
     def get_boottime(self):
+        """ the boot time does not change - it is resolved only once for
+            all the status and pid files that are checked in this process """
+        global _boottime
+        if _boottime is None:
+            _boottime = self.get_boottime_from_proc()
+        return _boottime
+    def get_boottime_from_proc(self):
+        if BOOT_TIME:
+            return float(BOOT_TIME)
         if "oldest" in COVERAGE:
             return self.get_boottime_oldest()
         for pid in xrange(10):
@@ -1406,19 +2515,18 @@ class Systemctl:
                     return os.path.getmtime(proc)
             except Exception as e: # pragma: nocover
                 logg.warning("could not access %s: %s", proc, e)
+        booted = proc_starttime(1)
+        if booted:
+            return booted
         return self.get_boottime_oldest()
-    def get_boottime_oldest(self):
+    def get_boottime_oldest(self, procs = None):
         # otherwise get the oldest entry in /proc
         booted = time.time()
-        for name in os.listdir("/proc"):
-            proc = "/proc/%s/status" % name
-            try:
-                if os.path.exists(proc):
-                    ctime = os.path.getmtime(proc)
-                    if ctime < booted:
-                        booted = ctime 
-            except Exception as e: # pragma: nocover
-                logg.warning("could not access %s: %s", proc, e)
+        procs = procs or ProcTable()
+        for pid in procs.pids():
+            ctime = procs.mtime[pid]
+            if ctime < booted:
+                booted = ctime
         return booted
     def get_filetime(self, filename):
         return os.path.getmtime(filename)
@@ -1428,12 +2536,12 @@ class Systemctl:
         if isinstance(filetime, float):
             filetime -= EpsilonTime
         if filetime >= boottime :
-            logg.debug("  file time: %s", datetime.datetime.fromtimestamp(filetime))
-            logg.debug("  boot time: %s", datetime.datetime.fromtimestamp(boottime))
+            logg.debug("  file time: %s", LogTime(filetime))
+            logg.debug("  boot time: %s", LogTime(boottime))
             return False # OK
         logg.info("truncate old %s", filename)
-        logg.info("  file time: %s", datetime.datetime.fromtimestamp(filetime))
-        logg.info("  boot time: %s", datetime.datetime.fromtimestamp(boottime))
+        logg.info("  file time: %s", LogTime(filetime))
+        logg.info("  boot time: %s", LogTime(boottime))
         try:
             shutil_truncate(filename)
         except Exception as e:
@@ -1463,18 +2571,15 @@ class Systemctl:
                 line = real_line.strip()
                 if not line or line.startswith("#"):
                     continue
-                m = re.match(r"(?:export +)?([\w_]+)[=]'([^']*)'", line)
-                if m:
-                    yield m.group(1), m.group(2)
-                    continue
-                m = re.match(r'(?:export +)?([\w_]+)[=]"([^"]*)"', line)
-                if m:
-                    yield m.group(1), m.group(2)
-                    continue
-                m = re.match(r'(?:export +)?([\w_]+)[=](.*)', line)
+                m = _env_file_line.match(line)
                 if m:
-                    yield m.group(1), m.group(2)
-                    continue
+                    name, single, double, value = m.groups()
+                    if single is not None:
+                        yield name, single
+                    elif double is not None:
+                        yield name, double
+                    else:
+                        yield name, value
         except Exception as e:
             logg.info("while reading %s: %s", env_file, e)
     def read_env_part(self, env_part): # -> generate[ (name, value) ]
@@ -1506,7 +2611,33 @@ class Systemctl:
         return self.get_env(conf)
     def extra_vars(self):
         return self._extra_vars # from command line
+    def env_file_stat(self, env_file): # -> key
+        if env_file.startswith("-"):
+            env_file = env_file[1:]
+        try:
+            st = os.stat(os_path(self._root, env_file))
+            return (env_file, st.st_mtime, st.st_size, st.st_ino)
+        except OSError:
+            return (env_file, None, None, None)
+    def get_env_key(self, conf): # -> key
+        """ the environment of a unit changes when an env file changes """
+        files = []
+        for env_file in conf.getlist("Service", "EnvironmentFile", []):
+            files.append(self.env_file_stat(self.expand_special(env_file, conf)))
+        for extra in self.extra_vars():
+            if extra.startswith("@"):
+                files.append(self.env_file_stat(extra[1:]))
+        return (tuple(files), tuple(self.extra_vars()))
     def get_env(self, conf):
+        """ the environment for the Exec commands (a copy for each call) """
+        key = self.get_env_key(conf)
+        if conf.env_cache is not None and conf.env_cache[0] == key:
+            logg.debug("cached environment of %s", conf.name())
+            return conf.env_cache[1].copy()
+        env = self.read_env(conf)
+        conf.env_cache = (key, env)
+        return env.copy()
+    def read_env(self, conf):
         env = os.environ.copy()
         for env_part in conf.getlist("Service", "Environment", []):
             for name, value in self.read_env_part(self.expand_special(env_part, conf)):
@@ -1526,86 +2657,97 @@ class Systemctl:
                     env[name] = value # a '$word' is not special here
         return env
     def expand_env(self, cmd, env):
+        """ expands $NAME and ${NAME} in one pass over the text. The values
+            are expanded again for their ${NAME} parts (up to a maxdepth)."""
+        exceeded = []
+        def get_env(name, braces, depth):
+            if name not in env:
+                if braces:
+                    logg.debug("can not expand ${%s}", name)
+                else:
+                    logg.debug("can not expand $%s", name)
+                return "" # empty string
+            value = env[name]
+            if "${" not in value:
+                return value
+            if depth >= _env_maxdepth:
+                exceeded.append(name)
+                return value
+            return _env_brace_var.sub(lambda m: get_env(m.group(1), True, depth + 1), value)
         def get_env1(m):
-            if m.group(1) in env:
-                return env[m.group(1)]
-            logg.debug("can not expand $%s", m.group(1))
-            return "" # empty string
-        def get_env2(m):
-            if m.group(1) in env:
-                return env[m.group(1)]
-            logg.debug("can not expand ${%s}", m.group(1))
-            return "" # empty string
-        #
-        maxdepth = 20
-        expanded = re.sub("[$](\w+)", lambda m: get_env1(m), cmd.replace("\\\n",""))
-        for depth in xrange(maxdepth):
-            new_text = re.sub("[$][{](\w+)[}]", lambda m: get_env2(m), expanded)
-            if new_text == expanded:
-                return expanded
-            expanded = new_text
-        logg.error("shell variable expansion exceeded maxdepth %s", maxdepth)
+            if m.group(1):
+                return get_env(m.group(1), False, 1)
+            return get_env(m.group(2), True, 1)
+        expanded = _env_var.sub(get_env1, cmd.replace("\\\n",""))
+        if exceeded:
+            logg.error("shell variable expansion exceeded maxdepth %s", _env_maxdepth)
         return expanded
+    def get_specials(self, conf):
+        """ the values for expand_special - computed once per unit """
+        if conf.specials is not None:
+            return conf.specials
+        def sh_escape(value):
+            return "'" + value.replace("'","\\'") + "'"
+        confs={ "%": "%" }
+        unit = parse_unit(conf.name())
+        confs["N"] = unit.name
+        confs["n"] = sh_escape(unit.name)
+        confs["P"] = unit.prefix
+        confs["p"] = sh_escape(unit.prefix)
+        confs["I"] = unit.instance
+        confs["i"] = sh_escape(unit.instance)
+        confs["J"] = unit.component
+        confs["j"] = sh_escape(unit.component)
+        confs["f"] = sh_escape(conf.filename())
+        VARTMP = "/var/tmp"
+        TMP = "/tmp"
+        RUN = "/run"
+        DAT = "/var/lib"
+        LOG = "/var/log"
+        CACHE = "/var/cache"
+        CONFIG = "/etc"
+        HOME = "/root"
+        USER = "root"
+        UID = 0
+        SHELL = "/bin/sh"
+        if self.is_user_conf(conf):
+            USER = os_getlogin()
+            HOME = get_home()
+            RUN = os.environ.get("XDG_RUNTIME_DIR", get_runtime_dir())
+            CONFIG = os.environ.get("XDG_CONFIG_HOME", HOME + "/.config")
+            CACHE = os.environ.get("XDG_CACHE_HOME", HOME + "/.cache")
+            SHARE = os.environ.get("XDG_DATA_HOME", HOME + "/.local/share")
+            DAT = CONFIG
+            LOG = os.path.join(CONFIG, "log")
+            SHELL = os.environ.get("SHELL", SHELL)
+            VARTMP = os.environ.get("TMPDIR", os.environ.get("TEMP", os.environ.get("TMP", VARTMP)))
+            TMP = os.environ.get("TMPDIR", os.environ.get("TEMP", os.environ.get("TMP", TMP)))
+        confs["V"] = os_path(self._root, VARTMP)
+        confs["T"] = os_path(self._root, TMP)
+        confs["t"] = os_path(self._root, RUN)
+        confs["S"] = os_path(self._root, DAT)
+        confs["s"] = SHELL
+        confs["h"] = HOME
+        confs["u"] = USER
+        confs["C"] = os_path(self._root, CACHE)
+        confs["E"] = os_path(self._root, CONFIG)
+        conf.specials = confs
+        return confs
     def expand_special(self, cmd, conf = None):
         """ expand %i %t and similar special vars. They are being expanded
             before any other expand_env takes place which handles shell-style
             $HOME references. """
-        def sh_escape(value):
-            return "'" + value.replace("'","\\'") + "'"
-        def get_confs(conf):
-            confs={ "%": "%" }
-            if not conf:
-                return confs
-            unit = parse_unit(conf.name())
-            confs["N"] = unit.name
-            confs["n"] = sh_escape(unit.name)
-            confs["P"] = unit.prefix
-            confs["p"] = sh_escape(unit.prefix)
-            confs["I"] = unit.instance
-            confs["i"] = sh_escape(unit.instance)
-            confs["J"] = unit.component
-            confs["j"] = sh_escape(unit.component)
-            confs["f"] = sh_escape(conf.filename())
-            VARTMP = "/var/tmp"
-            TMP = "/tmp"
-            RUN = "/run"
-            DAT = "/var/lib"
-            LOG = "/var/log"
-            CACHE = "/var/cache"
-            CONFIG = "/etc"
-            HOME = "/root"
-            USER = "root"
-            UID = 0
-            SHELL = "/bin/sh"
-            if self.is_user_conf(conf):
-                USER = os_getlogin()
-                HOME = get_home()
-                RUN = os.environ.get("XDG_RUNTIME_DIR", get_runtime_dir())
-                CONFIG = os.environ.get("XDG_CONFIG_HOME", HOME + "/.config")
-                CACHE = os.environ.get("XDG_CACHE_HOME", HOME + "/.cache")
-                SHARE = os.environ.get("XDG_DATA_HOME", HOME + "/.local/share")
-                DAT = CONFIG
-                LOG = os.path.join(CONFIG, "log")
-                SHELL = os.environ.get("SHELL", SHELL)
-                VARTMP = os.environ.get("TMPDIR", os.environ.get("TEMP", os.environ.get("TMP", VARTMP)))
-                TMP = os.environ.get("TMPDIR", os.environ.get("TEMP", os.environ.get("TMP", TMP)))
-            confs["V"] = os_path(self._root, VARTMP)
-            confs["T"] = os_path(self._root, TMP)
-            confs["t"] = os_path(self._root, RUN)
-            confs["S"] = os_path(self._root, DAT)
-            confs["s"] = SHELL
-            confs["h"] = HOME
-            confs["u"] = USER
-            confs["C"] = os_path(self._root, CACHE)
-            confs["E"] = os_path(self._root, CONFIG)
-            return confs
+        if "%" not in cmd:
+            return cmd
+        confs = { "%": "%" }
+        if conf:
+            confs = self.get_specials(conf)
         def get_conf1(m):
-            confs = get_confs(conf)
             if m.group(1) in confs:
                 return confs[m.group(1)]
             logg.warning("can not expand %%%s", m.group(1))
             return "''" # empty escaped string
-        return re.sub("[%](.)", lambda m: get_conf1(m), cmd)
+        return _special_var.sub(get_conf1, cmd)
     def exec_cmd(self, cmd, env, conf = None):
         """ expand ExecCmd statements including %i and $MAINPID """
         cmd1 = cmd.replace("\\\n","")
@@ -1625,10 +2767,10 @@ class Systemctl:
                 return env[m.group(1)]
             logg.debug("can not expand ${%s}", m.group(1))
             return "" # empty string
-        cmd3 = re.sub("[$](\w+)", lambda m: get_env1(m), cmd2)
+        cmd3 = _env_word_var.sub(get_env1, cmd2)
         newcmd = []
         for part in shlex.split(cmd3):
-            newcmd += [ re.sub("[$][{](\w+)[}]", lambda m: get_env2(m), part) ]
+            newcmd += [ _env_brace_var.sub(get_env2, part) ]
         return newcmd
     def path_journal_log(self, conf): # never None
         """ /var/log/zzz.service.log or /var/log/default.unit.log """
@@ -1645,7 +2787,14 @@ class Systemctl:
         log_folder = os.path.dirname(log_file)
         if not os.path.isdir(log_folder):
             os.makedirs(log_folder)
+        self.check_journal_log(conf)
         return open(os.path.join(log_file), "a")
+    def check_journal_log(self, conf):
+        log_file = self.path_journal_log(conf)
+        try:
+            JournalLog(log_file).check()
+        except Exception as e:
+            logg.warning("can not rotate %s: %s", log_file, e)
     def chdir_workingdir(self, conf):
         """ if specified then change the working directory """
         # the original systemd will start in '/' even if User= is given
@@ -1670,9 +2819,32 @@ class Systemctl:
                    logg.debug("chdir workingdir '%s': %s", into, e)
                    return None
         return None
+    def workingdir_change(self, conf):
+        """ the directory that chdir_workingdir would go into - or None if
+            the new process can just inherit the current directory """
+        into = self._root
+        workingdir = conf.get("Service", "WorkingDirectory", "")
+        if workingdir:
+            if workingdir.startswith("-"):
+                workingdir = workingdir[1:]
+            into = os_path(self._root, self.expand_special(workingdir, conf))
+        if into:
+            try:
+                if os.path.realpath(into) == os.getcwd():
+                    return None
+            except OSError as e:
+                logg.debug("getcwd: %s", e)
+            return into
+        return None
     def notify_socket_from(self, conf, socketfile = None):
-        """ creates a notify-socket for the (non-privileged) user """
+        """ creates a notify-socket for the (non-privileged) user - or takes
+            the one of the init-loop that is already listening for the unit """
+        import socket
         NotifySocket = collections.namedtuple("NotifySocket", ["socket", "socketfile" ])
+        for known, notify, ino in self._notify_sockets.values():
+            if known.name() == conf.name() and not socketfile:
+                logg.debug("use the notify socket of the init-loop %s", notify.socketfile)
+                return notify
         notify_socket_folder = conf.os_path_var(_notify_socket_folder)
         notify_name = "notify." + str(conf.name() or "systemctl")
         notify_socket = os.path.join(notify_socket_folder, notify_name)
@@ -1698,6 +2870,7 @@ class Systemctl:
         os.chmod(socketfile, 0o777) # the service my run under some User=setting
         return NotifySocket(sock, socketfile)
     def read_notify_socket(self, notify, timeout):
+        import socket
         notify.socket.settimeout(timeout or DefaultMaximumTimeout)
         result = ""
         try:
@@ -1712,6 +2885,8 @@ class Systemctl:
                 logg.debug("socket.timeout %s", e)
         return result
     def wait_notify_socket(self, notify, timeout, pid = None):
+        """ wait for READY=1 on the notify socket - or the (main) PID to
+            die. Without a pidfd the PID is checked once per second. """
         if not os.path.exists(notify.socketfile):
             logg.info("no $NOTIFY_SOCKET exists")
             return {}
@@ -1719,33 +2894,371 @@ class Systemctl:
         logg.info("wait $NOTIFY_SOCKET, timeout %s", timeout)
         results = {}
         seenREADY = None
-        for attempt in xrange(timeout+1):
-            if pid and not self.is_active_pid(pid):
-                logg.info("dead PID %s", pid)
-                return results
-            if not attempt: # first one
-                time.sleep(1) # until TimeoutStartSec
-                continue
-            result = self.read_notify_socket(notify, 1) # sleep max 1 second
-            if not result: # timeout
-                time.sleep(1) # until TimeoutStartSec
-                continue
-            for name, value in self.read_env_part(result):
-                results[name] = value
-                if name == "READY":
-                    seenREADY = value
-                if name in ["STATUS", "ACTIVESTATE"]:
-                    logg.debug("%s: %s", name, value) # TODO: update STATUS -> SubState
-            if seenREADY:
-                break
+        deadline = time.time() + timeout
+        pidfd = pidfd_open(pid) if pid else None
+        try:
+            while True:
+                if pid and not self.is_active_pid(pid):
+                    logg.info("dead PID %s", pid)
+                    return results
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                waits = [ notify.socket.fileno() ]
+                if pidfd is not None:
+                    waits.append(pidfd)
+                elif pid:
+                    remaining = min(remaining, 1)
+                try:
+                    ready, _, _ = select.select(waits + list(self._log_drain), [], [], remaining)
+                except (select.error, OSError) as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    continue
+                units = [ self._log_drain[fd] for fd in ready if fd in self._log_drain ]
+                if units:
+                    self.read_log_files(units)
+                if notify.socket.fileno() not in ready:
+                    continue # timeout or the PID has died
+                result = self.read_notify_socket(notify, 1)
+                for name, value in self.read_env_part(result):
+                    results[name] = value
+                    if name == "READY":
+                        seenREADY = value
+                    if name in ["STATUS", "ACTIVESTATE"]:
+                        logg.debug("%s: %s", name, value) # TODO: update STATUS -> SubState
+                    if name == "MAINPID" and to_int(value) and to_int(value) != to_int(pid):
+                        logg.debug("wait for new MAINPID %s (was PID %s)", value, pid)
+                        if pidfd is not None:
+                            os.close(pidfd)
+                        pid = to_int(value)
+                        pidfd = pidfd_open(pid)
+                if seenREADY:
+                    break
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
         if not seenREADY:
             logg.info(".... timeout while waiting for 'READY=1' status on $NOTIFY_SOCKET")
         logg.debug("notify = %s", results)
+        if notify.socket.fileno() in self._notify_sockets:
+            return results # the init-loop goes on listening
+        try:
+            notify.socket.close()
+        except Exception as e:
+            logg.debug("socket.close %s", e)
+        return results
+    def start_notify_sockets(self, units, readers):
+        """ the init-loop keeps listening to the notify services """
+        self._notify_sockets = {}
+        for unit in units:
+            conf = self.load_unit_conf(unit)
+            if not conf: continue
+            if conf.get("Service", "Type", "simple").lower() not in [ "notify" ]:
+                continue
+            self.listen_notify_socket(conf, readers)
+    def listen_notify_socket(self, conf, readers):
+        try:
+            notify = self.notify_socket_from(conf)
+            ino = os.stat(notify.socketfile).st_ino
+        except Exception as e:
+            logg.error("can not listen to %s notify socket: %s", conf.name(), e)
+            return
+        self._notify_sockets[notify.socket.fileno()] = (conf, notify, ino)
+        readers[notify.socket.fileno()] = self.read_notify_updates
+    def check_notify_sockets(self, readers):
+        """ a systemctl that did run standalone has bound the notify socket
+            path of a unit for its start - the init-loop takes it back when
+            that is done (the unit is not locked anymore) """
+        for fd in list(self._notify_sockets):
+            conf, notify, ino = self._notify_sockets[fd]
+            try:
+                if os.stat(notify.socketfile).st_ino == ino:
+                    continue
+            except OSError:
+                pass # removed
+            if self.is_locked_unit(conf):
+                continue
+            logg.debug("notify socket %s was replaced, listen again", notify.socketfile)
+            self._notify_sockets.pop(fd)
+            readers.pop(fd, None)
+            notify.socket.close()
+            self.listen_notify_socket(conf, readers)
+    def is_locked_unit(self, conf):
+        """ a start/stop of another systemctl holds the unit lock """
+        lockfile = waitlock(conf, shared = True).lockfile()
+        try:
+            fd = os.open(lockfile, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except (IOError, OSError):
+            return True
+        finally:
+            os.close(fd)
+    def read_notify_updates(self, fd):
+        """ MAINPID=, STATUS= and RELOADING=1 / READY=1 go to the status file """
+        conf, notify, ino = self._notify_sockets[fd]
+        result = self.read_notify_socket(notify, 1)
+        status = {}
+        for line in result.split("\n"):
+            name, _, value = line.strip().partition("=")
+            if name == "MAINPID" and to_int(value):
+                status["MainPID"] = to_int(value)
+            elif name == "STATUS":
+                status["StatusText"] = value
+            elif name == "RELOADING" and value == "1":
+                status["SubState"] = "reloading"
+            elif name == "READY" and value == "1":
+                status["SubState"] = None
+        if status:
+            logg.debug("notify %s: %s", conf.name(), status)
+            conf.status = None # another systemctl may have changed it
+            self.write_status_from(conf, **status)
+    def stop_notify_sockets(self, readers):
+        for fd in list(self._notify_sockets):
+            conf, notify, ino = self._notify_sockets.pop(fd)
+            readers.pop(fd, None)
+            try:
+                notify.socket.close()
+            except Exception as e:
+                logg.debug("socket.close %s", e)
+    def control_socket_file(self):
+        """ the init-loop runs the commands of a systemctl client (see control_client) """
+        return self.os_path_var(os.path.join(_notify_socket_folder, _control_socket_name))
+    def start_control_socket(self, readers):
+        """ the init-loop listens on a unix socket that only the owner may use """
+        import socket
+        socketfile = self.control_socket_file()
+        if len(socketfile) > 100:
+            logg.debug("no control socket, the path is too long: %s", socketfile)
+            return False
+        try:
+            if not os.path.isdir(os.path.dirname(socketfile)):
+                os.makedirs(os.path.dirname(socketfile))
+            if os.path.exists(socketfile):
+                os.unlink(socketfile)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            old_umask = os.umask(0o077)
+            try:
+                sock.bind(socketfile)
+            finally:
+                os.umask(old_umask)
+            os.chmod(socketfile, 0o600)
+            sock.listen(8)
+        except Exception as e:
+            logg.warning("can not listen to control socket %s: %s", socketfile, e)
+            return False
+        fcntl.fcntl(sock.fileno(), fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        self._control_socket = sock
+        readers[sock.fileno()] = self.read_control_request
+        return True
+    def stop_control_socket(self, readers):
+        sock = self._control_socket
+        if not sock:
+            return
+        self._control_socket = None
+        readers.pop(sock.fileno(), None)
+        sock.close()
+        socketfile = self.control_socket_file()
+        try:
+            os.unlink(socketfile)
+        except OSError as e:
+            logg.debug("unlink %s: %s", socketfile, e)
+    def stop_control_workers(self):
+        """ a pending control request does not outlive the init-loop """
+        for pid in list(self._control_workers):
+            logg.info("stop control worker %s", pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError as e:
+                logg.debug("control worker %s: %s", pid, e)
+            self._control_workers.pop(pid, None)
+    def read_control_request(self, fd):
+        """ one request per connection - it is run in a forked worker so that
+            the init-loop goes on (the reply is sent when the command is done) """
+        import socket
         try:
-            notify.socket.close()
+            conn, _ = self._control_socket.accept()
+        except socket.error as e:
+            logg.warning("control socket: %s", e)
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            pid = os.fork()
+        except OSError as e:
+            logg.warning("control request failed: %s", e)
+            conn.close()
+            return
+        if pid:
+            conn.close()
+            self._control_workers[pid] = time.time()
+            logg.debug("control request in worker %s", pid)
+            return
+        code = 1 # pragma: no cover (child process)
+        try:
+            signal.set_wakeup_fd(-1)
+            for signum in [ signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGQUIT ]:
+                signal.signal(signum, signal.SIG_DFL)
+            code = self.control_worker(conn)
+        finally:
+            os._exit(code)
+    def control_worker(self, conn): # -> exitcode
+        import json
+        try:
+            fcntl.fcntl(conn.fileno(), fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            conn.settimeout(ControlTimeout)
+            data = b""
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            if not data:
+                return 0 # the client did run standalone
+            request = json.loads(data.decode("utf-8"))
+            conn.settimeout(None)
+            reply = self.control_request(request)
+            conn.sendall(json.dumps(reply).encode("utf-8"))
+            return 0
         except Exception as e:
-            logg.debug("socket.close %s", e)
-        return results
+            logg.warning("control request failed: %s", e)
+            return 1
+        finally:
+            conn.close()
+    def control_request(self, request):
+        """ run a command of a client with its options and its environment
+            (in a worker of the init-loop) - the output and the log messages
+            are returned in a dict with the exitcode """
+        args = [ to_str(arg) for arg in request.get("args", []) ]
+        if not args or args[0] not in ControlCommands:
+            return { "code": 1, "out": "", "err": "ERROR:systemctl:not a control command %s\n" % args[:1] }
+        options = request.get("options", {})
+        unknown = [ to_str(name) for name in options if name not in ControlOptions ]
+        if unknown:
+            return { "code": 1, "out": "", "err": "ERROR:systemctl:unsupported options %s\n" % unknown }
+        logg.info("control request: %s", " ".join(args))
+        verbose = request.get("verbose", 0)
+        for name, value in options.items():
+            if isinstance(value, list):
+                value = [ to_str(item) for item in value ]
+            elif isinstance(value, string_types):
+                value = to_str(value)
+            setattr(self, to_str(name), value)
+        self._init = False # no nested init-loop
+        self._now = False
+        if "env" in request:
+            os.environ.clear()
+            for name, value in request["env"].items():
+                os.environ[to_str(name)] = to_str(value)
+        if request.get("cwd"):
+            try:
+                os.chdir(to_str(request["cwd"]))
+            except OSError as e:
+                logg.debug("control request cwd: %s", e)
+        self.forget_unit_status(environment = True)
+        out = CaptureOutput(sys.stdout.fileno())
+        err = CaptureOutput(sys.stderr.fileno())
+        handler = logging.StreamHandler(err)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        handler.setLevel(max(0, logging.ERROR - 10 * verbose))
+        logg.addHandler(handler)
+        logg.setLevel(min(logg.level, handler.level))
+        stdout = sys.stdout
+        sys.stdout = out
+        worker_pid = os.getpid()
+        try:
+            found, result = run_command(self, args[0], args[1:])
+            code = print_result(result)
+        except Exception as e:
+            if os.getpid() != worker_pid: # pragma: no cover (child process)
+                os._exit(1) # a forked child must not send a reply
+            logg.error("%s: %s", " ".join(args), e)
+            code = 1
+        finally:
+            sys.stdout = stdout
+            logg.removeHandler(handler)
+        return { "code": code, "out": out.getvalue(), "err": err.getvalue() }
+    def forget_unit_status(self, environment = False):
+        """ the status files may have been changed by another process """
+        for conf in list(self._loaded_file_sysd.values()) + list(self._loaded_file_sysv.values()):
+            if conf is not None:
+                conf.status = None
+                if environment:
+                    conf.specials = None
+                    conf.env_cache = None
+    def control_client(self, args, verbose = 0): # -> exitcode | None
+        """ when there is an init-loop with a control socket then the command
+            is run over there - returns None if it needs to be run standalone """
+        if not args or args[0] not in ControlCommands:
+            return None
+        if self._init or self._now or self._jobs > 1:
+            return None # not as a control request
+        socketfile = self.control_socket_file()
+        if len(socketfile) > 100 or not os.path.exists(socketfile):
+            return None
+        import json
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socketfile)
+            peer_pid = self.control_peer_pid(sock)
+            if self.control_deadlock(peer_pid):
+                logg.debug("control socket of PID %s is our parent, run standalone", peer_pid)
+                sock.close()
+                return None
+            options = dict([ (name, getattr(self, name)) for name in ControlOptions ])
+            request = { "args": args, "verbose": verbose, "options": options,
+                        "env": dict(os.environ), "cwd": os.getcwd() }
+            sock.sendall(json.dumps(request).encode("utf-8"))
+            sock.shutdown(socket.SHUT_WR)
+        except socket.error as e:
+            logg.debug("control socket %s: %s", socketfile, e)
+            sock.close()
+            return None
+        try:
+            data = b""
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            reply = json.loads(data.decode("utf-8"))
+        except Exception as e:
+            logg.error("control socket %s: no reply: %s", socketfile, e)
+            return 1
+        finally:
+            sock.close()
+        sys.stdout.write(to_str(reply.get("out", "")))
+        sys.stderr.write(to_str(reply.get("err", "")))
+        return reply.get("code", 1)
+    def control_peer_pid(self, sock):
+        """ SO_PEERCRED is (pid, uid, gid) of the init-loop """
+        import socket
+        import struct
+        so_peercred = getattr(socket, "SO_PEERCRED", 17)
+        try:
+            creds = sock.getsockopt(socket.SOL_SOCKET, so_peercred, struct.calcsize("3i"))
+            pid, uid, gid = struct.unpack("3i", creds)
+            return pid
+        except (socket.error, struct.error) as e:
+            logg.debug("no peer credentials: %s", e)
+            return 0
+    def control_deadlock(self, peer_pid):
+        """ a service started by the init-loop may run 'systemctl' while
+            the init-loop is still busy with the start of that service """
+        pid = os.getppid()
+        for depth in xrange(ProcMaxDepth):
+            if pid <= 1:
+                return False
+            if pid == peer_pid:
+                return True
+            pid = ProcTable([ pid ]).ppid.get(pid, 0)
+        return False
     def start_modules(self, *modules):
         """ [UNIT]... -- start these units
         /// SPECIAL: with --now or --init it will
@@ -1770,17 +3283,130 @@ class Systemctl:
         self.wait_system()
         done = True
         started_units = []
-        for unit in self.sortedAfter(units):
-            started_units.append(unit)
-            if not self.start_unit(unit):
-                done = False
+        if init:
+            self.start_log_pipes(units)
+            self.start_log_drain(units)
+        grouped = self.sync_status_begin()
+        try:
+            if self._jobs > 1:
+                started_units = self.sortedAfter(units)
+                done = self.start_units_parallel(started_units)
+            else:
+                for unit in self.sortedAfter(units):
+                    started_units.append(unit)
+                    if not self.start_unit(unit):
+                        done = False
+        finally:
+            self.sync_status_end(grouped)
+            self.stop_log_drain()
         if init:
             logg.info("init-loop start")
             sig = self.init_loop_until_stop(started_units)
             logg.info("init-loop %s", sig)
-            for unit in reversed(started_units):
-                self.stop_unit(unit)
+            self.start_log_drain(started_units) # the services may log on SIGTERM
+            try:
+                self.stop_units(list(reversed(started_units)), ShutdownTimeout or DefaultMaximumTimeout)
+                self.reap_children() # the stopped services (as a subreaper)
+            finally:
+                self.stop_log_drain()
+                self.read_log_files(started_units)
+                self.stop_log_files(started_units)
+        return done
+    def start_units_parallel(self, units):
+        """ start the (sorted) units with up to --jobs forked workers. A unit
+            is started when the earlier units that it is ordered after (or
+            that it requires) are done. Later units in the list are never
+            waited for - so an ordering cycle can not block the start. """
+        waits = self.parallel_units_waits(units)
+        done, unfinished = self.parallel_units_run(units, waits, self.start_unit)
         return done
+    def parallel_units_waits(self, units, stopping = False):
+        """ for each unit in the list the indices of the earlier units that
+            must be done before - from After/Before and Requires/BindsTo.
+            On stopping, the units are expected in reverse start order. """
+        conflist = [ self.get_unit_conf(unit) for unit in units ]
+        waits = [ [] for unit in units ]
+        def wait_for(index, other):
+            if other < index and other not in waits[index]:
+                waits[index].append(other)
+        for index, others in enumerate(orderingGraph(conflist)):
+            for other in others:
+                if stopping:
+                    wait_for(index, other)
+                else:
+                    wait_for(other, index)
+        positions = dict([ (unit, index) for index, unit in enumerate(units) ])
+        for index, conf in enumerate(conflist):
+            for style in [ "Requires", "Requisite", "BindsTo" ]:
+                for requirelist in conf.getlist("Unit", style, []):
+                    for required in requirelist.split(" "):
+                        other = positions.get(required.strip(), index)
+                        if stopping:
+                            wait_for(other, index)
+                        else:
+                            wait_for(index, other)
+        return waits
+    def parallel_units_run(self, units, waits, action, deadline = None):
+        """ run the action for each unit in a forked worker, at most --jobs
+            at the same time, each unit after the units in its waits list.
+            Returns the success and the units that did not finish before
+            the deadline as a dict of unit => worker pid (or None). """
+        done = True
+        finished = set()
+        pending = list(xrange(len(units)))
+        running = {} # pid => index
+        while pending or running:
+            for index in list(pending):
+                if len(running) >= self._jobs:
+                    break
+                if [ other for other in waits[index] if other not in finished ]:
+                    continue
+                pending.remove(index)
+                sys.stdout.flush()
+                sys.stderr.flush()
+                pid = os.fork()
+                if not pid: # pragma: no cover (child process)
+                    self._log_drain = {} # the parent reads the log pipes
+                    try:
+                        if action(units[index]):
+                            os._exit(0)
+                    except BaseException as e:
+                        logg.error("%s: %s failed: %s", units[index], action.__name__, e)
+                    os._exit(1)
+                logg.debug("%s %s in worker %s", action.__name__, units[index], pid)
+                running[pid] = index
+            try:
+                if deadline is None and not self._log_drain:
+                    pid, status = os.waitpid(-1, 0)
+                elif deadline is not None and time.time() > deadline:
+                    break
+                else:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                    if not pid:
+                        remaining = deadline is None and DefaultMaximumTimeout or deadline - time.time()
+                        self.wait_log_pipes(remaining, list(running), poll = MinimumYield)
+                        continue
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if pid not in running:
+                continue # some other child (like in the init-loop)
+            index = running.pop(pid)
+            finished.add(index)
+            if not os.WIFEXITED(status) or os.WEXITSTATUS(status):
+                logg.debug("%s %s failed in worker %s (status %s)", action.__name__, units[index], pid, status)
+                done = False
+        for unit in units:
+            conf = self.get_unit_conf(unit)
+            conf.status = None # it was changed by the workers
+            self.sync_status_folder(self.status_folder_from(conf))
+        unfinished = {}
+        for pid, index in running.items():
+            unfinished[units[index]] = pid
+        for index in pending:
+            unfinished[units[index]] = None
+        return done, unfinished
     def start_unit(self, unit):
         conf = self.load_unit_conf(unit)
         if conf is None:
@@ -1802,6 +3428,10 @@ class Systemctl:
             logg.debug(" start unit %s => %s", conf.name(), conf.filename())
             return self.do_start_unit_from(conf)
     def do_start_unit_from(self, conf):
+        done = self.do_start_unit_sequence_from(conf)
+        self.check_journal_log(conf) # the index marks the output of the start
+        return done
+    def do_start_unit_sequence_from(self, conf):
         timeout = self.get_TimeoutStartSec(conf)
         doRemainAfterExit = conf.getbool("Service", "RemainAfterExit", "no")
         runs = conf.get("Service", "Type", "simple").lower()
@@ -1817,10 +3447,8 @@ class Systemctl:
                 check, cmd = checkstatus(cmd)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info(" pre-start %s", shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid: 
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 logg.debug(" pre-start done (%s) <-%s>",
                     run.returncode or "OK", run.signal or "")
                 if run.returncode and check:
@@ -1836,11 +3464,8 @@ class Systemctl:
                 env["SYSTEMCTL_SKIP_REDIRECT"] = "yes"
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s start %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid: # pragma: no cover
-                    os.setsid() # detach child process from parent
-                    self.execve_from(conf, newcmd, env)
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env, setsid = True)
+                run = self.wait_subprocess(forkpid)
                 self.set_status_from(conf, "ExecMainCode", run.returncode)
                 logg.info("%s start done (%s) <-%s>", runs, 
                     run.returncode or "OK", run.signal or "")
@@ -1856,11 +3481,8 @@ class Systemctl:
                 check, cmd = checkstatus(cmd)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s start %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid: # pragma: no cover
-                    os.setsid() # detach child process from parent
-                    self.execve_from(conf, newcmd, env)
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env, setsid = True)
+                run = self.wait_subprocess(forkpid)
                 if run.returncode and check: 
                     returncode = run.returncode
                     service_result = "failed"
@@ -1890,14 +3512,11 @@ class Systemctl:
                 env["MAINPID"] = str(pid)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s start %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid: # pragma: no cover
-                    os.setsid() # detach child process from parent
-                    self.execve_from(conf, newcmd, env)
+                forkpid = self.spawn_from(conf, newcmd, env, setsid = True)
                 self.write_status_from(conf, MainPID=forkpid)
                 logg.info("%s started PID %s", runs, forkpid)
                 env["MAINPID"] = str(forkpid)
-                time.sleep(MinimumYield)
+                self.wait_log_pipes(MinimumYield)
                 run = subprocess_testpid(forkpid)
                 if run.returncode is not None:
                     logg.info("%s stopped PID %s (%s) <-%s>", runs, run.pid, 
@@ -1932,16 +3551,13 @@ class Systemctl:
                 env["MAINPID"] = str(mainpid)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s start %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid: # pragma: no cover
-                    os.setsid() # detach child process from parent
-                    self.execve_from(conf, newcmd, env)
+                forkpid = self.spawn_from(conf, newcmd, env, setsid = True)
                 # via NOTIFY # self.write_status_from(conf, MainPID=forkpid)
                 logg.info("%s started PID %s", runs, forkpid)
                 mainpid = forkpid
                 self.write_status_from(conf, MainPID=mainpid)
                 env["MAINPID"] = str(mainpid)
-                time.sleep(MinimumYield)
+                self.wait_log_pipes(MinimumYield)
                 run = subprocess_testpid(forkpid)
                 if run.returncode is not None:
                     logg.info("%s stopped PID %s (%s) <-%s>", runs, run.pid, 
@@ -1975,12 +3591,9 @@ class Systemctl:
                 newcmd = self.exec_cmd(cmd, env, conf)
                 if not newcmd: continue
                 logg.info("%s start %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid: # pragma: no cover
-                    os.setsid() # detach child process from parent
-                    self.execve_from(conf, newcmd, env)
+                forkpid = self.spawn_from(conf, newcmd, env, setsid = True)
                 logg.info("%s started PID %s", runs, forkpid)
-                run = subprocess_waitpid(forkpid)
+                run = self.wait_subprocess(forkpid)
                 if run.returncode and check:
                     returncode = run.returncode
                     service_result = "failed"
@@ -1992,7 +3605,7 @@ class Systemctl:
                 if pid:
                     env["MAINPID"] = str(pid)
             if not pid_file:
-                time.sleep(MinimumTimeoutStartSec)
+                self.wait_log_pipes(MinimumTimeoutStartSec)
                 logg.warning("No PIDFile for forking %s", conf.filename())
                 status_file = self.status_file_from(conf)
                 self.set_status_from(conf, "ExecMainCode", returncode)
@@ -2012,10 +3625,8 @@ class Systemctl:
                 check, cmd = checkstatus(cmd)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("post-fail %s", shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 logg.debug("post-fail done (%s) <-%s>", 
                     run.returncode or "OK", run.signal or "")
             return False
@@ -2024,10 +3635,8 @@ class Systemctl:
                 check, cmd = checkstatus(cmd)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("post-start %s", shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 logg.debug("post-start done (%s) <-%s>", 
                     run.returncode or "OK", run.signal or "")
             return True
@@ -2068,15 +3677,72 @@ class Systemctl:
         return self.expand_special(conf.get("Service", "Group", ""), conf)
     def get_SupplementaryGroups(self, conf):
         return self.expand_list(conf.getlist("Service", "SupplementaryGroups", []), conf)
+    def spawn_from(self, conf, cmd, env, setsid = False): # -> pid
+        """ start the cmd in a new process - with posix_spawn if the unit
+            settings allow for it, otherwise fork off a copy of ourselves
+            that changes the process settings before the execve() """
+        if USE_POSIX_SPAWN and hasattr(os, "posix_spawn") and "spawn" not in COVERAGE:
+            pid = self.posix_spawn_from(conf, cmd, env, setsid)
+            if pid:
+                return pid
+        self.resolve_credentials(conf) # before the fork, so the child has it
+        forkpid = os.fork()
+        if not forkpid: # pragma: no cover
+            if setsid:
+                os.setsid() # detach child process from parent
+            self.execve_from(conf, cmd, env)
+        return forkpid
+    def resolve_credentials(self, conf):
+        """ if the lookup fails here then the fork-child will report it """
+        runuser = self.get_User(conf)
+        rungroup = self.get_Group(conf)
+        xgroups = self.get_SupplementaryGroups(conf)
+        if runuser or rungroup:
+            try:
+                shutil_credentials(runuser, rungroup, xgroups)
+            except Exception as e:
+                logg.debug("can not resolve credentials %s:%s: %s", runuser, rungroup, e)
+    def posix_spawn_from(self, conf, cmd, env, setsid = False): # -> pid or None
+        """ the parent process does the preparations of execve_from so that
+            the new process does not need a copy of the python interpreter.
+            Returns None if that is not possible (setuid, chdir or errors) """
+        if self.get_User(conf) or self.get_Group(conf) or self.get_SupplementaryGroups(conf):
+            return None
+        if self.workingdir_change(conf):
+            return None # the fork child does the chdir
+        if conf.name() in self._log_pipe:
+            out, logpipe = None, self._log_pipe[conf.name()][1]
+        else:
+            out = self.open_journal_log(conf)
+            logpipe = out.fileno()
+        actions = [ (os.POSIX_SPAWN_OPEN, 0, "/dev/zero", os.O_RDONLY, 0),
+                    (os.POSIX_SPAWN_DUP2, logpipe, 1),
+                    (os.POSIX_SPAWN_DUP2, logpipe, 2) ]
+        try:
+            newenv = self.extend_exec_env(env)
+            pid = os.posix_spawn(cmd[0], cmd, newenv, file_actions = actions, setsid = setsid)
+            logg.debug("posix_spawn PID %s %s", pid, shell_cmd(cmd))
+            return pid
+        except Exception as e:
+            logg.debug("posix_spawn %s: %s", shell_cmd(cmd), e)
+            return None
+        finally:
+            if out is not None:
+                out.close()
     def execve_from(self, conf, cmd, env):
         """ this code is commonly run in a child process // returns exit-code"""
         runs = conf.get("Service", "Type", "simple").lower()
         logg.debug("%s process for %s", runs, conf.filename())
         inp = open("/dev/zero")
-        out = self.open_journal_log(conf)
         os.dup2(inp.fileno(), sys.stdin.fileno())
-        os.dup2(out.fileno(), sys.stdout.fileno())
-        os.dup2(out.fileno(), sys.stderr.fileno())
+        if conf.name() in self._log_pipe:
+            logpipe = self._log_pipe[conf.name()][1]
+            os.dup2(logpipe, sys.stdout.fileno())
+            os.dup2(logpipe, sys.stderr.fileno())
+        else:
+            out = self.open_journal_log(conf)
+            os.dup2(out.fileno(), sys.stdout.fileno())
+            os.dup2(out.fileno(), sys.stderr.fileno())
         runuser = self.get_User(conf)
         rungroup = self.get_Group(conf)
         xgroups = self.get_SupplementaryGroups(conf)
@@ -2118,14 +3784,97 @@ class Systemctl:
                 if unit not in units:
                     units += [ unit ]
         return self.stop_units(units) and found_all
-    def stop_units(self, units):
-        """ fails if any unit fails to stop """
+    def stop_units(self, units, timeout = None):
+        """ fails if any unit fails to stop - with a timeout (on shutdown)
+            all the stops together are limited, also without --jobs """
         self.wait_system()
         done = True
-        for unit in self.sortedBefore(units):
-            if not self.stop_unit(unit):
-                done = False
+        grouped = self.sync_status_begin()
+        try:
+            if self._jobs > 1:
+                return self.stop_units_parallel(self.sortedBefore(units), timeout)
+            if timeout:
+                return self.stop_units_until(self.sortedBefore(units), timeout)
+            for unit in self.sortedBefore(units):
+                if not self.stop_unit(unit):
+                    done = False
+        finally:
+            self.sync_status_end(grouped)
         return done
+    def stop_units_parallel(self, units, timeout = None):
+        """ stop the units (in reverse start order) with up to --jobs forked
+            workers. A unit is stopped when the units that were started after
+            it are down. When the timeout has passed then all the remaining
+            processes of the units and the workers get a SIGKILL."""
+        timeout = timeout or DefaultMaximumTimeout
+        deadline = time.time() + timeout
+        pidlists = self.pidlists_of_units(units)
+        waits = self.parallel_units_waits(units, stopping = True)
+        done, unfinished = self.parallel_units_run(units, waits, self.stop_unit, deadline)
+        if not unfinished:
+            return done
+        return self.kill_units_unfinished(units, unfinished, pidlists, timeout)
+    def stop_units_until(self, units, timeout):
+        """ stop the units one after the other (in reverse start order).
+            No unit waits beyond the deadline for its processes to vanish,
+            and the units not reached until then get a SIGKILL."""
+        deadline = time.time() + timeout
+        pidlists = self.pidlists_of_units(units)
+        done = True
+        unfinished = {}
+        self._stop_deadline = deadline
+        try:
+            for unit in units:
+                if time.time() > deadline:
+                    unfinished[unit] = None
+                    continue
+                if not self.stop_unit(unit):
+                    done = False
+                if time.time() > deadline:
+                    unfinished[unit] = None # its processes may be left
+        finally:
+            self._stop_deadline = None
+        if not unfinished:
+            return done
+        return self.kill_units_unfinished(units, unfinished, pidlists, timeout)
+    def pidlists_of_units(self, units):
+        """ the processes of the units before stopping them - as a dict of
+            unit => pids of the main process and its children """
+        pidlists = {}
+        procs = ProcTable()
+        for unit in units:
+            conf = self.get_unit_conf(unit)
+            mainpid = to_int(self.read_mainpid_from(conf, ""))
+            pidlists[unit] = mainpid and self.pidlist_of(mainpid, procs) or []
+        return pidlists
+    def kill_units_unfinished(self, units, unfinished, pidlists, timeout):
+        """ SIGKILL the remaining processes of the units (and the workers)
+            that were not stopped in time - as a dict of unit => worker pid """
+        logg.error("units not stopped after %ss: %s", timeout, " ".join(sorted(unfinished)))
+        for unit in units:
+            if unit not in unfinished:
+                continue
+            worker = unfinished[unit]
+            procs = ProcTable()
+            if worker:
+                for pid in reversed(self.pidlist_of(worker, procs)):
+                    self._kill_pid(pid, signal.SIGKILL)
+                try:
+                    os.waitpid(worker, 0)
+                except OSError as e:
+                    logg.debug("waitpid %s: %s", worker, e)
+            conf = self.get_unit_conf(unit)
+            mainpid = to_int(self.read_mainpid_from(conf, ""))
+            pidlist = pidlists[unit]
+            if mainpid:
+                pidlist = pidlist + self.pidlist_of(mainpid, procs)
+            if pidlist:
+                logg.info("hard kill %s PIDs %s", unit, pidlist)
+            for pid in pidlist:
+                self._kill_pid(pid, signal.SIGKILL)
+            self.clean_pid_file_from(conf)
+            self.clean_status_from(conf)
+        return False
     def stop_unit(self, unit):
         conf = self.load_unit_conf(unit)
         if conf is None:
@@ -2139,7 +3888,10 @@ class Systemctl:
     def get_TimeoutStopSec(self, conf):
         timeout = conf.get("Service", "TimeoutSec", DefaultTimeoutStartSec)
         timeout = conf.get("Service", "TimeoutStopSec", timeout)
-        return time_to_seconds(timeout, DefaultMaximumTimeout)
+        timeout = time_to_seconds(timeout, DefaultMaximumTimeout)
+        if self._stop_deadline is not None:
+            timeout = max(0, min(timeout, self._stop_deadline - time.time()))
+        return timeout
     def stop_unit_from(self, conf):
         if not conf: return False
         if self.syntax_check(conf) > 100: return False
@@ -2161,10 +3913,8 @@ class Systemctl:
                 env["SYSTEMCTL_SKIP_REDIRECT"] = "yes"
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s stop %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 if run.returncode:
                     self.set_status_from(conf, "ExecStopCode", run.returncode)
                     self.write_status_from(conf, AS="failed")
@@ -2181,10 +3931,8 @@ class Systemctl:
                 logg.debug("{env} %s", env)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s stop %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 if run.returncode and check: 
                     returncode = run.returncode
                     service_result = "failed"
@@ -2212,10 +3960,8 @@ class Systemctl:
                 env["MAINPID"] = str(self.read_mainpid_from(conf, ""))
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s stop %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 run = must_have_failed(run, newcmd) # TODO: a workaround
                 # self.write_status_from(conf, MainPID=run.pid) # no ExecStop
                 if run.returncode and check:
@@ -2247,10 +3993,8 @@ class Systemctl:
                 logg.debug("{env} %s", env)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("fork stop %s", shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 if run.returncode and check:
                     returncode = run.returncode
                     service_result = "failed"
@@ -2266,7 +4010,7 @@ class Systemctl:
                 if not pid or not pid_exists(pid) or pid_zombie(pid):
                     self.clean_pid_file_from(conf)
             if returncode:
-                if os.path.isfile(status_file):
+                if self.exists_status_from(conf):
                     self.set_status_from(conf, "ExecStopCode", returncode)
                     self.write_status_from(conf, AS="failed")
             else:
@@ -2282,10 +4026,8 @@ class Systemctl:
                 check, cmd = checkstatus(cmd)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("post-stop %s", shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 logg.debug("post-stop done (%s) <-%s>", 
                     run.returncode or "OK", run.signal or "")
         return service_result == "success"
@@ -2293,12 +4035,20 @@ class Systemctl:
         if not pid:
             return True
         logg.info("wait for PID %s to vanish (%ss)", pid, timeout)
+        if self.is_active_pid(pid):
+            running = pidfd_wait([ pid ], timeout)
+            if running is not None:
+                if running:
+                    logg.info("wait for PID %s failed (pidfd)", pid)
+                    return False
+                logg.info("wait for PID %s is done (pidfd)", pid)
+                return True
         for x in xrange(int(timeout)):
             if not self.is_active_pid(pid):
                 logg.info("wait for PID %s is done (%s.)", pid, x)
                 return True
             time.sleep(1) # until TimeoutStopSec
-        logg.info("wait for PID %s failed (%s.)", pid, x)
+        logg.info("wait for PID %s failed (%ss)", pid, timeout)
         return False
     def reload_modules(self, *modules):
         """ [UNIT]... -- reload these units """
@@ -2350,10 +4100,8 @@ class Systemctl:
                 env["SYSTEMCTL_SKIP_REDIRECT"] = "yes"
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s reload %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 self.set_status_from(conf, "ExecReloadCode", run.returncode)
                 if run.returncode:
                     self.write_status_from(conf, AS="failed")
@@ -2370,10 +4118,8 @@ class Systemctl:
                 check, cmd = checkstatus(cmd)
                 newcmd = self.exec_cmd(cmd, env, conf)
                 logg.info("%s reload %s", runs, shell_cmd(newcmd))
-                forkpid = os.fork()
-                if not forkpid:
-                    self.execve_from(conf, newcmd, env) # pragma: nocover
-                run = subprocess_waitpid(forkpid)
+                forkpid = self.spawn_from(conf, newcmd, env)
+                run = self.wait_subprocess(forkpid)
                 if check and run.returncode: 
                     logg.error("Job for %s failed because the control process exited with error code. (%s)", 
                         conf.name(), run.returncode)
@@ -2633,17 +4379,20 @@ class Systemctl:
                 self._kill_pid(pid, signal.SIGHUP)
         # wait for the processes to have exited
         while True:
-            dead = True
-            for pid in pidlist:
-                if pid_exists(pid) and not pid_zombie(pid):
-                    dead = False
-                    break
+            procs = ProcTable(pidlist)
+            dead = not [ pid for pid in pidlist if procs.alive(pid) ]
             if dead:
                 break
             if time.time() > started + timeout:
                 logg.info("service PIDs not stopped after %s", timeout)
                 break
-            time.sleep(1) # until TimeoutStopSec
+            if self._log_drain:
+                alive = [ pid for pid in pidlist if procs.alive(pid) ]
+                self.wait_log_pipes(started + timeout - time.time(), alive, poll = 1)
+                continue
+            running = pidfd_wait(pidlist, started + timeout - time.time())
+            if running is None:
+                time.sleep(1) # until TimeoutStopSec
         if dead or not doSendSIGKILL:
             logg.info("done kill PID %s %s", mainpid, dead and "OK")
             return dead
@@ -2737,12 +4486,16 @@ class Systemctl:
         """ returns 'active' 'inactive' 'failed' 'unknown' """
         # used in try-restart/other commands to check if needed.
         if not conf: return "unknown"
+        with waitlock(conf, shared = True):
+            return self.get_active_state_from(conf)
+    def get_active_state_from(self, conf):
+        """ get_active_from without the shared unit lock """
         pid_file = self.pid_file_from(conf)
         if pid_file: # application PIDFile
             if not os.path.exists(pid_file):
                 return "inactive"
         status_file = self.status_file_from(conf)
-        if self.getsize(status_file):
+        if self.has_status_from(conf):
             state = self.get_status_from(conf, "ActiveState", "")
             if state:
                 logg.info("get_status_from %s => %s", conf.name(), state)
@@ -2763,7 +4516,7 @@ class Systemctl:
             if not os.path.exists(pid_file):
                 return "dead"
         status_file = self.status_file_from(conf)
-        if self.getsize(status_file):
+        if self.has_status_from(conf):
             state = self.get_status_from(conf, "ActiveState", "")
             if state:
                 if state in [ "active" ]:
@@ -2832,7 +4585,10 @@ class Systemctl:
         if not self.is_failed_from(conf): return False
         done = False
         status_file = self.status_file_from(conf)
-        if status_file and os.path.exists(status_file):
+        if self.use_state_file(conf):
+            self.clean_status_from(conf)
+            done = True
+        elif status_file and os.path.exists(status_file):
             try:
                 os.remove(status_file)
                 done = True
@@ -2889,8 +4645,9 @@ class Systemctl:
         else:
             result += "\n    Loaded: failed"
             return 3, result
-        active = self.get_active_from(conf)
-        substate = self.get_substate_from(conf)
+        with waitlock(conf, shared = True):
+            active = self.get_active_from(conf)
+            substate = self.get_substate_from(conf)
         result += "\n    Active: {} ({})".format(active, substate)
         if active == "active":
             return 0, result
@@ -2933,6 +4690,50 @@ class Systemctl:
         except Exception as e:
             print("Unit {} is not-loaded: {}".format(unit, e))
         return False
+    def log_modules(self, *modules):
+        """ [UNIT]... show the journal log of these units (including
+            the rotated parts) - use -n NUM and --since TIME to limit it
+        """
+        found_all = True
+        units = []
+        for module in modules:
+            matched = self.match_units([ module ])
+            if not matched:
+                logg.error("Unit %s could not be found.", unit_of(module))
+                found_all = False
+                continue
+            for unit in matched:
+                if unit not in units:
+                    units += [ unit ]
+        count = None
+        if self._log_lines is not None:
+            count = max(0, to_int(self._log_lines))
+        since = None
+        if self._log_since:
+            since = since_to_time(self._log_since)
+            if since is None:
+                logg.error("Failed to parse timestamp: %s", self._log_since)
+                return False
+        result = []
+        for unit in units:
+            conf = self.get_unit_conf(unit)
+            for line in self.log_unit_from(conf, count, since):
+                if len(units) > 1:
+                    line = "%s: %s" % (unit, line)
+                result.append(line)
+        if not found_all:
+            return (False, result)
+        return result
+    def log_unit_from(self, conf, count = None, since = None): # -> [ text ]
+        journal = JournalLog(self.path_journal_log(conf))
+        if count == 0:
+            return []
+        result = []
+        for line in journal.lines(count, since):
+            if not isinstance(line, str): # bytes on python3
+                line = line.decode("utf-8", "replace")
+            result.append(line)
+        return result
     ##
     ##
     def load_preset_files(self, module = None): # -> [ preset-file-names,... ]
@@ -3576,6 +5377,10 @@ class Systemctl:
             and it is over 100 if it can not continue even
             for the relaxed systemctl.py style of execution. """
         errors = 0
+        self.reset_unit_index() # rescan all unit folders
+        self._conf_cache_reload = True # and parse all unit files again
+        self._loaded_file_sysd = {}
+        self._loaded_file_sysv = {}
         for unit in self.match_units():
             try:
                 conf = self.get_unit_conf(unit)
@@ -3768,13 +5573,17 @@ class Systemctl:
             loaded = "not-loaded"
             if "NOT-FOUND" in self.get_description_from(conf):
                 loaded = "not-found"
+        with waitlock(conf, shared = True):
+            mainpid = self.active_pid_from(conf) or "0"
+            substate = self.get_substate_from(conf)
+            active = self.get_active_from(conf)
         yield "Id", unit
         yield "Names", unit
         yield "Description", self.get_description_from(conf) # conf.get("Unit", "Description")
         yield "PIDFile", self.pid_file_from(conf) # not self.pid_file_from w/o default location
-        yield "MainPID", self.active_pid_from(conf) or "0"  # status["MainPID"] or PIDFile-read
-        yield "SubState", self.get_substate_from(conf)      # status["SubState"] or notify-result
-        yield "ActiveState", self.get_active_from(conf)     # status["ActiveState"]
+        yield "MainPID", mainpid       # status["MainPID"] or PIDFile-read
+        yield "SubState", substate     # status["SubState"] or notify-result
+        yield "ActiveState", active    # status["ActiveState"]
         yield "LoadState", loaded
         yield "UnitFileState", self.enabled_from(conf)
         yield "User", self.get_User(conf) or ""
@@ -3913,21 +5722,35 @@ class Systemctl:
         default_target = self._default_target
         default_services = self.system_default_services("S", default_target)
         self.sysinit_status(SubState = "starting")
-        self.start_units(default_services)
+        if init:
+            self.start_log_pipes(default_services)
+            self.start_log_drain(default_services)
+        try:
+            self.start_units(default_services)
+        finally:
+            self.stop_log_drain()
         logg.info(" -- system is up")
         if init:
             logg.info("init-loop start")
             sig = self.init_loop_until_stop(default_services)
             logg.info("init-loop %s", sig)
-            self.stop_system_default()
-    def stop_system_default(self):
+            self.start_log_drain(default_services) # the services may log on SIGTERM
+            try:
+                self.stop_system_default(ShutdownTimeout or DefaultMaximumTimeout)
+                self.reap_children() # the stopped services (as a subreaper)
+            finally:
+                self.stop_log_drain()
+                self.read_log_files(default_services)
+                self.stop_log_files(default_services)
+    def stop_system_default(self, timeout = None):
         """ detect the default.target services and stop them.
             This is commonly run through 'systemctl halt' or
-            at the end of a 'systemctl --init default' loop."""
+            at the end of a 'systemctl --init default' loop
+            (which limits all the stops together by a timeout)."""
         default_target = self._default_target
         default_services = self.system_default_services("K", default_target)
         self.sysinit_status(SubState = "stopping")
-        self.stop_units(default_services)
+        self.stop_units(default_services, timeout)
         logg.info(" -- system is down")
     def system_halt(self, arg = True):
         """ stop units from default system level """
@@ -3990,7 +5813,9 @@ class Systemctl:
         (and no unit is started/stoppped wether given or not).
         """
         if self._now:
-            return self.init_loop_until_stop([])
+            sig = self.init_loop_until_stop([])
+            self.stop_log_files([])
+            return sig
         if not modules:
             # like 'systemctl --init default'
             if self._now or self._show_all:
@@ -4018,42 +5843,251 @@ class Systemctl:
         done = self.start_units(units, init = True) 
         logg.info("-- init is done")
         return done # and found_all
-    def start_log_files(self, units):
+    def start_log_pipes(self, units):
+        """ with SYSTEMCTL_LOG_PIPE the services that are started for the
+            init-loop write to a pipe that the init-loop reads from. The
+            init-loop keeps the write end open for all processes of a unit,
+            and a full pipe makes the service wait for the init-loop. """
+        if not LOG_PIPE:
+            return
+        for unit in units:
+            if unit in self._log_pipe:
+                continue
+            pipe = os.pipe()
+            for fd in pipe:
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            fcntl.fcntl(pipe[0], fcntl.F_SETFL, fcntl.fcntl(pipe[0], fcntl.F_GETFL) | os.O_NONBLOCK)
+            self._log_pipe[unit] = pipe
+    def start_log_drain(self, units):
+        """ a service may write more than a pipe buffer before its start is
+            done (READY=1, the PIDFile, an ExecStartPre) or while it is being
+            stopped - so the waits of the start and the stop forward the log
+            pipes meanwhile (see wait_log_pipes) """
+        if not self._log_pipe:
+            return
+        if not self._log_file:
+            self.start_log_files(units)
+        for unit in units:
+            if unit in self._log_pipe and unit in self._log_file:
+                self._log_drain[self._log_pipe[unit][0]] = unit
+    def stop_log_drain(self):
+        self._log_drain = {}
+    def wait_log_pipes(self, timeout, pids = [], fds = [], poll = EpsilonTime): # -> ready fds
+        """ sleep for the timeout while forwarding the lines of the log pipes.
+            It returns early when one of the pids has exited (by its pidfd,
+            or every poll seconds without that) or when one of the fds is
+            readable - the caller checks again what it is waiting for. """
+        deadline = time.time() + max(0, timeout)
+        pidfds = []
+        for pid in pids:
+            pidfd = pidfd_open(pid)
+            if pidfd is None:
+                deadline = min(deadline, time.time() + poll)
+            else:
+                pidfds.append(pidfd)
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                try:
+                    ready, _, _ = select.select(list(self._log_drain) + pidfds + list(fds), [], [], remaining)
+                except (select.error, OSError) as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    continue
+                units = [ self._log_drain[fd] for fd in ready if fd in self._log_drain ]
+                if units:
+                    self.read_log_files(units)
+                if [ fd for fd in ready if fd in pidfds ]:
+                    return []
+                found = [ fd for fd in ready if fd in fds ]
+                if found:
+                    return found
+        finally:
+            for pidfd in pidfds:
+                os.close(pidfd)
+    def wait_subprocess(self, pid):
+        """ subprocess_waitpid - that forwards the log pipes meanwhile,
+            and that kills the process at the deadline of a shutdown """
+        if not self._log_drain and self._stop_deadline is None:
+            return subprocess_waitpid(pid)
+        while True:
+            run = subprocess_testpid(pid)
+            if run.returncode is not None:
+                return run
+            remaining = DefaultMaximumTimeout
+            if self._stop_deadline is not None:
+                remaining = self._stop_deadline - time.time()
+                if remaining <= 0:
+                    logg.warning("PID %s still running at the shutdown deadline", pid)
+                    self._kill_pid(pid, signal.SIGKILL)
+                    return subprocess_waitpid(pid)
+            self.wait_log_pipes(remaining, [ pid ])
+    def start_log_files(self, units, readers = None):
+        """ open the journal logs of the units for the init-loop. When
+            readers are given then an inotify on the log folders will
+            wake up the init-loop as soon as a service has written.
+            The log pipes are given to the readers directly (with the
+            partial line that a start_log_drain has read already). """
+        holds = self._log_hold
+        for tee in self._log_tee.values():
+            tee.close()
         self._log_file = {}
         self._log_hold = {}
+        self._log_journal = {}
+        self._log_tee = {}
+        self._log_inotify = None
         for unit in units:
             conf = self.load_unit_conf(unit)
             if not conf: continue
             log_path = self.path_journal_log(conf)
-            try:
-                opened = os.open(log_path, os.O_RDONLY | os.O_NONBLOCK)
-                self._log_file[unit] = opened
-                self._log_hold[unit] = b""
-            except Exception as e:
-                logg.error("can not open %s log: %s\n\t%s", unit, log_path, e)
+            if unit in self._log_pipe:
+                self._log_file[unit] = self._log_pipe[unit][0]
+                self._log_hold[unit] = holds.get(unit, bytearray())
+                if readers is not None:
+                    readers[self._log_pipe[unit][0]] = self.init_loop_log_pipe
+                if LOG_PIPE != "stdout":
+                    self._log_journal[unit] = JournalLog(log_path)
+                    self._log_tee[unit] = self.open_journal_log(conf)
+                continue
+            self._log_journal[unit] = JournalLog(log_path)
+            self.open_log_file(unit)
+        if readers is not None and len(self._log_journal) > len(self._log_tee):
+            inotify = Inotify()
+            folders = set([ os.path.dirname(journal.filename) for journal in self._log_journal.values() ])
+            for folder in sorted(folders):
+                if os.path.isdir(folder):
+                    inotify.add_watch(folder, Inotify.IN_MODIFY | Inotify.IN_CREATE | Inotify.IN_MOVED_TO)
+            if inotify.fd is not None:
+                self._log_inotify = inotify
+                readers[inotify.fd] = self.init_loop_log_event
+    def open_log_file(self, unit):
+        log_path = self._log_journal[unit].filename
+        try:
+            opened = os.open(log_path, os.O_RDONLY | os.O_NONBLOCK)
+            self._log_file[unit] = opened
+            self._log_hold[unit] = bytearray()
+        except Exception as e:
+            logg.error("can not open %s log: %s\n\t%s", unit, log_path, e)
+    def init_loop_log_event(self, fd):
+        """ some log folder has changed - read the logs that were named """
+        names = self._log_inotify.read_names()
+        changed = []
+        for unit, journal in self._log_journal.items():
+            if unit in self._log_pipe:
+                continue # we are writing it
+            if os.path.basename(journal.filename) in names:
+                if unit not in self._log_file:
+                    self.open_log_file(unit)
+                changed.append(unit)
+        self.read_log_files(changed)
+    def init_loop_log_pipe(self, fd):
+        for unit in self._log_pipe:
+            if self._log_pipe[unit][0] == fd:
+                self.read_log_files([ unit ])
+    def check_log_file(self, unit):
+        """ the log may have been truncated by a rotation (then read from
+            the start again) or replaced by a new file (then reopen it) """
+        journal = self._log_journal[unit]
+        opened = self._log_file[unit]
+        try:
+            st = os.stat(journal.filename)
+        except OSError:
+            return
+        if st.st_ino != os.fstat(opened).st_ino:
+            logg.debug("reopen %s log: %s", unit, journal.filename)
+            os.close(opened)
+            self._log_file[unit] = os.open(journal.filename, os.O_RDONLY | os.O_NONBLOCK)
+            del self._log_hold[unit][:]
+        elif st.st_size < os.lseek(opened, 0, os.SEEK_CUR):
+            os.lseek(opened, 0, os.SEEK_SET)
+            del self._log_hold[unit][:]
     def read_log_files(self, units):
-        BUFSIZE=8192
+        """ forward the complete lines of the unit logs to stdout - with
+            the unit name as a prefix, written in one go for all units """
+        iov = []
+        done = {}
         for unit in units:
             if unit in self._log_file:
-                new_text = b""
-                while True:
-                    buf = os.read(self._log_file[unit], BUFSIZE)
-                    if not buf: break
-                    new_text += buf
-                    continue
-                text = self._log_hold[unit] + new_text
-                if not text: continue
-                lines = text.split(b"\n")
-                if not text.endswith(b"\n"):
-                    self._log_hold[unit] = lines[-1]
-                    lines = lines[:-1]
-                for line in lines:
-                    prefix = unit.encode("utf-8")
-                    content = prefix+b": "+line+b"\n"
-                    os.write(1, content)
-                    try: os.fsync(1)
-                    except: pass
-    def stop_log_files(self, units):
+                done[unit] = self.read_log_file(unit, iov)
+        if iov:
+            write_iov(1, iov)
+        del iov[:] # release the views before the buffers are resized
+        for unit in done:
+            del self._log_hold[unit][:done[unit]]
+    def read_log_file(self, unit, iov): # -> size of the lines put into the iov
+        BUFSIZE=65536
+        if unit in self._log_pipe:
+            return self.read_log_pipe(unit, iov)
+        try:
+            self.check_log_file(unit)
+        except Exception as e:
+            logg.warning("can not check %s log: %s", unit, e)
+        text = self._log_hold[unit]
+        while True:
+            try:
+                buf = os.read(self._log_file[unit], BUFSIZE)
+            except OSError as e:
+                if e.errno in [ errno.EAGAIN, errno.EINTR ]:
+                    break
+                raise
+            if not buf: break
+            text.extend(buf)
+        try:
+            offset = os.lseek(self._log_file[unit], 0, os.SEEK_CUR)
+            cut = self._log_journal[unit].check(offset = offset)
+            if cut:
+                os.lseek(self._log_file[unit], offset - cut, os.SEEK_SET)
+        except Exception as e:
+            logg.warning("can not rotate %s log: %s", unit, e)
+        return self.split_log_lines(unit, iov)
+    def read_log_pipe(self, unit, iov): # -> size of the lines put into the iov
+        """ one read from the log pipe - a service that writes more has to
+            wait for the next round (the pipe buffer is the only backlog) """
+        BUFSIZE=65536
+        try:
+            buf = os.read(self._log_file[unit], BUFSIZE)
+        except OSError as e:
+            if e.errno not in [ errno.EAGAIN, errno.EINTR ]:
+                raise
+            buf = b""
+        if buf and unit in self._log_tee:
+            write_iov(self._log_tee[unit].fileno(), [ buf ])
+            try:
+                self._log_journal[unit].check()
+            except Exception as e:
+                logg.warning("can not rotate %s log: %s", unit, e)
+        self._log_hold[unit].extend(buf)
+        return self.split_log_lines(unit, iov)
+    def split_log_lines(self, unit, iov): # -> size of the lines put into the iov
+        BUFSIZE=65536
+        text = self._log_hold[unit]
+        if hasattr(os, "writev"):
+            view = memoryview(text)
+        else:
+            view = text # python2
+        prefix = unit.encode("utf-8") + b": "
+        start = 0
+        while True:
+            end = text.find(b"\n", start)
+            if end < 0:
+                break
+            iov.append(prefix)
+            iov.append(view[start:end+1])
+            start = end + 1
+        if len(text) - start >= BUFSIZE: # a very long line
+            iov.append(prefix)
+            iov.append(view[start:])
+            iov.append(b"\n")
+            start = len(text)
+        return start
+    def stop_log_readers(self, readers):
+        if self._log_inotify is not None:
+            readers.pop(self._log_inotify.fd, None)
+        for unit in self._log_pipe:
+            readers.pop(self._log_pipe[unit][0], None)
+    def stop_log_files(self, units, readers = None):
         for unit in units:
             try:
                 if unit in self._log_file:
@@ -4061,27 +6095,74 @@ class Systemctl:
                         os.close(self._log_file[unit])
             except Exception as e:
                 logg.error("can not close log: %s\n\t%s", unit, e)
+        if self._log_inotify is not None:
+            if readers is not None:
+                readers.pop(self._log_inotify.fd, None)
+            self._log_inotify.close()
+            self._log_inotify = None
+        for unit in self._log_pipe:
+            if readers is not None:
+                readers.pop(self._log_pipe[unit][0], None)
+            os.close(self._log_pipe[unit][1]) # the read end was in _log_file
+        for unit in self._log_tee:
+            self._log_tee[unit].close()
         self._log_file = {}
         self._log_hold = {}
+        self._log_journal = {}
+        self._log_pipe = {}
+        self._log_tee = {}
     def init_loop_until_stop(self, units):
-        """ this is the init-loop - it checks for any zombies to be reaped and
-            waits for an interrupt. When a SIGTERM /SIGINT /Control-C signal
-            is received then the signal name is returned. Any other signal will 
-            just raise an Exception like one would normally expect. As a special
-            the 'systemctl halt' emits SIGQUIT which puts it into no_more_procs mode."""
+        """ this is the init-loop - it reaps any zombies and waits for an
+            interrupt. When a SIGTERM /SIGINT /Control-C signal is received
+            then the signal name is returned. Any other signal will just
+            raise an Exception like one would normally expect. As a special
+            the 'systemctl halt' emits SIGQUIT which puts it into no_more_procs mode.
+            The loop sleeps in a select() until a SIGCHLD arrives (through a
+            self-pipe given to set_wakeup_fd), a service has written to its
+            log (through an inotify on the log folder), or after InitLoopSleep
+            seconds for the next round of reading all the log files."""
         signal.signal(signal.SIGQUIT, lambda signum, frame: ignore_signals_and_raise_keyboard_interrupt("SIGQUIT"))
         signal.signal(signal.SIGINT, lambda signum, frame: ignore_signals_and_raise_keyboard_interrupt("SIGINT"))
         signal.signal(signal.SIGTERM, lambda signum, frame: ignore_signals_and_raise_keyboard_interrupt("SIGTERM"))
-        self.start_log_files(units)
+        wakeup_read, wakeup_write = os.pipe()
+        for fd in [ wakeup_read, wakeup_write ]:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        old_wakeup = signal.set_wakeup_fd(wakeup_write)
+        signal.signal(signal.SIGCHLD, self.init_loop_sigchld)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        set_child_subreaper() # the services of a control worker stay with us
+        readers = {} # fd => callback(fd) when readable
+        readers[wakeup_read] = self.init_loop_wakeup
+        self.start_log_files(units, readers)
+        self.start_notify_sockets(units, readers)
+        self.start_control_socket(readers)
         self.sysinit_status(ActiveState = "active", SubState = "running")
+        running = self.system_reap_zombies() # also those from before the SIGCHLD handler
         result = None
         while True:
             try:
-                time.sleep(InitLoopSleep)
-                self.read_log_files(units)
-                ##### the reaper goes round
-                running = self.system_reap_zombies()
-                # logg.debug("reap zombies - init-loop found %s running procs", running)
+                try:
+                    waits = list(readers)
+                    if self._control_workers: # a start in a worker waits for READY=1
+                        waits = [ fd for fd in waits if fd not in self._notify_sockets ]
+                    ready, _, _ = select.select(waits, [], [], InitLoopSleep)
+                except (select.error, OSError) as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    ready = []
+                for fd in ready:
+                    if fd in readers: # may be gone by an earlier callback
+                        readers[fd](fd)
+                if not ready or self._log_inotify is None:
+                    self.read_log_files(units)
+                self.check_notify_sockets(readers)
+                if self._sigchld:
+                    ##### the reaper goes round
+                    self._sigchld = False
+                    self.reap_children()
+                    if self.exit_when_no_more_procs:
+                        running = self.count_procs() # only needed for that check
+                        # logg.debug("reap zombies - init-loop found %s running procs", running)
                 if self.exit_when_no_more_services:
                     active = False
                     for unit in units:
@@ -4089,6 +6170,8 @@ class Systemctl:
                         if not conf: continue
                         if self.is_active_from(conf):
                             active = True
+                        elif self.is_locked_unit(conf):
+                            active = True # a restart is going on
                     if not active:
                         logg.info("no more services - exit init-loop")
                         break
@@ -4101,51 +6184,82 @@ class Systemctl:
                     # the original systemd puts a coredump on that signal.
                     logg.info("SIGQUIT - switch to no more procs check")
                     self.exit_when_no_more_procs = True
+                    self._sigchld = True # count again
                     continue
                 signal.signal(signal.SIGTERM, signal.SIG_DFL)
                 signal.signal(signal.SIGINT, signal.SIG_DFL)
                 logg.info("interrupted - exit init-loop")
-                result = e.message or "STOPPED"
+                result = e.args and e.args[0] or "STOPPED"
                 break
             except Exception as e:
                 logg.info("interrupted - exception %s", e)
                 raise
+        self.stop_control_socket(readers)
+        self.stop_control_workers()
+        self.stop_notify_sockets(readers)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.set_wakeup_fd(old_wakeup)
+        os.close(wakeup_read)
+        os.close(wakeup_write)
         self.sysinit_status(ActiveState = None, SubState = "degraded")
         self.read_log_files(units)
         self.read_log_files(units)
-        self.stop_log_files(units)
+        self.stop_log_readers(readers) # the log files are closed after the stop of the units
         logg.debug("done - init loop")
         return result
+    def init_loop_sigchld(self, signum, frame):
+        self._sigchld = True # the wakeup fd interrupts the select()
+    def init_loop_wakeup(self, fd):
+        try:
+            while os.read(fd, 512):
+                pass
+        except OSError as e:
+            if e.errno not in [ errno.EAGAIN, errno.EWOULDBLOCK ]:
+                raise
+    def reap_children(self):
+        """ waitpid for all children that have exited """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    logg.warning("reap children: %s", e)
+                break
+            if not pid:
+                break
+            if pid in self._control_workers:
+                started = self._control_workers.pop(pid)
+                logg.debug("control worker %s done after %.3fs", pid, time.time() - started)
+                self.forget_unit_status()
+                continue
+            logg.info("reap zombie %s", pid)
+    def count_procs(self):
+        """ the number of processes except for PID 0, PID 1 and ourself """
+        selfpid = os.getpid()
+        running = 0
+        for name in os.listdir("/proc"):
+            if name.isdigit():
+                pid = int(name)
+                if pid > 1 and pid != selfpid:
+                    running += 1
+        return running
     def system_reap_zombies(self):
         """ check to reap children """
         selfpid = os.getpid()
         running = 0
-        for pid in os.listdir("/proc"):
-            try: pid = int(pid)
-            except: continue
+        procs = ProcTable()
+        for pid in procs.pids():
             if pid == selfpid:
                 continue
-            proc_status = "/proc/%s/status" % pid
-            if os.path.isfile(proc_status):
-                zombie = False
-                ppid = -1
-                try:
-                    for line in open(proc_status):
-                        m = re.match(r"State:\s*Z.*", line)
-                        if m: zombie = True
-                        m = re.match(r"PPid:\s*(\d+)", line)
-                        if m: ppid = int(m.group(1))
-                except IOError as e:
-                    logg.warning("%s : %s", proc_status, e)
-                    continue
-                if zombie and ppid == os.getpid():
-                    logg.info("reap zombie %s", pid)
-                    try: os.waitpid(pid, os.WNOHANG)
-                    except OSError as e: 
-                        logg.warning("reap zombie %s: %s", e.strerror)
-            if os.path.isfile(proc_status):
-                if pid > 1:
-                    running += 1
+            if procs.zombie(pid) and procs.ppid[pid] == selfpid:
+                logg.info("reap zombie %s", pid)
+                try: os.waitpid(pid, os.WNOHANG)
+                except OSError as e: 
+                    logg.warning("reap zombie %s: %s", pid, e.strerror)
+            if pid > 1:
+                running += 1
         return running # except PID 0 and PID 1
     def sysinit_status(self, **status):
         conf = self.sysinit_target()
@@ -4156,10 +6270,9 @@ class Systemctl:
         return self._sysinit_target
     def is_system_running(self):
         conf = self.sysinit_target()
-        status_file = self.status_file_from(conf)
-        if not os.path.isfile(status_file):
+        if not self.exists_status_from(conf):
             time.sleep(EpsilonTime)
-        if not os.path.isfile(status_file):
+        if not self.exists_status_from(conf):
             return "offline"
         status = self.read_status_from(conf)
         return status.get("SubState", "unknown")
@@ -4189,32 +6302,12 @@ class Systemctl:
             if "running" not in state:
                 logg.info("system is %s", state)
             break
-    def pidlist_of(self, pid):
+    def pidlist_of(self, pid, procs = None):
+        """ the pid and all its descendants (from one /proc snapshot) """
         try: pid = int(pid)
         except: return []
-        pidlist = [ pid ]
-        pids = [ pid ]
-        for depth in xrange(ProcMaxDepth):
-            for pid in os.listdir("/proc"):
-                try: pid = int(pid)
-                except: continue
-                proc_status = "/proc/%s/status" % pid
-                if os.path.isfile(proc_status):
-                    try:
-                        for line in open(proc_status):
-                            if line.startswith("PPid:"):
-                                ppid = line[len("PPid:"):].strip()
-                                try: ppid = int(ppid)
-                                except: continue
-                                if ppid in pidlist and pid not in pids:
-                                    pids += [ pid ]
-                    except IOError as e:
-                        logg.warning("%s : %s", proc_status, e)
-                        continue
-            if len(pids) != len(pidlist):
-                pidlist = pids[:]
-                continue
-        return pids
+        procs = procs or ProcTable()
+        return procs.descendants(pid)
     def etc_hosts(self):
         path = "/etc/hosts"
         if self._root:
@@ -4387,7 +6480,155 @@ def print_result(result):
         logg.warning("EXEC END Unknown result type %s", str(type(result)))
     return exitcode
 
-if __name__ == "__main__":
+def run_command(systemctl, command, modules): # -> (found, result)
+    """ the command of the commandline, or of a request on the control socket """
+    found = False
+    result = None
+    waitlock.transitions.clear() # a later command may wait again
+    # command NAME
+    if command.startswith("__"):
+        command_name = command[2:]
+        command_func = getattr(systemctl, command_name, None)
+        if callable(command_func) and not found:
+            found = True
+            result = command_func(*modules)
+    command_name = command.replace("-","_").replace(".","_")+"_modules"
+    command_func = getattr(systemctl, command_name, None)
+    if callable(command_func) and not found:
+        if command not in ReadOnlyCommands:
+            systemctl.wait_boot(command_name)
+        found = True
+        result = command_func(*modules)
+    command_name = "show_"+command.replace("-","_").replace(".","_")
+    command_func = getattr(systemctl, command_name, None)
+    if callable(command_func) and not found:
+        if command not in ReadOnlyCommands:
+            systemctl.wait_boot(command_name)
+        found = True
+        result = command_func(*modules)
+    command_name = "system_"+command.replace("-","_").replace(".","_")
+    command_func = getattr(systemctl, command_name, None)
+    if callable(command_func) and not found:
+        if command not in ReadOnlyCommands:
+            systemctl.wait_boot(command_name)
+        found = True
+        result = command_func()
+    command_name = "systems_"+command.replace("-","_").replace(".","_")
+    command_func = getattr(systemctl, command_name, None)
+    if callable(command_func) and not found:
+        if command not in ReadOnlyCommands:
+            systemctl.wait_boot(command_name)
+        found = True
+        result = command_func()
+    return found, result
+
+class FastOptions:
+    """ the defaults of the commandline options (as in the optparse of __main__) """
+    def __init__(self):
+        self.version = False
+        self.system = False
+        self.user = _user_mode
+        self.unit_type = _unit_type
+        self.state = _unit_state
+        self.unit_property = _unit_property
+        self.show_all = _show_all
+        self.full = _full
+        self.now = _now
+        self.quiet = _quiet
+        self.no_legend = _no_legend
+        self.no_ask_password = _no_ask_password
+        self.force = _force
+        self.preset_mode = _preset_mode
+        self.root = _root
+        self.coverage = COVERAGE
+        self.extra_vars = []
+        self.verbose = 0
+        self.ipv4 = False
+        self.ipv6 = False
+        self.init = False
+        self.jobs = _jobs
+        self.batch = None
+        self.lines = _log_lines
+        self.since = _log_since
+
+def fast_options(argv): # -> (opt, args) | None
+    """ the commandline of a read-only command (as used by health checks)
+        is parsed without optparse - returns None for anything else """
+    opt = FastOptions()
+    args = []
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if not arg.startswith("-") or arg == "-":
+            args.append(arg)
+        elif arg == "--user":
+            opt.user = True
+        elif arg == "--system":
+            opt.system = True
+        elif arg in [ "-q", "--quiet" ]:
+            opt.quiet = True
+        elif arg in [ "-a", "--all" ]:
+            opt.show_all = True
+        elif arg == "--no-legend":
+            opt.no_legend = True
+        elif arg == "--root" and argv:
+            opt.root = argv.pop(0)
+        elif arg.startswith("--root="):
+            opt.root = arg[len("--root="):]
+        elif arg in [ "-p", "--property" ] and argv:
+            opt.unit_property = argv.pop(0)
+        elif arg.startswith("--property="):
+            opt.unit_property = arg[len("--property="):]
+        elif arg.startswith("-v") and arg == "-" + "v" * (len(arg) - 1):
+            opt.verbose += len(arg) - 1
+        else:
+            return None
+    if not args or args[0] not in ReadOnlyCommands:
+        return None
+    return opt, args
+
+def run_batch(systemctl, filename): # -> exitcode
+    """ run the commands from a file (or '-' for stdin), one per line,
+        in the same systemctl instance. The exitcode of each command is
+        shown on stderr and the first one that failed is returned. """
+    exitcode = 0
+    batch_pid = os.getpid()
+    if filename == "-":
+        batch = sys.stdin
+    else:
+        batch = open(filename)
+    try:
+        for line in batch:
+            args = shlex.split(line, comments = True)
+            if not args:
+                continue
+            command = args[0]
+            modules = [ arg for arg in args[1:] if arg != "service" ]
+            logg.debug("======= batch " + " ".join(args))
+            try:
+                found, result = run_command(systemctl, command, modules)
+                if not found:
+                    logg.error("Unknown operation %s.", command)
+                    code = 1
+                else:
+                    code = print_result(result)
+            except Exception as e:
+                if os.getpid() != batch_pid: # pragma: no cover (child process)
+                    os._exit(1) # a forked child must not run the rest of the batch
+                logg.error("%s: %s", " ".join(args), e)
+                code = 1
+            sys.stdout.flush()
+            if not systemctl._quiet:
+                print("exit %s: %s" % (code, " ".join(args)), file = sys.stderr)
+            if code and not exitcode:
+                exitcode = code
+    finally:
+        if batch is not sys.stdin:
+            batch.close()
+    return exitcode
+
+_fast_options = __name__ == "__main__" and fast_options(sys.argv[1:]) # health checks
+if __name__ == "__main__" and not _fast_options:
     import optparse
     _o = optparse.OptionParser("%prog [options] command [name...]", 
         epilog="use 'help' command for more information")
@@ -4448,7 +6689,9 @@ if __name__ == "__main__":
     _o.add_option("--root", metavar="PATH", default=_root,
         help="Enable unit files in the specified root directory (used for alternative root prefix)")
     _o.add_option("-n","--lines", metavar="NUM",
-        help="Number of journal entries to show (ignored)")
+        help="Number of journal entries to show")
+    _o.add_option("--since", metavar="TIME",
+        help="Show journal entries not older than the specified date")
     _o.add_option("-o","--output", metavar="CAT",
         help="change journal output mode [short, ..., cat] (ignored)")
     _o.add_option("--plain", action="store_true",
@@ -4468,7 +6711,14 @@ if __name__ == "__main__":
         help="..only keep ipv6 localhost in /etc/hosts")
     _o.add_option("-1","--init", action="store_true", default=False,
         help="..keep running as init-process (default if PID 1)")
+    _o.add_option("-j","--jobs", metavar="N", type="int", default=_jobs,
+        help="..start up to N units in parallel [%default]")
+    _o.add_option("--batch", metavar="FILE",
+        help="..run the commands in FILE (or '-' for stdin), one per line")
     opt, args = _o.parse_args()
+if __name__ == "__main__":
+    if _fast_options:
+        opt, args = _fast_options
     logging.basicConfig(level = max(0, logging.FATAL - 10 * opt.verbose))
     logg.setLevel(max(0, logging.ERROR - 10 * opt.verbose))
     #
@@ -4494,6 +6744,9 @@ if __name__ == "__main__":
     _unit_state = opt.state
     _unit_type = opt.unit_type
     _unit_property = opt.unit_property
+    _jobs = max(1, opt.jobs)
+    _log_lines = opt.lines
+    _log_since = opt.since
     # being PID 1 (or 0) in a container will imply --init
     _pid = os.getpid()
     _init = opt.init or _pid in [ 1, 0 ]
@@ -4524,6 +6777,8 @@ if __name__ == "__main__":
     #
     #
     systemctl = Systemctl()
+    if opt.batch:
+        sys.exit(run_batch(systemctl, opt.batch))
     if opt.version:
         args = [ "version" ]
     if not args:
@@ -4542,38 +6797,10 @@ if __name__ == "__main__":
         systemctl.force_ipv4()
     elif opt.ipv6:
         systemctl.force_ipv6()
-    found = False
-    # command NAME
-    if command.startswith("__"):
-        command_name = command[2:]
-        command_func = getattr(systemctl, command_name, None)
-        if callable(command_func) and not found:
-            found = True
-            result = command_func(*modules)
-    command_name = command.replace("-","_").replace(".","_")+"_modules"
-    command_func = getattr(systemctl, command_name, None)
-    if callable(command_func) and not found:
-        systemctl.wait_boot(command_name)
-        found = True
-        result = command_func(*modules)
-    command_name = "show_"+command.replace("-","_").replace(".","_")
-    command_func = getattr(systemctl, command_name, None)
-    if callable(command_func) and not found:
-        systemctl.wait_boot(command_name)
-        found = True
-        result = command_func(*modules)
-    command_name = "system_"+command.replace("-","_").replace(".","_")
-    command_func = getattr(systemctl, command_name, None)
-    if callable(command_func) and not found:
-        systemctl.wait_boot(command_name)
-        found = True
-        result = command_func()
-    command_name = "systems_"+command.replace("-","_").replace(".","_")
-    command_func = getattr(systemctl, command_name, None)
-    if callable(command_func) and not found:
-        systemctl.wait_boot(command_name)
-        found = True
-        result = command_func()
+    result = systemctl.control_client([ command ] + modules, opt.verbose)
+    if result is not None:
+        sys.exit(result)
+    found, result = run_command(systemctl, command, modules)
     if not found:
         logg.error("Unknown operation %s.", command)
         sys.exit(1)
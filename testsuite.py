@@ -21,6 +21,7 @@ import types
 import logging
 import re
 import sys
+import fcntl
 from fnmatch import fnmatchcase as fnmatch
 from glob import glob
 import json
@@ -571,6 +572,29 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.assertFalse(greps(out, "--verbose"))
         self.assertTrue(greps(out, "reload-or-try-restart"))
         self.coverage()
+    def test_1004_systemctl_read_only_commands_start_fast(self):
+        """ the read-only commands (is-active, show -p) do not import the
+            modules needed for other commands - not even optparse """
+        python = _python
+        systemctl_py = realpath(_systemctl_py)
+        testdir = self.testdir()
+        root = self.root(testdir)
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            ExecStart=/bin/sleep 2
+            """)
+        for args in [ "is-active zza.service", "show zza.service -p ActiveState" ]:
+            cmd = "{python} -v {systemctl_py} --root={root} {args}"
+            out, err, end = output3(cmd.format(**locals()))
+            imported = [ m.group(1) for m in re.finditer(r"(?m)^import '?(\w+)'?", err) ]
+            logg.info(" %s =>%s\n%s\n imported %s", cmd, end, out, imported)
+            self.assertTrue(greps(out, "unknown|inactive"))
+            self.assertIn("logging", imported)
+            for module in [ "optparse", "socket", "datetime", "json" ]:
+                self.assertNotIn(module, imported)
+        self.rm_testdir()
     def test_1005_systemctl_help_command(self):
         """ for any command, 'help command' shows the documentation """
         systemctl = cover() + _systemctl_py
@@ -624,6 +648,131 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.rm_zzfiles(root)
         self.coverage()
+    def test_1012_systemctl_unit_index_is_reused(self):
+        """ the unit folders are only rescanned when they have changed,
+            and daemon-reload will always rebuild the unit index """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            ExecStart=/bin/sleep 3
+        """)
+        folder = os_path(root, "/etc/systemd/system")
+        os.utime(folder, (time.time() - 100, time.time() - 100))
+        index_file = os_path(root, "/var/run/systemd/systemctl.units.index")
+        #
+        cmd = "{systemctl} list-unit-files --type=service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(out, "zza.service"))
+        self.assertTrue(os.path.isfile(index_file))
+        self.assertTrue(greps(open(index_file), "^zza.service"))
+        #
+        text = open(index_file).read()
+        text = text.replace("zza.service\n", "zza.service\nzzb.service\n")
+        text_file(index_file, text)
+        cmd = "{systemctl} list-unit-files --type=service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(out, "zza.service"))
+        self.assertTrue(greps(out, "zzb.service")) # from the index
+        #
+        cmd = "{systemctl} daemon-reload"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertFalse(greps(open(index_file), "^zzb.service"))
+        cmd = "{systemctl} list-unit-files --type=service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(out, "zza.service"))
+        self.assertFalse(greps(out, "zzb.service"))
+        #
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            ExecStart=/bin/sleep 3
+        """)
+        cmd = "{systemctl} list-unit-files --type=service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(out, "zza.service"))
+        self.assertTrue(greps(out, "zzc.service")) # folder has changed
+        self.rm_testdir()
+        self.coverage()
+    def test_1013_systemctl_compiled_unit_config_is_reused(self):
+        """ the parsed unit files are only read again when they have changed,
+            and daemon-reload will always parse the unit files again """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        unit_file = os_path(root, "/etc/systemd/system/zza.service")
+        text_file(unit_file,"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            ExecStart=/bin/sleep 3
+        """)
+        past = time.time() - 100
+        os.utime(unit_file, (past, past))
+        #
+        cmd = "{systemctl} show zza.service -p Description"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(lines(out), ["Description=Testing A"])
+        cache_dir = os_path(root, "/var/run/systemd/systemctl.cache")
+        self.assertTrue(os.listdir(cache_dir))
+        #
+        text = open(unit_file).read().replace("Testing A", "Testing B")
+        with open(unit_file, "w") as f: # same size, same inode
+            f.write(text)
+        os.utime(unit_file, (past, past))
+        cmd = "{systemctl} show zza.service -p Description"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(lines(out), ["Description=Testing A"]) # compiled
+        #
+        cmd = "{systemctl} daemon-reload"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        cmd = "{systemctl} show zza.service -p Description"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(lines(out), ["Description=Testing B"])
+        #
+        text_file(os_path(root, "/etc/systemd/system/zza.service.d/extra.conf"),"""
+            [Service]
+            User=somebody
+        """)
+        cmd = "{systemctl} show zza.service -p User"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(lines(out), ["User=somebody"]) # new drop-in
+        #
+        text = open(unit_file).read().replace("Testing B", "Testing BB")
+        with open(unit_file, "w") as f:
+            f.write(text)
+        os.remove(os_path(root, "/etc/systemd/system/zza.service.d/extra.conf"))
+        cmd = "{systemctl} show zza.service -p Description"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(lines(out), ["Description=Testing BB"]) # changed
+        self.rm_testdir()
+        self.coverage()
     def test_1020_systemctl_with_systemctl_log(self):
         """ when /var/log/systemctl.log exists then print INFO messages into it"""
         testdir = self.testdir()
@@ -2966,6 +3115,66 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.coverage()
     def real_3002_enable_service_creates_a_symlink(self):
         self.test_3002_enable_service_creates_a_symlink(True)
+    def test_2910_pidfd_open_syscall(self):
+        """ using systemctl.py as a helper library for the pidfd_open
+            syscall numbers - that are not the same on all machines."""
+        self.begin()
+        python_exe = _python
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl_py_dir = os.path.dirname(realpath(_systemctl_py))
+        pidfd_py = os_path(root, "/usr/bin/pidfd.py")
+        shell_file(pidfd_py,"""
+            #! {python_exe}
+            from __future__ import print_function
+            import sys
+            sys.path += [ "{systemctl_py_dir}" ]
+            import systemctl
+            for machine in [ "x86_64", "i686", "aarch64", "armv7l", "ppc64le", "s390x", "riscv64", "alpha", "mips64" ]:
+                print(machine, systemctl.pidfd_open_syscall(machine))
+            """.format(**locals()))
+        cmd = "{pidfd_py}"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(lines(out), [ "x86_64 434", "i686 434", "aarch64 434", "armv7l 434",
+            "ppc64le 434", "s390x 434", "riscv64 434", "alpha 544", "mips64 None" ])
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_2920_credentials_cache_checks_the_user_database(self):
+        """ using systemctl.py as a helper library for the credentials
+            cache - that is dropped when the user database changes."""
+        self.begin()
+        python_exe = _python
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl_py_dir = os.path.dirname(realpath(_systemctl_py))
+        credentials_py = os_path(root, "/usr/bin/credentials.py")
+        passwd = os_path(root, "/etc/passwd")
+        text_file(passwd, "")
+        shell_file(credentials_py,"""
+            #! {python_exe}
+            from __future__ import print_function
+            import sys, os
+            sys.path += [ "{systemctl_py_dir}" ]
+            import systemctl
+            systemctl._credentials_files = [ "{passwd}" ]
+            first = systemctl.shutil_credentials("root")
+            print("cached", systemctl.shutil_credentials("root") is first)
+            changed = os.path.getmtime("{passwd}") + 10
+            os.utime("{passwd}", (changed, changed))
+            print("changed", systemctl.shutil_credentials("root") is first)
+            print("uid", systemctl.shutil_credentials("root")[2])
+            """.format(**locals()))
+        cmd = "{credentials_py}"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(lines(out), [ "cached True", "changed False", "uid 0" ])
+        self.rm_testdir()
+        self.coverage()
+        self.end()
     def test_3002_enable_service_creates_a_symlink(self, real = False):
         """ check that a service can be enabled """
         self.begin()
@@ -3300,6 +3509,74 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.coverage()
         self.end()
+    def test_3007_enable_services_in_batch(self):
+        """ check that a batch file can enable services in one run """
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        #
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            ExecStart=/bin/sleep 2
+            [Install]
+            WantedBy=multi-user.target""")
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            ExecStart=/bin/sleep 2
+            [Install]
+            WantedBy=multi-user.target""")
+        batch_file = os_path(testdir, "enable.batch")
+        text_file(batch_file, """
+            # enable some services
+            enable zzb.service
+            enable zzc.service
+
+            is-enabled zzb.service zzc.service
+            is-enabled zz-unknown.service
+            """)
+        cmd = "{systemctl} --batch {batch_file}"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 1)
+        self.assertEqual(lines(out), [ "enabled", "enabled" ])
+        self.assertTrue(greps(err, "^exit 0: enable zzb.service"))
+        self.assertTrue(greps(err, "^exit 0: enable zzc.service"))
+        self.assertTrue(greps(err, "^exit 0: is-enabled zzb.service zzc.service"))
+        self.assertTrue(greps(err, "^exit 1: is-enabled zz-unknown.service"))
+        self.assertEqual(len(greps(err, "^exit")), 4)
+        enabled_file = os_path(root, "/etc/systemd/system/multi-user.target.wants/zzc.service")
+        self.assertTrue(os.path.islink(enabled_file))
+        #
+        cmd = "echo disable zzb.service zzc.service | {systemctl} --batch -"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(err, "^exit 0: disable zzb.service zzc.service"))
+        self.assertFalse(os.path.islink(enabled_file))
+        #
+        default_file = os_path(root, "/etc/systemd/system/default.target")
+        text_file(default_file, "not a symlink")
+        text_file(batch_file, """
+            set-default basic.target
+            enable zzc.service
+            """)
+        cmd = "{systemctl} --batch {batch_file}"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 1)
+        self.assertTrue(greps(err, "ERROR:systemctl:set-default basic.target: "))
+        self.assertTrue(greps(err, "^exit 1: set-default basic.target"))
+        self.assertTrue(greps(err, "^exit 0: enable zzc.service"))
+        self.assertTrue(os.path.islink(enabled_file))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
     def test_3008_is_enabled_for_nonexistant_service(self):
         """ check that 'is-enabled' reports correctly for non-existant services """
         self.begin()
@@ -5773,6 +6050,180 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_zzfiles(root)
         self.coverage()
         self.end()
+    def test_3082_waiting_start_gets_the_lock_when_released(self):
+        """ a 'systemctl start' that has to wait for the unit lock shall
+            continue as soon as the lock is released - not only when its
+            next attempt comes around in a second."""
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        python = _python
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/true
+            """)
+        lockfile = os_path(root, "/var/run/systemd/zza.service.lock")
+        self.makedirs(os.path.dirname(lockfile))
+        locker = os_path(testdir, "locker.py")
+        locked = os_path(testdir, "locked")
+        text_file(locker, """
+            import fcntl, os, time
+            fd = os.open("{lockfile}", os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, ("{{ 'locker': %s }}\\n" % os.getpid()).encode("utf-8"))
+            open("{locked}", "w").close()
+            time.sleep(0.7)
+            os.ftruncate(fd, 0)
+            """.format(**locals()))
+        cmd = "{python} {locker} &"
+        sh____(cmd.format(**locals()))
+        for attempt in xrange(20):
+            if os.path.exists(locked): break
+            time.sleep(0.1)
+        started = time.time()
+        cmd = "{systemctl} start zza.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        elapsed = time.time() - started
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, err, out)
+        logg.info("elapsed %s", elapsed)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(err, "0. systemctl locked by .*locker"))
+        self.assertFalse(greps(err, "1. systemctl locked by"))
+        self.assertGreater(elapsed, 0.5)
+        self.assertLess(elapsed, 0.95)
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3083_queries_wait_for_a_transition_but_not_for_each_other(self):
+        """ the queries take a shared unit lock - they wait while a start
+            holds the exclusive lock, but not while another query runs."""
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = "SYSTEMCTL_QUERY_LOCKWAIT=3 " + cover() + _systemctl_py + " --root=" + root
+        python = _python
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/true
+            """)
+        lockfile = os_path(root, "/var/run/systemd/zza.service.lock")
+        status_file = os_path(root, "/var/run/zza.service.status")
+        self.makedirs(os.path.dirname(lockfile))
+        locker = os_path(testdir, "locker.py")
+        locked = os_path(testdir, "locked")
+        text_file(locker, """
+            import fcntl, os, sys, time
+            fd = os.open("{lockfile}", os.O_RDWR | os.O_CREAT, 0o600)
+            if sys.argv[1] == "shared":
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                open("{locked}", "w").close()
+                time.sleep(2)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                open("{locked}", "w").close()
+                time.sleep(0.7)
+                with open("{status_file}", "w") as f:
+                    f.write("ActiveState=active\\n")
+            """.format(**locals()))
+        def waitlocked():
+            for attempt in xrange(20):
+                if os.path.exists(locked): break
+                time.sleep(0.1)
+            os.remove(locked)
+        #
+        cmd = "{python} {locker} exclusive &"
+        sh____(cmd.format(**locals()))
+        waitlocked()
+        started = time.time()
+        cmd = "{systemctl} show zza.service -p ActiveState"
+        out, err, end = output3(cmd.format(**locals()))
+        elapsed = time.time() - started
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, err, out)
+        logg.info("elapsed %s", elapsed)
+        self.assertEqual(out.strip(), "ActiveState=active")
+        self.assertGreater(elapsed, 0.5)
+        #
+        cmd = "{python} {locker} shared &"
+        sh____(cmd.format(**locals()))
+        waitlocked()
+        started = time.time()
+        cmd = "{systemctl} status zza.service"
+        out, err, end = output3(cmd.format(**locals()))
+        elapsed = time.time() - started
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, err, out)
+        logg.info("elapsed %s", elapsed)
+        self.assertTrue(greps(out, "Active: active"))
+        self.assertLess(elapsed, 1.0)
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3084_query_in_batch_waits_again_for_a_later_transition(self):
+        """ a query that did not wait long enough for a transition does
+            not wait for that unit again - but only within the same command.
+            A later command of a batch will wait again for the next one."""
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = "SYSTEMCTL_QUERY_LOCKWAIT=1 " + cover() + _systemctl_py + " --root=" + root
+        python = _python
+        lockfile = os_path(root, "/var/run/systemd/zza.service.lock")
+        status_file = os_path(root, "/var/run/zza.service.status")
+        self.makedirs(os.path.dirname(lockfile))
+        locker = os.path.abspath(os_path(testdir, "locker.py"))
+        locked = os.path.abspath(os_path(testdir, "locked"))
+        lockfile = os.path.abspath(lockfile)
+        status_file = os.path.abspath(status_file)
+        text_file(locker, """
+            import fcntl, os, sys, time
+            fd = os.open("{lockfile}", os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            open("{locked}", "w").close()
+            time.sleep(float(sys.argv[1]))
+            with open("{status_file}", "w") as f:
+                f.write("ActiveState=%s\\n" % sys.argv[2])
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/true
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/sleep 2
+            ExecStartPost=/bin/sh -c '{python} {locker} 1 active &'
+            ExecStartPost=/bin/sh -c 'while test ! -f {locked}; do sleep 0.1; done'
+            """.format(**locals()))
+        batch_file = os_path(testdir, "query.batch")
+        text_file(batch_file, """
+            show zza.service
+            start zzb.service
+            show zza.service
+            """)
+        cmd = "{python} {locker} 2.5 failed &"
+        sh____(cmd.format(**locals()))
+        for attempt in xrange(20):
+            if os.path.exists(locked): break
+            time.sleep(0.1)
+        os.remove(locked)
+        cmd = "{systemctl} --batch {batch_file} -p ActiveState"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, err, out)
+        self.assertEqual(lines(out), ["ActiveState=inactive", "ActiveState=active"])
+        self.rm_testdir()
+        self.coverage()
+        self.end()
     def test_3081_two_service_starts_in_parallel_with_lockfile_remove(self, real = None):
         """ consider a situation where a 'systemctl start <service>' is
             done from two programs at the same time. Ensure that there
@@ -6420,6 +6871,61 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.coverage()
         self.end()
+    def test_3265_expansion_of_many_specifiers_is_fast(self):
+        """ check that the special variables are computed once per unit
+            and that a recursive ${VAR} stops at the maxdepth."""
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        count = 1000
+        specials = "\n".join([ "Environment=V%s=%%n.%%N.%%p.%%i.%%t.%%h.%%f.%%T" % num for num in xrange(count) ])
+        plain = "\n".join([ "Environment=V%s=n.N.p.i.t.h.f.T" % num for num in xrange(count) ])
+        text_file(os_path(root, "/etc/sysconfig/b.conf"),"""
+            DEF1='def1'
+            DEF2="${DEF1} def2"
+            DEF3="${DEF2} def3"
+            DEF4="${LOOP1}"
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            {specials}
+            EnvironmentFile=/etc/sysconfig/b.conf
+            ExecStart=/bin/sleep 3
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            {plain}
+            ExecStart=/bin/sleep 3
+            """.format(**locals()))
+        cmd = "LOOP1='${{LOOP2}}' LOOP2='${{LOOP1}}' {systemctl} environment zza.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, err)
+        self.assertEqual(end, 0)
+        unitfile = os_path(root, "/etc/systemd/system/zza.service")
+        V1 = "V1='zza.service'.zza.service.'zza'.''.{run}./root.'{unitfile}'.{tmp}".format(
+              run = os_path(root, "/run"), tmp = os_path(root, "/tmp"), **locals())
+        self.assertIn(V1, lines(out))
+        self.assertTrue(greps(out, "^DEF3=def1 def2 def3$"))
+        self.assertTrue(greps(err, "exceeded maxdepth 20"))
+        #
+        def walltime(cmd, repeat = 3):
+            started = time.time()
+            for attempt in xrange(repeat):
+                sx____(cmd)
+            return (time.time() - started) / repeat
+        cmd = "{systemctl} environment zzb.service"
+        plaintime = walltime(cmd.format(**locals()))
+        cmd = "{systemctl} environment zza.service"
+        specialtime = walltime(cmd.format(**locals()))
+        logg.info("environment: plain %.3fs with specials %.3fs", plaintime, specialtime)
+        self.rm_testdir()
+        self.coverage()
+        self.end()
     def test_3270_may_override_environment_from_commandline(self):
         """ check that --extra-vars can be given on the commandline
             to override settings in Environment= and EnvironmentFile=."""
@@ -6517,18 +7023,94 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3301_service_config_show(self):
-        """ check that a named service config can show its properties"""
+    def test_3275_environment_is_cached_until_the_env_file_changes(self):
+        """ check that the environment of a unit is read only once in a
+            batch run - until its EnvironmentFile is changed."""
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
-        user = self.user()
         root = self.root(testdir)
-        logfile = os_path(root, "/var/log/test.log")
         systemctl = cover() + _systemctl_py + " --root=" + root
-        testsleep = self.testname("sleep")
         bindir = os_path(root, "/usr/bin")
-        text_file(os_path(testdir, "zzs.service"),"""
+        env_file = os_path(root, "/etc/sysconfig/a.conf")
+        flags = "\n".join([ "FLAG_%s=on" % num for num in xrange(5000) ])
+        text_file(env_file, flags + "\nA='first'\n")
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            EnvironmentFile=/etc/sysconfig/a.conf
+            ExecStart={bindir}/change.sh
+            """.format(**locals()))
+        shell_file(os_path(bindir, "change.sh"),"""
+            #! /bin/sh
+            echo 'export A="changed"' >> {env_file}
+            """.format(**locals()))
+        batch_file = os_path(testdir, "env.batch")
+        text_file(batch_file, """
+            environment zza.service
+            environment zza.service
+            restart zza.service
+            environment zza.service
+            """)
+        cmd = "{systemctl} --batch {batch_file} -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s", cmd, end, greps(err, "^exit|cached"))
+        self.assertEqual(end, 0)
+        self.assertEqual(len(greps(out, "^A=first$")), 2)
+        self.assertEqual(len(greps(out, "^A=changed$")), 1)
+        self.assertEqual(len(greps(out, "^FLAG_4999=on$")), 3)
+        self.assertTrue(greps(err, "cached environment of zza.service"))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3285_credentials_are_resolved_once_for_all_exec_lines(self):
+        """ check that the User= credentials are looked up in the parent
+            process only once - the exec children do not scan again."""
+        self.begin()
+        testdir = self.testdir()
+        user = self.user()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        logfile = os_path(root, "/var/log/test.log")
+        journal = os_path(root, "/var/log/journal/zzc.service.log")
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=oneshot
+            User={user}
+            ExecStartPre=/bin/sh -c 'echo pre1 >> {logfile}'
+            ExecStartPre=/bin/sh -c 'echo pre2 >> {logfile}'
+            ExecStartPre=/bin/sh -c 'echo pre3 >> {logfile}'
+            ExecStart=/bin/sh -c 'echo start >> {logfile}'
+            ExecStartPost=/bin/sh -c 'echo post >> {logfile}'
+            """.format(**locals()))
+        os.makedirs(os_path(root, "/var/log"))
+        cmd = "{systemctl} start zzc.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s", cmd, end, greps(err, "credentials"))
+        self.assertEqual(end, 0)
+        log = lines(open(logfile))
+        self.assertEqual(log, ["pre1", "pre2", "pre3", "start", "post"])
+        self.assertEqual(len(greps(err, "resolved credentials %s:" % user)), 1)
+        if os.path.exists(journal):
+            self.assertFalse(greps(open(journal), "resolved credentials"))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3301_service_config_show(self):
+        """ check that a named service config can show its properties"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        user = self.user()
+        root = self.root(testdir)
+        logfile = os_path(root, "/var/log/test.log")
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        text_file(os_path(testdir, "zzs.service"),"""
             [Unit]
             Description=Testing S
             After=foo.service
@@ -7616,101 +8198,693 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3801_start_some_unknown(self):
-        """ check start some unknown unit fails okay"""
+    def test_3720_systemctl_py_init_loop_reaps_on_sigchld(self):
+        """ check that the init-loop reaps an exited service at once
+            (on SIGCHLD) and not only after the InitLoopSleep time. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
         root = self.root(testdir)
         systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 2
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 40
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
         #
-        cmd = "{systemctl} start zz-unknown.service -vv"
-        out, err, end = output3(cmd.format(**locals()))
-        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
-        self.assertEqual(end, 1)
-        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        log_stdout = os.path.join(root, "systemctl.stdout.log")
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stdout = os.open(log_stdout, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stdout, 1)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzb.service", "zzc.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "30"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        time.sleep(6)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, testsleep+" 40"))
+        self.assertFalse(greps(top, testsleep+".*defunct"))
+        self.assertFalse(greps(top, testsleep+" 2"))
+        txt_stderr = lines(open(log_stderr))
+        logg.info("-- %s>\n\t%s", log_stderr, "\n\t".join(txt_stderr))
+        self.assertTrue(greps(txt_stderr, "reap zombie"))
         #
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        txt_stderr = lines(open(log_stderr))
+        self.assertTrue(greps(txt_stderr, "interrupted - exit init-loop"))
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3802_stop_some_unknown(self):
-        """ check stop some unknown unit fails okay"""
+    def test_3725_systemctl_py_init_loop_stop_has_a_shutdown_deadline(self):
+        """ check that the stop at the end of the init-loop is limited by
+            the SYSTEMCTL_SHUTDOWN_TIMEOUT also without --jobs, and that
+            the remaining processes get a SIGKILL when it has passed. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
         root = self.root(testdir)
-        systemctl = cover() + _systemctl_py + " --root=" + root
-        #
-        cmd = "{systemctl} stop zz-unknown.service -vv"
-        out, err, end = output3(cmd.format(**locals()))
-        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
-        self.assertEqual(end, 1)
-        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        shell_file(os_path(bindir, "stopper"),"""
+            #! /bin/sh
+            sleep $1
+            kill $2
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 40
+            ExecStop={bindir}/stopper 30 $MAINPID
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
         #
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzc.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_SHUTDOWN_TIMEOUT"] = "2"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        for attempt in xrange(30):
+            if os.path.exists(log_stderr) and greps(open(log_stderr), "init-loop start"): break
+            time.sleep(0.2)
+        time.sleep(0.5)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, testsleep+" 40"))
+        started = time.time()
+        os.kill(pid, 15) # SIGTERM
+        os.waitpid(pid, 0)
+        elapsed = time.time() - started
+        logg.info("elapsed %s", elapsed)
+        txt_stderr = lines(open(log_stderr))
+        logg.info("-- %s>\n\t%s", log_stderr, "\n\t".join(txt_stderr))
+        self.assertLess(elapsed, 6)
+        self.assertTrue(greps(txt_stderr, "units not stopped after 2s: zzc.service"))
+        self.assertFalse(greps(txt_stderr, "stop_unit zzc.service in worker"))
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, testsleep+" 40"))
+        self.assertFalse(greps(top, "stopper 30"))
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3803_restart_some_unknown(self):
-        """ check restart some unknown unit fails okay"""
+    def test_3730_systemctl_py_init_loop_control_socket(self):
+        """ check that the init-loop runs the commands of a systemctl
+            client that finds the control socket of the init-loop. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
         root = self.root(testdir)
         systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 40
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzd.service"),"""
+            [Unit]
+            Description=Testing D
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 50
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        control_socket = os_path(root, "/var/run/systemd/private")
         #
-        cmd = "{systemctl} restart zz-unknown.service -vv"
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzb.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "30"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        time.sleep(3)
+        self.assertTrue(os.path.exists(control_socket))
+        self.assertEqual(os.stat(control_socket).st_mode & 0o777, 0o600)
+        #
+        cmd = "{systemctl} start zzd.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 0)
+        for attempt in range(10): # the control worker exits after its reply
+            top = _recent(output(_top_list))
+            if greps(top, r" %s .*%s 50" % (pid, testsleep)):
+                break
+            time.sleep(0.1)
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, r" %s .*%s 50" % (pid, testsleep)))
+        txt_stderr = lines(open(log_stderr))
+        self.assertTrue(greps(txt_stderr, "control request: start zzd.service"))
+        cmd = "{systemctl} show zzd.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(out.strip(), "ActiveState=active")
+        cmd = "{systemctl} start zz-unknown.service"
         out, err, end = output3(cmd.format(**locals()))
         logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
         self.assertEqual(end, 1)
         self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        cmd = "{systemctl} stop zzd.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, testsleep+" 50"))
+        self.assertTrue(greps(top, testsleep+" 40"))
         #
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        self.assertFalse(os.path.exists(control_socket))
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3804_reload_some_unknown(self):
-        """ check reload some unknown unit fails okay"""
+    def test_3735_systemctl_py_init_loop_control_requests_of_the_client(self):
+        """ check that the init-loop runs a control request in a worker with
+            the environment and the options of the client - another request
+            is answered while a slow start is still going on. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
         root = self.root(testdir)
         systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        envfile = os.path.abspath(os_path(testdir, "zzf.env"))
+        trigger = os.path.abspath(os_path(testdir, "trigger"))
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 40
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zze.service"),"""
+            [Unit]
+            Description=Testing E
+            [Service]
+            Type=simple
+            ExecStartPre=/bin/sh -c 'while test ! -f {trigger}; do sleep 0.1; done'
+            ExecStart={bindir}/{testsleep} 50
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzf.service"),"""
+            [Unit]
+            Description=Testing F
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/sh -c 'echo "FOO=$FOO BAR=$BAR" > {envfile}'
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        control_socket = os_path(root, "/var/run/systemd/private")
         #
-        cmd = "{systemctl} reload zz-unknown.service -vv"
-        out, err, end = output3(cmd.format(**locals()))
-        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
-        self.assertEqual(end, 1)
-        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzb.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "30"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        time.sleep(3)
+        self.assertTrue(os.path.exists(control_socket))
+        #
+        cmd = "{systemctl} start zze.service"
+        slow = subprocess.Popen(cmd.format(**locals()), shell=True)
+        time.sleep(0.5)
+        cmd = "timeout 10 {systemctl} show zzb.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        running = slow.poll()
+        text_file(trigger, "go")
+        self.assertEqual(out.strip(), "ActiveState=active") # not blocked by the start
+        self.assertEqual(running, None)
+        self.assertEqual(slow.wait(), 0)
+        txt_stderr = lines(open(log_stderr))
+        self.assertTrue(greps(txt_stderr, "control request: start zze.service"))
+        self.assertTrue(greps(txt_stderr, "control request: show zzb.service"))
+        #
+        cmd = "FOO=foo {systemctl} restart zzf.service -e BAR=bar"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        txt_stderr = lines(open(log_stderr))
+        self.assertTrue(greps(txt_stderr, "control request: restart zzf.service"))
+        self.assertEqual(open(envfile).read().strip(), "FOO=foo BAR=bar")
         #
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        self.assertFalse(os.path.exists(control_socket))
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3805_reload_or_restart_some_unknown(self):
-        """ check reload-or-restart some unknown unit fails okay"""
+    def test_3740_systemctl_py_init_loop_forwards_logs_at_once(self):
+        """ check that the init-loop forwards the log lines of a service
+            right away - not only after the InitLoopSleep timeout. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
         root = self.root(testdir)
-        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        trigger = os.path.abspath(os_path(testdir, "trigger"))
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart={bindir}/logger.sh
+            """.format(**locals()))
+        shell_file(os_path(bindir, "logger.sh"),"""
+            #! /bin/sh
+            while test ! -f {trigger}; do sleep 0.1; done
+            for i in `seq 1 2000`; do echo "line $i"; done
+            exec {bindir}/{testsleep} 40
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
         #
-        cmd = "{systemctl} reload-or-restart zz-unknown.service -vv"
-        out, err, end = output3(cmd.format(**locals()))
-        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
-        self.assertEqual(end, 1)
-        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        log_stdout = os.path.join(root, "systemctl.stdout.log")
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stdout = os.open(log_stdout, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stdout, 1)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzc.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "30"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        time.sleep(3)
+        text_file(trigger, "")
+        started = time.time()
+        for attempt in xrange(50):
+            time.sleep(0.1)
+            if greps(open(log_stdout), "zzc.service: line 2000$"):
+                break
+        forwarded = time.time() - started
+        logg.info("forwarded after %.3fs", forwarded)
+        txt_stdout = lines(open(log_stdout))
+        self.assertEqual(len(greps(txt_stdout, "^zzc.service: line [0-9]*$")), 2000)
+        self.assertEqual(len(greps(txt_stdout, "^zzc.service: line 1000$")), 1)
+        self.assertFalse(greps(txt_stdout, "^zzc.service: $"))
+        self.assertLess(forwarded, 2)
         #
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3806_reload_or_try_restart_some_unknown(self):
-        """ check reload-or-try-restart some unknown unit fails okay"""
+    def test_3750_systemctl_py_init_loop_reads_log_pipe(self):
+        """ check that with SYSTEMCTL_LOG_PIPE the service writes into a
+            pipe of the init-loop which forwards and tees the lines. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
         root = self.root(testdir)
-        systemctl = cover() + _systemctl_py + " --root=" + root
-        #
-        cmd = "{systemctl} reload-or-try-restart zz-unknown.service -vv"
-        out, err, end = output3(cmd.format(**locals()))
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        trigger = os.path.abspath(os_path(testdir, "trigger"))
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart={bindir}/logger.sh
+            """.format(**locals()))
+        shell_file(os_path(bindir, "logger.sh"),"""
+            #! /bin/sh
+            while test ! -f {trigger}; do sleep 0.1; done
+            for i in `seq 1 2000`; do echo "line $i"; done
+            echo "error 1" >&2
+            exec {bindir}/{testsleep} 40
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        #
+        log_stdout = os.path.join(root, "systemctl.stdout.log")
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stdout = os.open(log_stdout, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stdout, 1)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzc.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "30"
+            env["SYSTEMCTL_LOG_PIPE"] = "yes"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        time.sleep(3)
+        text_file(trigger, "")
+        started = time.time()
+        for attempt in xrange(50):
+            time.sleep(0.1)
+            if greps(open(log_stdout), "zzc.service: error 1$"):
+                break
+        forwarded = time.time() - started
+        logg.info("forwarded after %.3fs", forwarded)
+        txt_stdout = lines(open(log_stdout))
+        self.assertEqual(len(greps(txt_stdout, "^zzc.service: line [0-9]*$")), 2000)
+        self.assertEqual(len(greps(txt_stdout, "^zzc.service: error 1$")), 1)
+        self.assertLess(forwarded, 2)
+        journal = os_path(root, "/var/log/journal/zzc.service.log")
+        txt_journal = lines(open(journal))
+        self.assertEqual(len(greps(txt_journal, "^line [0-9]*$")), 2000)
+        self.assertEqual(len(greps(txt_journal, "^error 1$")), 1)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        found = greps(top, testsleep+" 40")
+        self.assertTrue(found)
+        sleeppid = int(found[0].split()[1])
+        self.assertTrue(os.readlink("/proc/%s/fd/1" % sleeppid).startswith("pipe:"))
+        #
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3755_systemctl_py_init_loop_drains_log_pipe_at_start(self):
+        """ check that with SYSTEMCTL_LOG_PIPE the output of a service is
+            read while it is started - it may write more than a pipe
+            buffer before the init-loop is running. """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStartPre={bindir}/logger.sh
+            ExecStart={bindir}/{testsleep} 40
+            """.format(**locals()))
+        shell_file(os_path(bindir, "logger.sh"),"""
+            #! /bin/sh
+            for i in `seq 1 20000`; do echo "line $i"; done
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        #
+        log_stdout = os.path.join(root, "systemctl.stdout.log")
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stdout = os.open(log_stdout, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stdout, 1)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzc.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "30"
+            env["SYSTEMCTL_LOG_PIPE"] = "yes"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        for attempt in xrange(100):
+            time.sleep(0.1)
+            if greps(open(log_stderr), "init-loop start"):
+                break
+        time.sleep(1)
+        txt_stderr = lines(open(log_stderr))
+        self.assertTrue(greps(txt_stderr, "init-loop start"))
+        txt_stdout = lines(open(log_stdout))
+        self.assertEqual(len(greps(txt_stdout, "^zzc.service: line [0-9]*$")), 20000)
+        journal = os_path(root, "/var/log/journal/zzc.service.log")
+        txt_journal = lines(open(journal))
+        self.assertEqual(len(greps(txt_journal, "^line [0-9]*$")), 20000)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, testsleep+" 40"))
+        #
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3756_systemctl_py_init_loop_reads_log_pipe_on_stop(self):
+        """ check that with SYSTEMCTL_LOG_PIPE the lines that a service
+            writes on its SIGTERM are forwarded when the init-loop stops. """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        bindir = os_path(root, "/usr/bin")
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart={bindir}/logger.sh
+            """.format(**locals()))
+        shell_file(os_path(bindir, "logger.sh"),"""
+            #! /bin/sh
+            trap 'for i in `seq 1 20000`; do echo "stopping $i"; done; exit 0' TERM
+            echo "started"
+            while true; do sleep 0.1; done
+            """.format(**locals()))
+        #
+        log_stdout = os.path.join(root, "systemctl.stdout.log")
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stdout = os.open(log_stdout, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stdout, 1)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzc.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "30"
+            env["SYSTEMCTL_LOG_PIPE"] = "yes"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        for attempt in xrange(100):
+            time.sleep(0.1)
+            if greps(open(log_stderr), "init-loop start"):
+                break
+        time.sleep(1)
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        txt_stdout = lines(open(log_stdout))
+        self.assertEqual(len(greps(txt_stdout, "^zzc.service: started$")), 1)
+        self.assertEqual(len(greps(txt_stdout, "^zzc.service: stopping [0-9]*$")), 20000)
+        journal = os_path(root, "/var/log/journal/zzc.service.log")
+        txt_journal = lines(open(journal))
+        self.assertEqual(len(greps(txt_journal, "^stopping [0-9]*$")), 20000)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, "logger.sh"))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3760_exec_commands_are_started_with_posix_spawn(self):
+        """ check that the Exec commands are started with posix_spawn
+            where possible and that it is quicker than the fork path. It
+            needs no chdir, so systemctl is run in the --root here. """
+        python = _python
+        cmd = "{python} -c 'import os; os.posix_spawn' 2>/dev/null"
+        if sx____(cmd.format(**locals())):
+            self.skipTest("no posix_spawn in " + python)
+        self.begin()
+        testdir = self.testdir()
+        root = os.path.abspath(self.root(testdir))
+        systemctl = cover() + realpath(_systemctl_py) + " --root=" + root
+        count = 100
+        execs = "\n".join([ "ExecStart=/bin/true" ] * count)
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            {execs}
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=oneshot
+            User=root
+            ExecStart=/bin/true
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=oneshot
+            WorkingDirectory=/srv
+            ExecStart=/bin/sh -c 'pwd > {root}/pwd.txt'
+            """.format(**locals()))
+        os.makedirs(os_path(root, "/srv"))
+        #
+        cmd = "cd {root} && {systemctl} restart zza.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertEqual(len(greps(err, "posix_spawn PID")), count)
+        cmd = "cd {root} && SYSTEMCTL_POSIX_SPAWN=no {systemctl} restart zza.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertFalse(greps(err, "posix_spawn"))
+        cmd = "cd {root} && {systemctl} restart zzb.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertFalse(greps(err, "posix_spawn"))
+        cmd = "cd {root} && {systemctl} restart zzc.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertFalse(greps(err, "posix_spawn"))
+        self.assertEqual(lines(open(os_path(root, "/pwd.txt"))), [ os_path(root, "/srv") ])
+        cmd = "{systemctl} restart zza.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertFalse(greps(err, "posix_spawn"))
+        #
+        def walltime(cmd, repeat = 3):
+            started = time.time()
+            for attempt in xrange(repeat):
+                sx____(cmd)
+            return (time.time() - started) / repeat / count
+        cmd = "cd {root} && SYSTEMCTL_POSIX_SPAWN=no {systemctl} restart zza.service"
+        forktime = walltime(cmd.format(**locals()))
+        cmd = "cd {root} && {systemctl} restart zza.service"
+        spawntime = walltime(cmd.format(**locals()))
+        logg.info("per exec: fork %.2fms posix_spawn %.2fms", forktime * 1000, spawntime * 1000)
+        self.assertLess(spawntime, forktime)
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3801_start_some_unknown(self):
+        """ check start some unknown unit fails okay"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        #
+        cmd = "{systemctl} start zz-unknown.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 1)
+        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3802_stop_some_unknown(self):
+        """ check stop some unknown unit fails okay"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        #
+        cmd = "{systemctl} stop zz-unknown.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 1)
+        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3803_restart_some_unknown(self):
+        """ check restart some unknown unit fails okay"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        #
+        cmd = "{systemctl} restart zz-unknown.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 1)
+        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3804_reload_some_unknown(self):
+        """ check reload some unknown unit fails okay"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        #
+        cmd = "{systemctl} reload zz-unknown.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 1)
+        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3805_reload_or_restart_some_unknown(self):
+        """ check reload-or-restart some unknown unit fails okay"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        #
+        cmd = "{systemctl} reload-or-restart zz-unknown.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 1)
+        self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3806_reload_or_try_restart_some_unknown(self):
+        """ check reload-or-try-restart some unknown unit fails okay"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        #
+        cmd = "{systemctl} reload-or-try-restart zz-unknown.service -vv"
+        out, err, end = output3(cmd.format(**locals()))
         logg.info(" %s =>%s \n%s\n%s", cmd, end, err, out)
         self.assertEqual(end, 1)
         self.assertTrue(greps(err, "Unit zz-unknown.service could not be found."))
@@ -7923,76 +9097,298 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.coverage()
         self.end()
-
-    def test_3901_service_config_cat(self):
-        """ check that a name service config can be printed as-is"""
+
+    def test_3901_service_config_cat(self):
+        """ check that a name service config can be printed as-is"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        user = self.user()
+        root = self.root(testdir)
+        logfile = os_path(root, "/var/log/test.log")
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        text_file(os_path(testdir, "zzs.service"),"""
+            [Unit]
+            Description=Testing S
+            After=foo.service
+            [Service]
+            Type=simple
+            ExecStart={bindir}{testsleep} 99
+            ExecStop=/usr/bin/killall {testsleep}
+            [Install]
+            WantedBy=multi-user.target
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        copy_file(os_path(testdir, "zzs.service"), os_path(root, "/etc/systemd/system/zzs.service"))
+        #
+        cmd = "{systemctl} cat zzs.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        orig = lines(open(os_path(root, "/etc/systemd/system/zzs.service")))
+        data = lines(out)
+        self.assertEqual(orig + [""], data)
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3903_service_config_cat_plus_unknown(self):
+        """ check that a name service config can be printed as-is"""
+        self.begin()
+        testname = self.testname()
+        testdir = self.testdir()
+        user = self.user()
+        root = self.root(testdir)
+        logfile = os_path(root, "/var/log/test.log")
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        text_file(os_path(testdir, "zzs.service"),"""
+            [Unit]
+            Description=Testing S
+            After=foo.service
+            [Service]
+            Type=simple
+            ExecStart={bindir}{testsleep} 99
+            ExecStop=/usr/bin/killall {testsleep}
+            [Install]
+            WantedBy=multi-user.target
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        copy_file(os_path(testdir, "zzs.service"), os_path(root, "/etc/systemd/system/zzs.service"))
+        #
+        cmd = "{systemctl} cat zzs.service unknown.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s \n%s", cmd, end, out)
+        self.assertEqual(end, 1)
+        orig = lines(open(os_path(root, "/etc/systemd/system/zzs.service")))
+        data = lines(out)
+        self.assertEqual(orig + [""], data)
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3905_service_log_is_rotated(self):
+        """ check that the journal log of a service is rotated when it gets
+            too big - and that 'log' shows the segments with -n and --since """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = "SYSTEMCTL_JOURNAL_MAXFILESIZE=2000 " + cover() + _systemctl_py + " --root=" + root
+        bindir = os_path(root, "/usr/bin")
+        counter = os.path.abspath(os_path(testdir, "counter"))
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart={bindir}/print100.sh
+            """.format(**locals()))
+        shell_file(os_path(bindir, "print100.sh"),"""
+            #! /bin/sh
+            N=`cat {counter} 2>/dev/null || echo 0`
+            N=`expr $N + 1`
+            echo $N > {counter}
+            for i in `seq 1 100`; do echo "run $N line $i"; done
+            """.format(**locals()))
+        journal = os_path(root, "/var/log/journal/zza.service.log")
+        for run in xrange(4):
+            cmd = "{systemctl} restart zza.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+        time.sleep(1.2)
+        cmd = "{systemctl} log zza.service -n 1"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(lines(out), [ "run 4 line 100" ])
+        time.sleep(0.5)
+        since = time.time()
+        time.sleep(0.5)
+        cmd = "{systemctl} restart zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertTrue(os.path.exists(journal + ".1.gz"))
+        self.assertTrue(os.path.exists(journal + ".2.gz"))
+        self.assertTrue(os.path.exists(journal + ".1.idx"))
+        self.assertFalse(os.path.exists(journal + ".3.gz"))
+        self.assertLess(os.path.getsize(journal), 2000)
+        #
+        cmd = "{systemctl} log zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertEqual(len(lines(out)), 500)
+        self.assertEqual(lines(out)[0], "run 1 line 1")
+        self.assertEqual(lines(out)[-1], "run 5 line 100")
+        cmd = "{systemctl} log zza.service -n 3"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(lines(out), [ "run 5 line 98", "run 5 line 99", "run 5 line 100" ])
+        cmd = "{systemctl} log zza.service --lines 150"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(len(lines(out)), 150)
+        self.assertEqual(lines(out)[0], "run 4 line 51")
+        cmd = "{systemctl} log zza.service --since @{since}"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertEqual(len(lines(out)), 100)
+        self.assertEqual(lines(out)[0], "run 5 line 1")
+        cmd = "{systemctl} log zza.service --since=-1h -n 2"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), [ "run 5 line 99", "run 5 line 100" ])
+        cmd = "{systemctl} log zza.service --since=yesternoon"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 1)
+        #
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3906_service_log_rotation_keeps_lines_written_meanwhile(self):
+        """ check that the lines that a service writes while its log is
+            being rotated are not lost - all of them are in the segments."""
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = "SYSTEMCTL_JOURNAL_MAXFILESIZE=1000 SYSTEMCTL_JOURNAL_MAXFILES=200 "
+        systemctl += cover() + _systemctl_py + " --root=" + root
+        python = _python
+        journal = os.path.abspath(os_path(root, "/var/log/journal/zza.service.log"))
+        done = os.path.abspath(os_path(testdir, "done"))
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/true
+            """)
+        writer = os_path(testdir, "writer.py")
+        text_file(writer, """
+            import os, time
+            fd = os.open("{journal}", os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            for num in range(1, 5001):
+                os.write(fd, ("line %s\\n" % num).encode("utf-8"))
+                if not num % 50:
+                    time.sleep(0.01)
+            open("{done}", "w").close()
+            """.format(**locals()))
+        self.makedirs(os.path.dirname(journal))
+        cmd = "{python} {writer} &"
+        sh____(cmd.format(**locals()))
+        for attempt in xrange(100):
+            if os.path.exists(done): break
+            cmd = "{systemctl} restart zza.service"
+            sh____(cmd.format(**locals()))
+        self.assertTrue(os.path.exists(done))
+        self.assertTrue(os.path.exists(journal + ".3.gz"))
+        cmd = "{systemctl} log zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        found = [ line for line in lines(out) if line.startswith("line ") ]
+        logg.info("found %s lines", len(found))
+        self.assertEqual(sorted(found), sorted([ "line %s" % num for num in xrange(1, 5001) ]))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_3907_service_log_is_checked_by_one_writer(self):
+        """ check that the journal log is not rotated while another process
+            holds its flock - and that 'log' does not write to the index. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
-        user = self.user()
         root = self.root(testdir)
-        logfile = os_path(root, "/var/log/test.log")
-        systemctl = cover() + _systemctl_py + " --root=" + root
-        testsleep = self.testname("sleep")
+        systemctl = "SYSTEMCTL_JOURNAL_MAXFILESIZE=2000 " + cover() + _systemctl_py + " --root=" + root
         bindir = os_path(root, "/usr/bin")
-        text_file(os_path(testdir, "zzs.service"),"""
+        counter = os.path.abspath(os_path(testdir, "counter"))
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
             [Unit]
-            Description=Testing S
-            After=foo.service
+            Description=Testing A
             [Service]
-            Type=simple
-            ExecStart={bindir}{testsleep} 99
-            ExecStop=/usr/bin/killall {testsleep}
-            [Install]
-            WantedBy=multi-user.target
+            Type=oneshot
+            ExecStart={bindir}/print100.sh
             """.format(**locals()))
-        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
-        copy_file(os_path(testdir, "zzs.service"), os_path(root, "/etc/systemd/system/zzs.service"))
-        #
-        cmd = "{systemctl} cat zzs.service -vv"
+        shell_file(os_path(bindir, "print100.sh"),"""
+            #! /bin/sh
+            N=`cat {counter} 2>/dev/null || echo 0`
+            N=`expr $N + 1`
+            echo $N > {counter}
+            for i in `seq 1 100`; do echo "run $N line $i"; done
+            """.format(**locals()))
+        journal = os_path(root, "/var/log/journal/zza.service.log")
+        cmd = "{systemctl} restart zza.service"
         out, end = output2(cmd.format(**locals()))
-        logg.info(" %s =>%s \n%s", cmd, end, out)
         self.assertEqual(end, 0)
-        orig = lines(open(os_path(root, "/etc/systemd/system/zzs.service")))
-        data = lines(out)
-        self.assertEqual(orig + [""], data)
+        index = open(journal + ".idx").read()
+        size = os.path.getsize(journal)
+        time.sleep(1.2)
+        cmd = "{systemctl} log zza.service -n 1"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), [ "run 1 line 100" ])
+        cmd = "{systemctl} log zza.service --since=-1h"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(len(lines(out)), 100)
+        self.assertEqual(open(journal + ".idx").read(), index)
+        self.assertEqual(os.path.getsize(journal), size)
+        os.remove(journal + ".idx")
+        cmd = "{systemctl} log zza.service -n 1"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), [ "run 1 line 100" ])
+        self.assertFalse(os.path.exists(journal + ".idx"))
         #
+        locked = open(journal)
+        fcntl.flock(locked.fileno(), fcntl.LOCK_EX)
+        cmd = "{systemctl} restart zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertFalse(os.path.exists(journal + ".1.gz"))
+        self.assertGreater(os.path.getsize(journal), 2000)
+        locked.close()
+        cmd = "{systemctl} restart zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
+        self.assertTrue(os.path.exists(journal + ".1.gz"))
+        cmd = "{systemctl} log zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(len(lines(out)), 300)
         self.rm_testdir()
         self.coverage()
         self.end()
-    def test_3903_service_config_cat_plus_unknown(self):
-        """ check that a name service config can be printed as-is"""
+    def test_3908_service_log_rotation_cuts_whole_blocks(self):
+        """ check that the rotation cuts the journal log at a block boundary
+            and that 'log' joins the line that was split by that. """
         self.begin()
-        testname = self.testname()
         testdir = self.testdir()
-        user = self.user()
         root = self.root(testdir)
-        logfile = os_path(root, "/var/log/test.log")
-        systemctl = cover() + _systemctl_py + " --root=" + root
-        testsleep = self.testname("sleep")
+        systemctl = "SYSTEMCTL_JOURNAL_MAXFILESIZE=5000 " + cover() + _systemctl_py + " --root=" + root
         bindir = os_path(root, "/usr/bin")
-        text_file(os_path(testdir, "zzs.service"),"""
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
             [Unit]
-            Description=Testing S
-            After=foo.service
+            Description=Testing A
             [Service]
-            Type=simple
-            ExecStart={bindir}{testsleep} 99
-            ExecStop=/usr/bin/killall {testsleep}
-            [Install]
-            WantedBy=multi-user.target
+            Type=oneshot
+            ExecStart={bindir}/print300.sh
             """.format(**locals()))
-        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
-        copy_file(os_path(testdir, "zzs.service"), os_path(root, "/etc/systemd/system/zzs.service"))
-        #
-        cmd = "{systemctl} cat zzs.service unknown.service -vv"
+        shell_file(os_path(bindir, "print300.sh"),"""
+            #! /bin/sh
+            for i in `seq 1 300`; do printf "line %05d %s\\n" $i "........................................"; done
+            """.format(**locals()))
+        journal = os_path(root, "/var/log/journal/zza.service.log")
+        expected = [ "line %05d %s" % (num, "." * 40) for num in xrange(1, 301) ]
+        cmd = "{systemctl} start zza.service"
         out, end = output2(cmd.format(**locals()))
-        logg.info(" %s =>%s \n%s", cmd, end, out)
-        self.assertEqual(end, 1)
-        orig = lines(open(os_path(root, "/etc/systemd/system/zzs.service")))
-        data = lines(out)
-        self.assertEqual(orig + [""], data)
-        #
+        self.assertEqual(end, 0)
+        self.assertTrue(os.path.exists(journal + ".1.gz"))
+        blocksize = os.statvfs(journal).f_bsize
+        self.assertEqual(os.path.getsize(journal), 300 * 52 % blocksize)
+        self.assertNotEqual(open(journal).read()[:5], "line ")
+        cmd = "{systemctl} log zza.service"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), expected)
+        cmd = "{systemctl} log zza.service -n 100"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), expected[-100:])
+        cmd = "{systemctl} log zza.service --since=-1h"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(lines(out), expected)
         self.rm_testdir()
         self.coverage()
         self.end()
@@ -9417,6 +10813,153 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.assertNotEqual(ps6[0], ps7[0])
         #
         logg.info("LOG\n%s", " "+open(logfile).read().replace("\n","\n "))
+    def test_4038_notify_service_ready_is_seen_at_once(self):
+        """ check that a start of a notify service returns when READY=1 is
+            sent, and that the init-loop will take later STATUS= messages """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        counter = os.path.abspath(os_path(testdir, "counter"))
+        os.makedirs(os_path(root, "/var/run"))
+        shell_file(os_path(bindir, "notifier"), """
+            #! /usr/bin/python3
+            import os, socket, sys, time
+            counter = "{counter}"
+            run = os.path.exists(counter) and int(open(counter).read()) or 0
+            open(counter, "w").write(str(run + 1))
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.sendto(b"STATUS=starting", os.environ["NOTIFY_SOCKET"])
+            time.sleep(0.1)
+            sock.sendto(b"READY=1", os.environ["NOTIFY_SOCKET"])
+            time.sleep(int(sys.argv[1]))
+            sock.sendto(("STATUS=serving requests %s" % (run + 1)).encode("utf-8"), os.environ["NOTIFY_SOCKET"])
+            os.execv("{bindir}/{testsleep}", [ "{testsleep}", "40" ])
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzn.service"),"""
+            [Unit]
+            Description=Testing N
+            [Service]
+            Type=notify
+            ExecStart={bindir}/notifier 2
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        status_file = os_path(root, "/var/run/zzn.service.status")
+        #
+        started = time.time()
+        cmd = "{systemctl} start zzn.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        elapsed = time.time() - started
+        logg.info("elapsed %s", elapsed)
+        self.assertLess(elapsed, 1.2)
+        cmd = "{systemctl} show zzn.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(out.strip(), "ActiveState=active")
+        cmd = "{systemctl} stop zzn.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        #
+        log_stderr = os.path.join(root, "systemctl.stderr.log")
+        pid = os.fork()
+        if not pid:
+            new_stderr = os.open(log_stderr, os.O_WRONLY|os.O_CREAT|os.O_TRUNC)
+            os.dup2(new_stderr, 2)
+            systemctl_cmd = [ _systemctl_py, "--root="+root, "init", "zzn.service", "-vv" ]
+            env = os.environ.copy()
+            env["SYSTEMCTL_INITLOOP"] = "1"
+            os.execve(_systemctl_py, systemctl_cmd, env)
+        time.sleep(4)
+        status = open(status_file).read()
+        logg.info("%s:\n%s", status_file, status)
+        self.assertTrue(greps(status, "StatusText=serving requests 2"))
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, testsleep+" 40"))
+        # the restart on the control socket uses the notify socket of the init-loop
+        cmd = "{systemctl} restart zzn.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        time.sleep(3)
+        status = open(status_file).read()
+        logg.info("%s:\n%s", status_file, status)
+        self.assertTrue(greps(status, "StatusText=serving requests 3"))
+        # a standalone systemctl rebinds it, the init-loop takes it back later
+        cmd = "{systemctl} try-restart zzn.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        time.sleep(3)
+        status = open(status_file).read()
+        logg.info("%s:\n%s", status_file, status)
+        self.assertTrue(greps(status, "StatusText=serving requests 4"))
+        os.kill(pid, 2) # SIGINT
+        os.waitpid(pid, 0)
+        #
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_4039_forking_service_pid_file_is_seen_at_once(self):
+        """ check that a start of a forking service does not sleep a second
+            when the PIDFile gets written shortly after the fork """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        os.makedirs(os_path(root, "/var/run"))
+        shell_file(os_path(bindir, "zzz.init"), """
+            #! /bin/sh
+            (sleep 0.2; {bindir}/{testsleep} 111 0<&- >/dev/null 2>&1 &
+             echo $! > {root}/var/run/zzz.init.pid.tmp
+             mv {root}/var/run/zzz.init.pid.tmp {root}/var/run/zzz.init.pid
+            ) 0<&- >/dev/null 2>&1 &
+            exit 0
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzz.service"),"""
+            [Unit]
+            Description=Testing Z
+            [Service]
+            Type=forking
+            PIDFile={root}/var/run/zzz.init.pid
+            ExecStart={bindir}/zzz.init
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        #
+        started = time.time()
+        cmd = "{systemctl} start zzz.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        elapsed = time.time() - started
+        logg.info("elapsed %s", elapsed)
+        self.assertLess(elapsed, 1.0)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, testsleep+" 111"))
+        cmd = "{systemctl} show zzz.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(out.strip(), "ActiveState=active")
+        #
+        cmd = "{systemctl} stop zzz.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
     def test_4040_oneshot_service_functions(self):
         """ check that we manage oneshot services in a root env
             with basic run-service commands: start, stop, restart,
@@ -10448,39 +11991,245 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.assertEqual(end, 3)
         self.assertTrue(os.path.exists(os_path(root, "/var/tmp/test.1")))
         #
-        logg.info("== mark the status file as being too old")
-        status_file = os_path(root, "/var/run/zzz.service.status")
-        self.assertTrue(os.path.exists(status_file))
-        sh____("LANG=C stat {status_file} | grep Modify:".format(**locals()))
-        sh____("LANG=C stat /proc/1/status | grep Modify:".format(**locals()))
-        sh____("touch -r /proc/1/status {status_file}".format(**locals()))
-        sh____("LANG=C stat {status_file} | grep Modify:".format(**locals()))
+        logg.info("== mark the status file as being too old")
+        status_file = os_path(root, "/var/run/zzz.service.status")
+        self.assertTrue(os.path.exists(status_file))
+        sh____("LANG=C stat {status_file} | grep Modify:".format(**locals()))
+        sh____("LANG=C stat /proc/1/status | grep Modify:".format(**locals()))
+        sh____("touch -r /proc/1/status {status_file}".format(**locals()))
+        sh____("LANG=C stat {status_file} | grep Modify:".format(**locals()))
+        #
+        logg.info("== the next is-active shall then truncate it")
+        old_size = os.path.getsize(status_file)
+        is_activeXX = "{systemctl} is-active zzz.service other.service {vv} {vv}"
+        act, end = output2(is_activeXX.format(**locals()))
+        self.assertEqual(act.strip(), "inactive\nunknown")
+        self.assertEqual(end, 3)
+        self.assertTrue(os.path.exists(os_path(root, "/var/tmp/test.1")))
+        new_size = os.path.getsize(status_file)
+        logg.info("status-file size: old %s new %s", old_size, new_size)
+        self.assertGreater(old_size, 0)
+        self.assertEqual(new_size, 0)
+        #
+        logg.info("== 'stop' shall cleanup a service that was not inactive")
+        cmd = "{systemctl} stop zzz.service other.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info("%s =>\n%s", cmd, out)
+        self.assertNotEqual(end, 0)
+        act, end = output2(is_active.format(**locals()))
+        self.assertEqual(act.strip(), "inactive\nunknown")
+        self.assertEqual(end, 3)
+        self.assertFalse(os.path.exists(os_path(root, "/var/tmp/test.1")))
+        # and the status_file is also cleaned away
+        self.assertFalse(os.path.exists(status_file))
+        #
+        logg.info("LOG\n%s", " "+open(logfile).read().replace("\n","\n "))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_4061_status_in_one_state_file(self):
+        """ check that with SYSTEMCTL_STATE_FILE the status of all units
+            is kept in one file instead of a status file per unit """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = "SYSTEMCTL_STATE_FILE=1 " + cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        for name, seconds in [ ("zza", 40), ("zzb", 50) ]:
+            text_file(os_path(root, "/etc/systemd/system/%s.service" % name),"""
+                [Unit]
+                Description=Testing {name}
+                [Service]
+                Type=simple
+                ExecStart={bindir}/{testsleep} {seconds}
+                [Install]
+                WantedBy=multi-user.target
+                """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=oneshot
+            ExecStart=/bin/false
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        state_file = os_path(root, "/var/run/systemctl.state")
+        #
+        cmd = "{systemctl} start zza.service zzb.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        cmd = "{systemctl} start zzc.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 1)
+        self.assertFalse(os.path.exists(os_path(root, "/var/run/zza.service.status")))
+        self.assertFalse(os.path.exists(os_path(root, "/var/run/zzc.service.status")))
+        state = lines(open(state_file))
+        logg.info("%s:\n%s", state_file, "\n".join(state))
+        self.assertEqual(len(greps(state, "^zza.service\t.*MainPID=[1-9]")), 1)
+        self.assertEqual(len(greps(state, "^zzb.service\t.*MainPID=[1-9]")), 1)
+        self.assertEqual(len(greps(state, "^zzc.service\t.*ActiveState=failed")), 1)
+        cmd = "{systemctl} list-units --all"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertTrue(greps(out, r"zza.service\s+loaded\s+active\s+running"))
+        self.assertTrue(greps(out, r"zzb.service\s+loaded\s+active\s+running"))
+        self.assertTrue(greps(out, r"zzc.service\s+loaded\s+failed\s+dead"))
+        cmd = "{systemctl} reset-failed zzc.service"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertFalse(greps(open(state_file), "^zzc.service"))
+        #
+        cmd = "{systemctl} stop zza.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        state = lines(open(state_file))
+        logg.info("%s:\n%s", state_file, "\n".join(state))
+        self.assertFalse(greps(state, "^zza.service"))
+        self.assertTrue(greps(state, "^zzb.service"))
+        cmd = "{systemctl} show zza.service zzb.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(lines(out), [ "ActiveState=inactive", "", "ActiveState=active" ])
+        cmd = "{systemctl} stop zzb.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, testsleep+" [45]0"))
+        #
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_4062_status_files_are_replaced_atomically(self):
+        """ check that a status file is never seen partially by a reader
+            while it is rewritten - and that with SYSTEMCTL_SYNC_STATUS the folder
+            of the status files is synced once for the units started together """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = "SYSTEMCTL_SYNC_STATUS=1 " + cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        for name, seconds in [ ("zza", 40), ("zzb", 50) ]:
+            text_file(os_path(root, "/etc/systemd/system/%s.service" % name),"""
+                [Unit]
+                Description=Testing {name}
+                [Service]
+                Type=simple
+                ExecStart={bindir}/{testsleep} {seconds}
+                [Install]
+                WantedBy=multi-user.target
+                """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        status_file = os_path(root, "/var/run/zza.service.status")
+        python = _python
+        reader = os_path(testdir, "reader.py")
+        shell_file(reader, """
+            #! {python}
+            import os, sys, time
+            seen, short = 0, []
+            until = time.time() + float(sys.argv[2])
+            while time.time() < until:
+                try:
+                    f = open(sys.argv[1])
+                except IOError:
+                    continue
+                seen += 1
+                text = f.read()
+                if text.endswith("\\n") or len(short) > 100:
+                    f.close()
+                else:
+                    short.append((f, len(text)))
+            partial = [ f for f, size in short if os.fstat(f.fileno()).st_size > size ]
+            print("seen %s partial %s" % (seen, len(partial)))
+            """.format(**locals()))
+        #
+        cmd = "{systemctl} start zza.service zzb.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, out, err)
+        self.assertEqual(end, 0)
+        self.assertEqual(len(greps(err, "synced status folder .*/var/run")), 1)
+        self.assertFalse(glob(os_path(root, "/var/run/*.tmp")))
+        #
+        read = subprocess.Popen([ reader, status_file, "3" ], stdout=subprocess.PIPE)
+        for attempt in xrange(4):
+            cmd = "{systemctl} try-restart zza.service"
+            out, end = output2(cmd.format(**locals()))
+            self.assertEqual(end, 0)
+        result = read.communicate()[0].decode("utf-8").strip()
+        logg.info("reader: %s", result)
+        self.assertTrue(result.endswith(" partial 0"))
+        self.assertFalse(glob(os_path(root, "/var/run/*.tmp")))
+        #
+        cmd = "{systemctl} stop zza.service zzb.service -vvv"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, out, err)
+        self.assertEqual(end, 0)
+        self.assertEqual(len(greps(err, "synced status folder .*/var/run")), 1)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, testsleep+" [45]0"))
+        #
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
+    def test_4064_status_from_before_boot_time_is_ignored(self):
+        """ check that the boot time can be given by SYSTEMCTL_BOOT_TIME so
+            that a status file from before is seen as being left over
+            from a reboot (and it is truncated on the next check) """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        for name, seconds in [ ("zza", 40), ("zzb", 50) ]:
+            text_file(os_path(root, "/etc/systemd/system/%s.service" % name),"""
+                [Unit]
+                Description=Testing {name}
+                [Service]
+                Type=simple
+                ExecStart={bindir}/{testsleep} {seconds}
+                [Install]
+                WantedBy=multi-user.target
+                """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        status_file = os_path(root, "/var/run/zza.service.status")
         #
-        logg.info("== the next is-active shall then truncate it")
-        old_size = os.path.getsize(status_file)
-        is_activeXX = "{systemctl} is-active zzz.service other.service {vv} {vv}"
-        act, end = output2(is_activeXX.format(**locals()))
-        self.assertEqual(act.strip(), "inactive\nunknown")
-        self.assertEqual(end, 3)
-        self.assertTrue(os.path.exists(os_path(root, "/var/tmp/test.1")))
-        new_size = os.path.getsize(status_file)
-        logg.info("status-file size: old %s new %s", old_size, new_size)
-        self.assertGreater(old_size, 0)
-        self.assertEqual(new_size, 0)
+        cmd = "{systemctl} start zza.service zzb.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        self.assertGreater(os.path.getsize(status_file), 0)
+        time.sleep(1)
+        booted = time.time()
+        time.sleep(1)
+        cmd = "{systemctl} restart zzb.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        self.assertEqual(end, 0)
         #
-        logg.info("== 'stop' shall cleanup a service that was not inactive")
-        cmd = "{systemctl} stop zzz.service other.service -vv"
+        cmd = "SYSTEMCTL_BOOT_TIME={booted} {systemctl} list-units --no-legend zz*"
         out, end = output2(cmd.format(**locals()))
-        logg.info("%s =>\n%s", cmd, out)
-        self.assertNotEqual(end, 0)
-        act, end = output2(is_active.format(**locals()))
-        self.assertEqual(act.strip(), "inactive\nunknown")
-        self.assertEqual(end, 3)
-        self.assertFalse(os.path.exists(os_path(root, "/var/tmp/test.1")))
-        # and the status_file is also cleaned away
-        self.assertFalse(os.path.exists(status_file))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertTrue(greps(out, r"zza.service\s+loaded\s+inactive\s+dead"))
+        self.assertTrue(greps(out, r"zzb.service\s+loaded\s+active\s+running"))
+        self.assertEqual(os.path.getsize(status_file), 0)
+        cmd = "{systemctl} show zza.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(lines(out), [ "ActiveState=inactive" ])
         #
-        logg.info("LOG\n%s", " "+open(logfile).read().replace("\n","\n "))
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
         self.rm_testdir()
         self.coverage()
         self.end()
@@ -10596,6 +12345,59 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.end()
     def real_4090_simple_service_RemainAfterExit(self):
         self.test_4090_simple_service_RemainAfterExit(True)
+    def test_4066_simple_service_stop_waits_for_the_exit_only(self):
+        """ check that a stop of a simple service does not sleep a second
+            when the main process exits shortly after SIGTERM """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        shell_file(os_path(bindir, "zzz.sh"), """
+            #! /bin/sh
+            trap "sleep 0.2; exit 0" TERM
+            {bindir}/{testsleep} 111 &
+            wait
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzz.service"),"""
+            [Unit]
+            Description=Testing Z
+            [Service]
+            Type=simple
+            ExecStart={bindir}/zzz.sh
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        #
+        cmd = "{systemctl} start zzz.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, testsleep+" 111"))
+        #
+        started = time.time()
+        cmd = "{systemctl} stop zzz.service -vv"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        elapsed = time.time() - started
+        logg.info("elapsed %s", elapsed)
+        self.assertLess(elapsed, 0.8)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, testsleep+" 111"))
+        cmd = "{systemctl} show zzz.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(out.strip(), "ActiveState=inactive")
+        #
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
     def test_4090_simple_service_RemainAfterExit(self, real = None):
         """ check that we manage simple services in a root env
             with commands like start, restart, stop, etc where
@@ -11752,6 +13554,44 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.coverage()
         self.end()
+    def test_4170_systemctl_pidlist_of_process_tree(self):
+        """ check that the process tree is found from one /proc snapshot,
+            even with a program name that has spaces and parens """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        oddsleep = "sl) (eep"
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        copy_tool("/usr/bin/sleep", os_path(bindir, oddsleep))
+        shell_file(os_path(bindir, "tree"),"""
+            #! /bin/sh
+            "{bindir}/{oddsleep}" 77 &
+            sh -c "{bindir}/{testsleep} 78 & wait" &
+            wait
+            """.format(**locals()))
+        proc = subprocess.Popen([ os_path(bindir, "tree") ])
+        time.sleep(1)
+        #
+        cmd = "{systemctl} __pidlist_of {proc.pid}"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        pids = [ int(line) for line in lines(out) ]
+        self.assertEqual(pids[0], proc.pid)
+        self.assertEqual(len(pids), 4) # tree, oddsleep, sh, testsleep
+        top = output(_top_list)
+        logg.info("\n>>>\n%s", top)
+        for pid in pids:
+            self.assertTrue(greps(top, r"^\s*\S+\s+%s\s" % pid))
+        #
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        sx____("killall '{oddsleep}'".format(**locals()))
+        proc.wait()
+        self.rm_testdir()
+        self.coverage()
     def test_4201_systemctl_py_dependencies_plain_start_order(self):
         """ check list-dependencies - standard order of starting
             units is simply the command line order"""
@@ -11954,6 +13794,217 @@ class DockerSystemctlReplacementTest(unittest.TestCase):
         self.rm_testdir()
         self.coverage()
         self.end()
+    def test_4221_systemctl_py_dependencies_order_with_before_and_cycle(self):
+        """ check list-dependencies - the start order honors After and Before,
+            keeps the command line order for unrelated units, and an ordering
+            cycle is reported and broken at the first unit of the cycle """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            After=zzb.service
+            [Service]
+            ExecStart=/bin/sleep 3
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            ExecStart=/bin/sleep 3
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            Before=zzb.service
+            [Service]
+            ExecStart=/bin/sleep 3
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzd.service"),"""
+            [Unit]
+            Description=Testing D
+            [Service]
+            ExecStart=/bin/sleep 3
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zze.service"),"""
+            [Unit]
+            Description=Testing E
+            After=zzf.service
+            [Service]
+            ExecStart=/bin/sleep 3
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zzf.service"),"""
+            [Unit]
+            Description=Testing F
+            After=zze.service
+            [Service]
+            ExecStart=/bin/sleep 3
+            """)
+        #
+        cmd = "{systemctl} list-dependencies zza.service zzd.service zzb.service zzc.service --now"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        order = [ line.split()[0] for line in lines(out) ]
+        self.assertEqual(order, ["zzc.service", "zzb.service", "zza.service", "zzd.service"])
+        #
+        cmd = "{systemctl} list-dependencies zze.service zzf.service zzd.service --now"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, err, out)
+        self.assertEqual(end, 0)
+        self.assertTrue(greps(err, "ordering cycle between units: zze.service zzf.service"))
+        self.assertTrue(greps(err, "breaking the ordering cycle at zze.service"))
+        order = [ line.split()[0] for line in lines(out) ]
+        self.assertEqual(sorted(order), ["zzd.service", "zze.service", "zzf.service"])
+        self.rm_testdir()
+        self.coverage()
+    def test_4231_systemctl_py_parallel_start_with_jobs(self):
+        """ check that --jobs starts unrelated units at the same time
+            while an After= unit still waits for its predecessor """
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        logfile = os_path(root, "/var/log/test.log")
+        bindir = os_path(root, "/usr/bin")
+        shell_file(os_path(bindir, "logger"),"""
+            #! /bin/sh
+            sleep $2
+            echo "$1" >> {logfile}
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=oneshot
+            ExecStart={bindir}/logger start-A 2
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=oneshot
+            ExecStart={bindir}/logger start-B 2
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            After=zza.service
+            [Service]
+            Type=oneshot
+            ExecStart={bindir}/logger start-C 0
+            """.format(**locals()))
+        os.makedirs(os_path(root, "/var/run"))
+        os.makedirs(os_path(root, "/var/log"))
+        #
+        started = time.time()
+        cmd = "{systemctl} start zzc.service zza.service zzb.service --jobs 3"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        elapsed = time.time() - started
+        logg.info("elapsed %s", elapsed)
+        self.assertLess(elapsed, 3.5)
+        log = lines(open(logfile))
+        logg.info("logs \n| %s", "\n| ".join(log))
+        self.assertEqual(len(log), 3)
+        self.assertEqual(log[2], "start-C")
+        for unit in [ "zza.service", "zzb.service", "zzc.service" ]:
+            cmd = "{systemctl} show {unit} -p ActiveState"
+            out, end = output2(cmd.format(**locals()))
+            logg.info(" %s =>%s\n%s", cmd, end, out)
+            self.assertEqual(out.strip(), "ActiveState=active")
+        self.rm_testdir()
+        self.coverage()
+    def test_4232_systemctl_py_parallel_stop_with_jobs(self):
+        """ check that --jobs stops unrelated units at the same time
+            and that the shutdown timeout will kill the remaining ones """
+        self.begin()
+        testdir = self.testdir()
+        root = self.root(testdir)
+        systemctl = cover() + _systemctl_py + " --root=" + root
+        testsleep = self.testname("sleep")
+        bindir = os_path(root, "/usr/bin")
+        shell_file(os_path(bindir, "stopper"),"""
+            #! /bin/sh
+            sleep $1
+            kill $2
+            """)
+        text_file(os_path(root, "/etc/systemd/system/zza.service"),"""
+            [Unit]
+            Description=Testing A
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 40
+            ExecStop={bindir}/stopper 2 $MAINPID
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzb.service"),"""
+            [Unit]
+            Description=Testing B
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 41
+            ExecStop={bindir}/stopper 2 $MAINPID
+            """.format(**locals()))
+        text_file(os_path(root, "/etc/systemd/system/zzc.service"),"""
+            [Unit]
+            Description=Testing C
+            [Service]
+            Type=simple
+            ExecStart={bindir}/{testsleep} 42
+            ExecStop={bindir}/stopper 30 $MAINPID
+            """.format(**locals()))
+        copy_tool("/usr/bin/sleep", os_path(bindir, testsleep))
+        os.makedirs(os_path(root, "/var/run"))
+        os.makedirs(os_path(root, "/var/log"))
+        #
+        cmd = "{systemctl} start zza.service zzb.service zzc.service --jobs 3"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertTrue(greps(top, testsleep+" 40"))
+        self.assertTrue(greps(top, testsleep+" 41"))
+        self.assertTrue(greps(top, testsleep+" 42"))
+        #
+        started = time.time()
+        cmd = "{systemctl} stop zza.service zzb.service --jobs 3"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(end, 0)
+        elapsed = time.time() - started
+        logg.info("elapsed %s", elapsed)
+        self.assertLess(elapsed, 3.9) # not 4s as one after another
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, testsleep+" 40"))
+        self.assertFalse(greps(top, testsleep+" 41"))
+        self.assertTrue(greps(top, testsleep+" 42"))
+        #
+        started = time.time()
+        cmd = "SYSTEMCTL_MAXIMUM_TIMEOUT=3 {systemctl} stop zzc.service --jobs 3"
+        out, err, end = output3(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s\n%s", cmd, end, err, out)
+        self.assertNotEqual(end, 0)
+        self.assertTrue(greps(err, "units not stopped after 3s: zzc.service"))
+        elapsed = time.time() - started
+        logg.info("elapsed %s", elapsed)
+        self.assertLess(elapsed, 5.5)
+        top = _recent(output(_top_list))
+        logg.info("\n>>>\n%s", top)
+        self.assertFalse(greps(top, testsleep+" 42"))
+        self.assertFalse(greps(top, "stopper 30"))
+        cmd = "{systemctl} show zzc.service -p ActiveState"
+        out, end = output2(cmd.format(**locals()))
+        logg.info(" %s =>%s\n%s", cmd, end, out)
+        self.assertEqual(out.strip(), "ActiveState=inactive")
+        #
+        kill_testsleep = "killall {testsleep}"
+        sx____(kill_testsleep.format(**locals()))
+        self.rm_testdir()
+        self.coverage()
+        self.end()
     def test_4251_systemctl_py_dependencies_basic_reorder(self):
         """ check list-dependencies - standard order of starting
             units is simply the command line order (Before case)"""
@@ -0,0 +1,6 @@
+#! /bin/sh
+log=/root/package/tmp/tmp.test_3531/root/var/log/test.log
+date > "$log"
+pwd >> "$log"
+exec /root/package/tmp/tmp.test_3531/root/usr/bin/test_3531_sleep 111
+
@@ -0,0 +1,6 @@
+#! /bin/sh
+log=/root/package/tmp/tmp.test_3533/root/var/log/test.log
+date > "$log"
+pwd >> "$log"
+exec /root/package/tmp/tmp.test_3533/root/usr/bin/test_3533_sleep 111
+